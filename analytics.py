@@ -0,0 +1,308 @@
+"""Vectorized trade statistics over NumPy arrays.
+
+The trade columns are read straight from SQLite into a structured array with one query,
+without building ORM objects, and every statistic below is computed with array
+operations over that snapshot. History reads take archived trades (see archive.py) from
+the archived_trade view and then the hot trade table, which is already (date_entered, id)
+order since every archived trade of an account precedes its hot ones.
+"""
+import numpy as np
+
+TRADE_DTYPE = np.dtype([
+    ('actual_return', 'f8'),
+    ('risk', 'f8'),
+    ('actual_rr', 'f8'),
+    ('account_change', 'f8'),
+    ('account_balance', 'f8'),
+    ('date_entered', 'f8'),  # unix seconds
+    ('trade_setup_id', 'i8'),
+    ('market_id', 'i8'),
+])
+
+_TRADE_COLUMNS_SQL = """
+SELECT COALESCE(actual_return, 0), COALESCE(risk, 0), COALESCE(actual_rr, 0), COALESCE(account_change, 0),
+       COALESCE(account_balance, 0), julianday(date_entered),
+       trade_setup_id, market_id
+FROM {table}
+WHERE account_id = ? AND date_entered IS NOT NULL {filters}
+ORDER BY date_entered, id
+"""
+
+_BALANCE_SERIES_SQL = {
+    # End-of-day balances, one row per day with activity
+    'day': "SELECT julianday(date), balance FROM account_balance_log WHERE account_id = ? {filters} ORDER BY date",
+    # The balance after every trade
+    'trade': ("SELECT julianday(date_entered), COALESCE(account_balance, 0) FROM {table} "
+              "WHERE account_id = ? AND date_entered IS NOT NULL {filters} ORDER BY date_entered, id"),
+}
+_BALANCE_SERIES_COLUMN = {'day': 'date', 'trade': 'date_entered'}
+_BALANCE_SERIES_FORMAT = {'day': '%Y-%m-%d', 'trade': '%Y-%m-%d %H:%M:%S.%f'}
+
+R_MULTIPLE_BINS = np.array([-np.inf, -3, -2, -1.5, -1, -0.5, 0, 0.5, 1, 1.5, 2, 3, 5, np.inf])
+SECONDS_PER_YEAR = 365.25 * 24 * 3600
+JULIAN_DAY_UNIX_EPOCH = 2440587.5
+
+
+def _trade_tables(history):
+    return ('archived_trade', 'trade') if history else ('trade',)
+
+
+def load_trade_arrays(connection, account_id, start=None, end=None, history=False):
+    """Read one account's trade columns in (date_entered, id) order into a TRADE_DTYPE array.
+
+    `connection` is a DB-API sqlite3 connection; `start`/`end` are optional datetimes
+    bounding date_entered. history=True includes archived trades.
+    """
+    filters, params = "", [account_id]
+    if start is not None:
+        filters += " AND date_entered >= ?"
+        params.append(start.strftime('%Y-%m-%d %H:%M:%S.%f'))
+    if end is not None:
+        filters += " AND date_entered <= ?"
+        params.append(end.strftime('%Y-%m-%d %H:%M:%S.%f'))
+    cursor = connection.cursor()
+    try:
+        trades = np.concatenate([
+            np.fromiter(cursor.execute(_TRADE_COLUMNS_SQL.format(table=table, filters=filters), params),
+                        dtype=TRADE_DTYPE)
+            for table in _trade_tables(history)
+        ])
+    finally:
+        cursor.close()
+    # julianday() is a cheap C-side conversion; turn it into unix seconds here
+    trades['date_entered'] = (trades['date_entered'] - JULIAN_DAY_UNIX_EPOCH) * 86400
+    return trades
+
+
+def load_balance_series(connection, account_id, resolution='day', start=None, end=None, history=False):
+    """Read one account's equity curve as (unix seconds, balance) float arrays.
+
+    resolution 'day' reads the end-of-day balance log, which covers archived days too;
+    'trade' the balance after every trade, archived ones included with history=True.
+    """
+    column, date_format = _BALANCE_SERIES_COLUMN[resolution], _BALANCE_SERIES_FORMAT[resolution]
+    filters, params = "", [account_id]
+    if start is not None:
+        filters += f" AND {column} >= ?"
+        params.append(start.strftime(date_format))
+    if end is not None:
+        filters += f" AND {column} <= ?"
+        params.append(end.strftime(date_format))
+    cursor = connection.cursor()
+    try:
+        tables = _trade_tables(history) if resolution == 'trade' else (None,)
+        series = np.concatenate([
+            np.fromiter(cursor.execute(_BALANCE_SERIES_SQL[resolution].format(table=table, filters=filters), params),
+                        dtype=[('x', 'f8'), ('y', 'f8')])
+            for table in tables
+        ])
+    finally:
+        cursor.close()
+    return (series['x'] - JULIAN_DAY_UNIX_EPOCH) * 86400, series['y']
+
+
+def lttb(x, y, threshold):
+    """Indexes of the points kept by Largest-Triangle-Three-Buckets downsampling.
+
+    The first and last points are always kept; each bucket in between keeps the point that
+    forms the largest triangle with the previous kept point and the next bucket's average.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    # Averages of every bucket, with the last point standing in after the final bucket
+    sums_x, sums_y = np.add.reduceat(x[1:n - 1], edges[:-1] - 1), np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    sizes = np.diff(edges)
+    average_x = np.append(sums_x / sizes, x[-1])
+    average_y = np.append(sums_y / sizes, y[-1])
+
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        low, high = edges[bucket], edges[bucket + 1]
+        ax, ay = x[previous], y[previous]
+        areas = np.abs((ax - average_x[bucket + 1]) * (y[low:high] - ay)
+                       - (ax - x[low:high]) * (average_y[bucket + 1] - ay))
+        previous = low + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return kept
+
+
+def minmax_downsample(x, y, threshold):
+    """Indexes of the first and last point plus the lowest and highest point in each of
+    (threshold - 2) // 2 equal-count buckets."""
+    n = len(x)
+    if threshold >= n or threshold < 4:
+        return np.arange(n)
+    buckets = (threshold - 2) // 2
+    bucket_of = np.arange(n) * buckets // n
+    edges = np.flatnonzero(np.diff(bucket_of, prepend=-1))
+    # Sort by (bucket, value) once so each bucket's min and max are its first and last entries
+    order = np.lexsort((y, bucket_of))
+    ends = np.append(edges[1:], n) - 1
+    return np.unique(np.concatenate(([0, n - 1], order[edges], order[ends])))
+
+
+DOWNSAMPLERS = {'lttb': lttb, 'minmax': minmax_downsample}
+
+
+def downsample_series(x, y, threshold, method='lttb', unit='s'):
+    """Downsample a (unix seconds, value) series; returns ISO timestamp strings and values as lists."""
+    kept = DOWNSAMPLERS[method](x, y, threshold)
+    timestamps = np.datetime_as_string(np.round(x[kept]).astype('datetime64[s]'), unit=unit)
+    return timestamps.tolist(), y[kept].tolist()
+
+
+def _runs(mask):
+    """Start and end (exclusive) indexes of every run of True values in a boolean array."""
+    padded = np.concatenate(([False], mask, [False]))
+    edges = np.flatnonzero(np.diff(padded.astype(np.int8)))
+    return edges[0::2], edges[1::2]
+
+
+def drawdown_stats(balance, timestamps):
+    peak = np.maximum.accumulate(balance)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdown = np.where(peak > 0, balance / peak - 1, 0.0)
+    trough = int(np.argmin(drawdown))
+
+    starts, ends = _runs(balance < peak)
+    if len(starts):
+        lengths = ends - starts
+        longest = int(np.argmax(lengths))
+        # Time underwater runs from the peak before the run to the trade that recovers it
+        recovered = np.minimum(ends, len(balance) - 1)
+        durations = timestamps[recovered] - timestamps[np.maximum(starts - 1, 0)]
+        max_duration_trades = int(lengths[longest])
+        max_duration_days = float(durations.max()) / 86400
+    else:
+        max_duration_trades, max_duration_days = 0, 0.0
+
+    return {
+        "max_drawdown": float(drawdown[trough]),
+        "max_drawdown_amount": float(balance[trough] - peak[trough]),
+        "current_drawdown": float(drawdown[-1]),
+        "max_drawdown_duration_trades": max_duration_trades,
+        "max_drawdown_duration_days": max_duration_days,
+    }
+
+
+def ratio_stats(returns, timestamps):
+    mean = returns.mean()
+    std = returns.std(ddof=1) if len(returns) > 1 else 0.0
+    downside = np.sqrt(np.mean(np.minimum(returns, 0) ** 2))
+    span_years = (timestamps[-1] - timestamps[0]) / SECONDS_PER_YEAR
+    trades_per_year = len(returns) / span_years if span_years > 0 else None
+
+    sharpe = mean / std if std > 0 else None
+    sortino = mean / downside if downside > 0 else None
+    annualize = np.sqrt(trades_per_year) if trades_per_year else None
+    return {
+        "mean_return": float(mean),
+        "return_std": float(std),
+        "sharpe_per_trade": _number(sharpe),
+        "sortino_per_trade": _number(sortino),
+        "sharpe_annualized": _number(sharpe * annualize) if sharpe is not None and annualize else None,
+        "sortino_annualized": _number(sortino * annualize) if sortino is not None and annualize else None,
+        "trades_per_year": _number(trades_per_year),
+    }
+
+
+def pnl_stats(pnl, r_multiples):
+    wins, losses = pnl > 0, pnl < 0
+    gross_profit = pnl[wins].sum()
+    gross_loss = -pnl[losses].sum()
+    win_rate = wins.mean()
+    average_win = pnl[wins].mean() if wins.any() else 0.0
+    average_loss = -pnl[losses].mean() if losses.any() else 0.0
+    return {
+        "win_rate": float(win_rate * 100),
+        "expectancy": float(pnl.mean()),
+        "expectancy_r": float(r_multiples.mean()),
+        "average_win": float(average_win),
+        "average_loss": float(average_loss),
+        "payoff_ratio": _number(average_win / average_loss) if average_loss else None,
+        "gross_profit": float(gross_profit),
+        "gross_loss": float(gross_loss),
+        "profit_factor": _number(gross_profit / gross_loss) if gross_loss else None,
+    }
+
+
+def streak_stats(pnl):
+    win_starts, win_ends = _runs(pnl > 0)
+    loss_starts, loss_ends = _runs(pnl < 0)
+    current = 0
+    if len(win_ends) and win_ends[-1] == len(pnl):
+        current = int(win_ends[-1] - win_starts[-1])
+    elif len(loss_ends) and loss_ends[-1] == len(pnl):
+        current = -int(loss_ends[-1] - loss_starts[-1])
+    return {
+        "longest_win_streak": int((win_ends - win_starts).max()) if len(win_starts) else 0,
+        "longest_loss_streak": int((loss_ends - loss_starts).max()) if len(loss_starts) else 0,
+        "current_streak": current,  # positive for wins, negative for losses
+    }
+
+
+def r_multiple_distribution(r_multiples):
+    counts, _ = np.histogram(r_multiples, bins=R_MULTIPLE_BINS)
+    percentiles = np.percentile(r_multiples, [5, 25, 50, 75, 95])
+    return {
+        "bins": [{"from": _number(low), "to": _number(high), "count": int(count)}
+                 for low, high, count in zip(R_MULTIPLE_BINS[:-1], R_MULTIPLE_BINS[1:], counts)],
+        "percentiles": {f"p{p}": float(v) for p, v in zip((5, 25, 50, 75, 95), percentiles)},
+        "mean": float(r_multiples.mean()),
+    }
+
+
+def group_stats(keys, pnl, r_multiples):
+    """Trade count, win rate, total P&L and average R per group key, via bincount."""
+    groups, index = np.unique(keys, return_inverse=True)
+    counts = np.bincount(index)
+    wins = np.bincount(index, weights=(pnl > 0))
+    totals = np.bincount(index, weights=pnl)
+    r_totals = np.bincount(index, weights=r_multiples)
+    return {
+        int(group): {
+            "trades": int(count),
+            "win_rate": float(win / count * 100),
+            "total_pnl": float(total),
+            "average_r": float(r_total / count),
+        }
+        for group, count, win, total, r_total in zip(groups, counts, wins, totals, r_totals)
+    }
+
+
+def trade_statistics(trades):
+    """Full statistics suite for a TRADE_DTYPE array, or None when it is empty."""
+    if len(trades) == 0:
+        return None
+    pnl = trades['actual_return']
+    r_multiples = trades['actual_rr']
+    balance = trades['account_balance']
+    timestamps = trades['date_entered']
+
+    previous_balance = balance - trades['account_change']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.where(previous_balance != 0, trades['account_change'] / previous_balance, 0.0)
+
+    return {
+        "total_trades": int(len(trades)),
+        "average_risk": float(trades['risk'].mean()),
+        **pnl_stats(pnl, r_multiples),
+        **drawdown_stats(balance, timestamps),
+        **ratio_stats(returns, timestamps),
+        **streak_stats(pnl),
+        "r_multiple_distribution": r_multiple_distribution(r_multiples),
+        "by_setup": group_stats(trades['trade_setup_id'], pnl, r_multiples),
+        "by_market": group_stats(trades['market_id'], pnl, r_multiples),
+    }
+
+
+def _number(value):
+    """Plain float for JSON, with infinities and NaN mapped to None."""
+    if value is None:
+        return None
+    value = float(value)
+    return value if np.isfinite(value) else None
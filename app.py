@@ -1,22 +1,166 @@
 from flask import Flask, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
 from flask_migrate import Migrate
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, g, has_app_context, stream_with_context
+from sqlalchemy import bindparam, column, delete, event, func, insert, literal_column, table, text, tuple_, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import aliased, joinedload
+import analytics
+import archive
+import export
+import base64
+import binascii
+import click
+import csv
+import functools
+import hashlib
+import io
+import itertools
+import jobs
+import json
+import ledger
 import logging
-
-logging.basicConfig(level=logging.DEBUG)
+import math
+import os
+import perf
+import simulation
+import stream
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///trading_journal_new.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///trading_journal_new.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# Storage mode: 'default' keeps SQLite's stock settings, 'production' enables WAL, tuned
+# pragmas and a connection pool sized for several gunicorn workers and threads.
+app.config['STORAGE_MODE'] = os.environ.get('STORAGE_MODE', 'default')
+SQLITE_PRODUCTION_PRAGMAS = {
+    'journal_mode': 'WAL',          # readers no longer block the writer
+    'synchronous': 'NORMAL',        # fsync at checkpoints only; safe with WAL
+    'cache_size': -64000,           # 64 MB page cache per connection
+    'mmap_size': 268435456,         # 256 MB memory-mapped reads
+    'busy_timeout': 10000,          # wait up to 10s for the write lock instead of failing
+    'temp_store': 'MEMORY',
+}
+if app.config['STORAGE_MODE'] == 'production':
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': 30,
+        'connect_args': {'timeout': 10},
+    }
+
+# Request instrumentation (see perf.py): on by default; PROFILE_SAMPLE_RATE > 0 also profiles
+# that fraction of requests and keeps the captures of those slower than PROFILE_SLOW_MS.
+app.config['PERF_INSTRUMENTATION'] = os.environ.get('PERF_INSTRUMENTATION', '1') != '0'
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_SLOW_MS'] = float(os.environ.get('PROFILE_SLOW_MS', 500))
+if app.config['PERF_INSTRUMENTATION'] and app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    engine_options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    engine_options.setdefault('connect_args', {})['factory'] = perf.CountingConnection
+
+# Worker processes for Monte Carlo simulations (see simulation.py); 0 runs them in the request thread
+app.config['SIMULATION_WORKERS'] = int(os.environ.get('SIMULATION_WORKERS', os.cpu_count() or 1))
+# Background jobs (see jobs.py): jobs running at once and jobs waiting, per process
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_MAX_QUEUED'] = int(os.environ.get('JOB_MAX_QUEUED', 20))
+# Cold storage for old closed trades (see archive.py): unset disables archiving; trades
+# closed more than ARCHIVE_AFTER_DAYS ago are moved by `flask archive-trades` or the archive job
+app.config['ARCHIVE_DATABASE'] = os.environ.get('ARCHIVE_DATABASE')
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+# Live updates over /stream (see stream.py), per process: events buffered for clients to catch up
+# from, how often the event log is polled for other processes' writes, connected clients, and
+# seconds before a connection is closed for the client to reconnect. Under sync workers every
+# open stream holds a thread; run gunicorn with gevent workers (-k gevent) to make them greenlets.
+app.config['STREAM_BUFFER_SIZE'] = int(os.environ.get('STREAM_BUFFER_SIZE', 1000))
+app.config['STREAM_POLL_INTERVAL'] = float(os.environ.get('STREAM_POLL_INTERVAL', 0.5))
+app.config['STREAM_MAX_CLIENTS'] = int(os.environ.get('STREAM_MAX_CLIENTS', 100))
+app.config['STREAM_MAX_SECONDS'] = float(os.environ.get('STREAM_MAX_SECONDS', 300))
+
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 
-# Global Risk Percentage (default to 2%)
-global_risk_percentage = 0.02
+@event.listens_for(Engine, 'connect')
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    # Let SQLAlchemy emit BEGIN itself (see begin_sqlite_transaction) instead of pysqlite's
+    # implicit deferred BEGIN, so chain writes can take the write lock up front.
+    dbapi_connection.isolation_level = None
+    archive_pragmas = None
+    if app.config['STORAGE_MODE'] == 'production':
+        cursor = dbapi_connection.cursor()
+        for pragma, value in SQLITE_PRODUCTION_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+        cursor.close()
+        archive_pragmas = {pragma: SQLITE_PRODUCTION_PRAGMAS[pragma] for pragma in ('journal_mode', 'synchronous')}
+    # After the pragmas: setting temp_store drops the temp views this creates
+    archive.configure_connection(dbapi_connection, [c.name for c in Trade.__table__.c], app.config['ARCHIVE_DATABASE'],
+                                 archive_pragmas)
+
+@event.listens_for(Engine, 'begin')
+def begin_sqlite_transaction(conn):
+    if conn.dialect.name == 'sqlite':
+        conn.exec_driver_sql("BEGIN " + conn.get_execution_options().get('sqlite_begin', 'DEFERRED'))
+
+def begin_chain_write():
+    """Start the session's transaction with BEGIN IMMEDIATE.
+
+    Anything that reads the chain head and then writes after it must call this before its
+    first query. The write lock is taken up front, so concurrent writers in any worker
+    process queue on it instead of reading the same head and forking the chain.
+    """
+    db.session.connection(execution_options={'sqlite_begin': 'IMMEDIATE'})
+
+# Risk percentage and starting balance of a new account (default to 2% and 1000)
+DEFAULT_RISK_PERCENTAGE = 0.02
+STARTING_BALANCE = 1000
+
+# The account that requests without an account_id act on
+DEFAULT_ACCOUNT_ID = 1
+# Every account's chain is checkpointed after each CHECKPOINT_INTERVAL-th trade
+CHECKPOINT_INTERVAL = 256
 
 # Models
+# A trading account. Trades, cash flows, the daily balance log, rollups and metrics are all
+# kept per account. head_balance/head_pnl/head_ts/head_trades cache the end of the account's
+# balance chain: appends advance them in the same transaction as the write and rechains reset them,
+# so every worker process reads the current head from this row instead of the trade table.
+class Account(db.Model):
+    __tablename__ = 'account'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False, unique=True)
+    starting_balance = db.Column(db.Float, nullable=False, default=STARTING_BALANCE)
+    risk_percentage = db.Column(db.Float, nullable=False, default=DEFAULT_RISK_PERCENTAGE)
+    head_balance = db.Column(db.Float, nullable=False, default=STARTING_BALANCE)  # balance after the latest event
+    head_pnl = db.Column(db.Float, nullable=False, default=0)  # cumulative P&L after the latest trade
+    head_ts = db.Column(db.DateTime, nullable=True)  # latest trade or cash flow; anything before it is back-dated
+    head_trades = db.Column(db.Integer, nullable=False, default=0)  # trades in the chain
+    # The last archived trade (see archive.py): the chain up to it is read-only
+    archived_trades = db.Column(db.Integer, nullable=False, default=0)
+    archived_ts = db.Column(db.DateTime, nullable=True)
+    archived_trade_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+@event.listens_for(Account.__table__, 'after_create')
+def create_default_account(target, connection, **kw):
+    connection.execute(target.insert().values(
+        id=DEFAULT_ACCOUNT_ID, name='Default', starting_balance=STARTING_BALANCE,
+        risk_percentage=DEFAULT_RISK_PERCENTAGE, head_balance=STARTING_BALANCE, head_pnl=0, head_trades=0,
+        archived_trades=0, created_at=datetime.utcnow()
+    ))
+
 class TradeSetup(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False, unique=True)
@@ -24,9 +168,16 @@ class TradeSetup(db.Model):
 
 class Transaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False, default=DEFAULT_ACCOUNT_ID)
     amount = db.Column(db.Float, nullable=False)  # Positive for deposits, negative for withdrawals
     date = db.Column(db.DateTime, default=datetime.utcnow)
     type = db.Column(db.String(10), nullable=False)  # 'deposit' or 'withdrawal'
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # drives incremental exports
+
+    __table_args__ = (
+        db.Index('ix_transaction_account_date', 'account_id', 'date'),
+        db.Index('ix_transaction_updated_at', 'updated_at'),
+    )
 
 class Market(db.Model):
     __tablename__ = 'market'
@@ -36,8 +187,15 @@ class Market(db.Model):
 class AccountBalanceLog(db.Model):
     __tablename__ = 'account_balance_log'
     id = db.Column(db.Integer, primary_key=True)
-    date = db.Column(db.Date, nullable=False, unique=True)  # Ensure one entry per day
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False, default=DEFAULT_ACCOUNT_ID)
+    date = db.Column(db.Date, nullable=False)
     balance = db.Column(db.Float, nullable=False)  # Account balance for the day
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        # Ensure one entry per account and day; the unique index also serves date ranges
+        db.Index('ix_account_balance_log_account_date', 'account_id', 'date', unique=True),
+    )
 
 
 # This relationship will allow linking multiple setups to a trade if needed
@@ -49,6 +207,7 @@ trade_setups = db.Table('trade_setups',
 class Trade(db.Model):
     __tablename__ = 'trade'
     id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False, default=DEFAULT_ACCOUNT_ID)
     date_entered = db.Column(db.DateTime)
     date_exited = db.Column(db.DateTime, nullable=True)
     asset = db.Column(db.String(50), nullable=False)
@@ -72,24 +231,577 @@ class Trade(db.Model):
     pre_trade_notes = db.Column(db.Text, nullable=True)
     post_trade_notes = db.Column(db.Text, nullable=True)
     feelings_after_trade = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # drives incremental exports
+
+    # Matched to the access paths, each led by account_id so one account's queries never
+    # read another's rows: the chain and listings walk (date_entered, id), filtered
+    # listings seek by market/setup/asset within a date range, the metrics aggregate
+    # re-reads the extremes of actual_return after a delete, and incremental exports
+    # (which cover every account) select by updated_at.
+    __table_args__ = (
+        db.Index('ix_trade_account_date_entered', 'account_id', 'date_entered', 'id'),
+        db.Index('ix_trade_account_market_date', 'account_id', 'market_id', 'date_entered'),
+        db.Index('ix_trade_account_setup_date', 'account_id', 'trade_setup_id', 'date_entered'),
+        db.Index('ix_trade_account_asset_date', 'account_id', 'asset', 'date_entered'),
+        db.Index('ix_trade_account_actual_return', 'account_id', 'actual_return'),
+        db.Index('ix_trade_updated_at', 'updated_at'),
+    )
 
+# The per-connection temp views over the archive (see archive.py), declared on their own
+# metadata so create_all() leaves them alone. trade_history suits filtered aggregates and
+# full rebuilds; ordered reads go through ArchivedTrade and then Trade.
+_view_metadata = db.MetaData()
+def _trade_view(name):
+    table = db.Table(name, _view_metadata, *(db.Column(c.name, c.type) for c in Trade.__table__.c))
+    return aliased(Trade, table, adapt_on_names=True)
+ArchivedTrade = _trade_view('archived_trade')
+TradeHistory = _trade_view('trade_history')
+
+
+# Running aggregate behind /metrics, one row per account. Trade and transaction writes
+# update it in the same transaction so the endpoint never has to scan the trade table.
+class MetricsAggregate(db.Model):
+    __tablename__ = 'metrics_aggregate'
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), primary_key=True)
+    total_trades = db.Column(db.Integer, nullable=False, default=0)
+    winning_trades = db.Column(db.Integer, nullable=False, default=0)
+    sum_actual_return = db.Column(db.Float, nullable=False, default=0)
+    sum_planned_rr = db.Column(db.Float, nullable=False, default=0)
+    sum_actual_rr = db.Column(db.Float, nullable=False, default=0)
+    sum_account_change_percentage = db.Column(db.Float, nullable=False, default=0)
+    max_actual_return = db.Column(db.Float, nullable=True)
+    min_actual_return = db.Column(db.Float, nullable=True)
+    total_deposits = db.Column(db.Float, nullable=False, default=0)
+    total_withdrawals = db.Column(db.Float, nullable=False, default=0)
+
+class SetupTradeCount(db.Model):
+    __tablename__ = 'metrics_setup_count'
+    account_id = db.Column(db.Integer, primary_key=True)
+    trade_setup_id = db.Column(db.Integer, primary_key=True)
+    trade_count = db.Column(db.Integer, nullable=False, default=0)
+
+class MarketTradeCount(db.Model):
+    __tablename__ = 'metrics_market_count'
+    account_id = db.Column(db.Integer, primary_key=True)
+    market_id = db.Column(db.Integer, primary_key=True)
+    trade_count = db.Column(db.Integer, nullable=False, default=0)
+
+# Day, ISO-week and month P&L rollups per account, updated incrementally with every trade
+# and cash flow so calendar views read a handful of indexed rows instead of grouping trades.
+class PnlRollup(db.Model):
+    __tablename__ = 'pnl_rollup'
+    account_id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(5), primary_key=True)  # 'day', 'week' or 'month'
+    period_start = db.Column(db.Date, primary_key=True)  # the day, the ISO week's Monday, or the 1st
+    pnl = db.Column(db.Float, nullable=False, default=0)
+    trade_count = db.Column(db.Integer, nullable=False, default=0)
+    wins = db.Column(db.Integer, nullable=False, default=0)
+    losses = db.Column(db.Integer, nullable=False, default=0)
+    gross_profit = db.Column(db.Float, nullable=False, default=0)
+    gross_loss = db.Column(db.Float, nullable=False, default=0)
+    deposits = db.Column(db.Float, nullable=False, default=0)
+    withdrawals = db.Column(db.Float, nullable=False, default=0)
+    closing_balance = db.Column(db.Float, nullable=True)
+
+# The balance chain just after every CHECKPOINT_INTERVAL-th trade of an account. Point-in-time
+# queries seek the nearest checkpoint and replay at most one interval of trades from it;
+# appends add checkpoints as they pass them and rechains rewrite the ones after their anchor.
+class BalanceCheckpoint(db.Model):
+    __tablename__ = 'balance_checkpoint'
+    account_id = db.Column(db.Integer, primary_key=True)
+    trade_count = db.Column(db.Integer, primary_key=True)  # trades up to and including trade_id
+    ts = db.Column(db.DateTime, nullable=False)  # the trade's date_entered
+    trade_id = db.Column(db.Integer, nullable=False)
+    balance = db.Column(db.Float, nullable=False)
+    cumulative_pnl = db.Column(db.Float, nullable=False)
+    __table_args__ = (
+        db.Index('ix_balance_checkpoint_account_ts', 'account_id', 'ts', 'trade_id'),
+    )
 
-# Global Risk Percentage Management
+# Progress of a streamed trade import, committed with every chunk so an
+# interrupted import can resume after the last committed row.
+class TradeImport(db.Model):
+    __tablename__ = 'trade_import'
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(255), nullable=False, unique=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False, default=DEFAULT_ACCOUNT_ID)
+    status = db.Column(db.String(20), nullable=False, default='running')  # 'running' or 'completed'
+    rows_committed = db.Column(db.Integer, nullable=False, default=0)
+    trades_imported = db.Column(db.Integer, nullable=False, default=0)
+    rows_rejected = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# Per-table data version, bumped in the same transaction as any write to a cached table.
+# Read endpoints key their cached responses and ETags on these, so every worker process
+# sees an invalidation as soon as the write commits.
+class DataVersion(db.Model):
+    __tablename__ = 'data_version'
+    table_name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+# Background job: an expensive recompute or report run off the request thread. The partial
+# unique index lets only one queued or running job hold a dedup_key, across all processes.
+class Job(db.Model):
+    __tablename__ = 'job'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    params = db.Column(db.Text, nullable=False, default='{}')  # JSON
+    dedup_key = db.Column(db.String(255), nullable=False)
+    data_versions = db.Column(db.String(100), nullable=True)  # versions the result was computed at
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed, cancelled
+    progress = db.Column(db.Float, nullable=False, default=0)
+    message = db.Column(db.String(255), nullable=True)
+    result = db.Column(db.Text, nullable=True)  # JSON
+    error = db.Column(db.Text, nullable=True)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    owner = db.Column(db.String(100), nullable=False)  # host:pid of the process running it
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_job_active_dedup_key', 'dedup_key', unique=True,
+                 sqlite_where=text("status IN ('queued', 'running')")),
+        db.Index('ix_job_dedup_key', 'dedup_key', 'id'),
+        db.Index('ix_job_status', 'status'),
+    )
+
+
+# A change pushed to /stream clients, appended in the same transaction as the write it describes
+# (see publish_event). Autoincrement ids are never reused, so they order the log across processes.
+class StreamEvent(db.Model):
+    __tablename__ = 'stream_event'
+    id = db.Column(db.Integer, primary_key=True)
+    type = db.Column(db.String(50), nullable=False)
+    account_id = db.Column(db.Integer, nullable=True)  # None for markets and setups, which all accounts share
+    data = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = {'sqlite_autoincrement': True}
+
+
+# Full-text search over the journal notes. trade_fts is an FTS5 table keyed by trade id and
+# kept in sync by triggers, so every write path (ORM, bulk inserts, imports) maintains it.
+TRADE_SEARCH_COLUMNS = ('asset', 'setup_name', 'pre_trade_notes', 'post_trade_notes', 'feelings_after_trade')
+_TRADE_SEARCH_ROW = """
+    SELECT {trade}.id, {trade}.asset, (SELECT name FROM trade_setup WHERE id = {trade}.trade_setup_id),
+           {trade}.pre_trade_notes, {trade}.post_trade_notes, {trade}.feelings_after_trade
+"""
+TRADE_SEARCH_DDL = (
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS trade_fts USING fts5(
+        {', '.join(TRADE_SEARCH_COLUMNS)},
+        tokenize = 'porter unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS trade_fts_insert AFTER INSERT ON trade BEGIN
+        INSERT INTO trade_fts (rowid, {', '.join(TRADE_SEARCH_COLUMNS)}) {_TRADE_SEARCH_ROW.format(trade='new')};
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trade_fts_delete AFTER DELETE ON trade BEGIN
+        DELETE FROM trade_fts WHERE rowid = old.id;
+    END""",
+    # Balance rechains update other columns and do not fire this
+    f"""CREATE TRIGGER IF NOT EXISTS trade_fts_update
+    AFTER UPDATE OF asset, trade_setup_id, pre_trade_notes, post_trade_notes, feelings_after_trade ON trade BEGIN
+        DELETE FROM trade_fts WHERE rowid = old.id;
+        INSERT INTO trade_fts (rowid, {', '.join(TRADE_SEARCH_COLUMNS)}) {_TRADE_SEARCH_ROW.format(trade='new')};
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trade_fts_setup_rename AFTER UPDATE OF name ON trade_setup BEGIN
+        UPDATE trade_fts SET setup_name = new.name WHERE rowid IN (SELECT id FROM trade WHERE trade_setup_id = new.id);
+    END""",
+)
+
+@event.listens_for(db.metadata, 'after_create')
+def create_trade_search_index(target, connection, **kw):
+    if connection.dialect.name != 'sqlite':
+        return
+    for statement in TRADE_SEARCH_DDL:
+        connection.exec_driver_sql(statement)
+
+@event.listens_for(db.metadata, 'before_drop')
+def drop_trade_search_index(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql("DROP TABLE IF EXISTS trade_fts")
+
+
+# Response cache
+CACHED_TABLES = ('trade', 'transaction', 'market', 'trade_setup', 'account')
+app.config.setdefault('RESPONSE_CACHE_MAX_BYTES', int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024)))
+
+def mark_tables_changed(*tables):
+    """Record writes made outside the ORM unit of work (Core/text statements) for the version bump."""
+    db.session.info.setdefault('changed_tables', set()).update(tables)
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_changed_tables(session, flush_context):
+    changed = session.info.setdefault('changed_tables', set())
+    for instance in itertools.chain(session.new, session.dirty, session.deleted):
+        changed.add(instance.__table__.name)
+
+@event.listens_for(db.session, 'before_commit')
+def _bump_data_versions(session):
+    session.flush()
+    tables = sorted(session.info.pop('changed_tables', set()).intersection(CACHED_TABLES))
+    if tables:
+        table = DataVersion.__table__
+        stmt = sqlite_insert(table).values([{'table_name': name, 'version': 1} for name in tables])
+        stmt = stmt.on_conflict_do_update(index_elements=['table_name'], set_={'version': table.c.version + 1})
+        session.execute(stmt)
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_changed_tables(session):
+    session.info.pop('changed_tables', None)
+
+def current_data_versions(tables):
+    versions = dict(db.session.query(DataVersion.table_name, DataVersion.version)
+                    .filter(DataVersion.table_name.in_(tables)))
+    return tuple(versions.get(name, 0) for name in tables)
+
+class ResponseCache:
+    """Thread-safe LRU of serialized responses, bounded by total body bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, versions):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != versions:
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, versions, body, status, mimetype):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[1])
+            self.entries[key] = (versions, body, status, mimetype)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted[1])
+
+response_cache = ResponseCache(app.config['RESPONSE_CACHE_MAX_BYTES'])
+
+def cached_response(*tables):
+    """Serve a GET endpoint from memory while the given tables' data versions are unchanged.
+
+    The ETag is derived from the URL and the versions alone, so If-None-Match is answered
+    with 304 before the view runs. Streamed responses get the ETag but are not stored.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.full_path
+            versions = current_data_versions(tables)
+            etag = hashlib.sha1(f"{key}|{versions}".encode()).hexdigest()
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            entry = response_cache.get(key, versions)
+            if entry is not None:
+                response = Response(entry[1], status=entry[2], mimetype=entry[3])
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    response_cache.put(key, versions, response.get_data(), response.status_code, response.mimetype)
+            response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
+
+
+# Live updates
+STREAM_EVENT_RETENTION = 10000  # newest events kept in the log; older Last-Event-IDs get a reset
+STREAM_PRUNE_EVERY = 100  # events between prunes of the log
+STREAM_TRADE_ROWS = 100  # larger batches are announced without their rows
+STREAM_HEARTBEAT_SECONDS = 15
+STREAM_RETRY_MS = 2000
+
+def publish_event(event_type, data, account=None):
+    """Append an event for /stream clients to the current transaction; it is pushed once that commits.
+
+    Events about an account also carry its new balance and headline metrics, so publish them
+    after the write's chain and aggregate updates, right before the commit.
+    """
+    db.session.flush()
+    if account is not None:
+        # The aggregate is updated with Core statements; reload any copy the session holds
+        aggregate = db.session.get(MetricsAggregate, account.id)
+        if aggregate is not None:
+            db.session.refresh(aggregate)
+        result = aggregate_metrics(account)
+        data = {**data, 'account_id': account.id, 'balance': account.head_balance,
+                'metrics': result[0] if result is not None else None}
+    event_row = StreamEvent(type=event_type, account_id=account.id if account is not None else None,
+                            data=json.dumps(data))
+    db.session.add(event_row)
+    db.session.flush()
+    if event_row.id % STREAM_PRUNE_EVERY == 0:
+        db.session.execute(delete(StreamEvent).where(StreamEvent.id <= event_row.id - STREAM_EVENT_RETENTION))
+    db.session.info['stream_events'] = True
+
+def stream_trade_rows(account, trade_ids):
+    """The listing rows (as in /get_trades) of some of an account's trades, in chain order."""
+    rows = trade_listing_query({'account_id': account.id}).filter(Trade.id.in_(trade_ids)).all()
+    # Primary key lookups; a few rows are cheaper to order here than in a temp B-tree
+    return [trade_to_dict(row) for row in sorted(rows, key=lambda row: (row.date_entered, row.id))]
+
+def publish_trades(event_type, account, trade_ids, **data):
+    """publish_event() with the listing rows of the given trades, omitted for large batches."""
+    trades = stream_trade_rows(account, trade_ids) if len(trade_ids) <= STREAM_TRADE_ROWS else None
+    publish_event(event_type, {'trade_ids': list(trade_ids), 'trades': trades, **data}, account)
+
+@event.listens_for(db.session, 'after_commit')
+def _notify_stream(session):
+    if session.info.pop('stream_events', False):
+        stream_broadcaster.notify()
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_stream_events(session):
+    session.info.pop('stream_events', None)
+
+def fetch_stream_events(after_id, limit):
+    """Log rows after `after_id` in id order, or the newest `limit` when it is None (see stream.Broadcaster)."""
+    with app.app_context():
+        query = db.session.query(StreamEvent.id, StreamEvent.type, StreamEvent.account_id, StreamEvent.data)
+        if after_id is None:
+            rows = query.order_by(StreamEvent.id.desc()).limit(limit).all()[::-1]
+        else:
+            rows = query.filter(StreamEvent.id > after_id).order_by(StreamEvent.id).limit(limit).all()
+        return [tuple(row) for row in rows]
+
+stream_broadcaster = stream.Broadcaster(fetch_stream_events, app.config['STREAM_BUFFER_SIZE'],
+                                        app.config['STREAM_POLL_INTERVAL'], app.config['STREAM_MAX_CLIENTS'])
+
+@app.route('/stream', methods=['GET'])
+def stream_events():
+    """Server-Sent Events of committed changes to one account (account_id) and to the markets and setups.
+
+    Events: trades_added, trade_updated, trade_deleted (with the removed row), transaction_added
+    (each with the account's balance and headline metrics), market_added, market_deleted,
+    trade_setup_added and trade_setup_deleted. A client that reconnects with Last-Event-ID
+    (or passes last_event_id) is replayed what it missed; when that is no longer buffered,
+    or it falls too far behind, it gets a reset event and should refetch its state.
+    """
+    try:
+        account_id = requested_account_id()
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({"error": "account_id and last_event_id must be integers"}), 400
+    try:
+        stream_broadcaster.subscribe()
+    except stream.StreamFull:
+        response = jsonify({"error": "Too many open streams; try again later"})
+        response.headers['Retry-After'] = str(STREAM_RETRY_MS // 1000)
+        return response, 503
+
+    # Runs after the request's session is gone and never opens one: the broadcaster reads the log
+    def generate(position):
+        deadline = time.monotonic() + app.config['STREAM_MAX_SECONDS']
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        while time.monotonic() < deadline:
+            timeout = min(STREAM_HEARTBEAT_SECONDS, deadline - time.monotonic())
+            if position is None:
+                position = stream_broadcaster.head(timeout)
+                yield ": connected\n\n" if position is not None else ": waiting\n\n"
+                continue
+            events = stream_broadcaster.read(position, timeout)
+            if events is None:
+                position = stream_broadcaster.head(0)
+                yield stream.format_event(position, 'reset', json.dumps({'last_event_id': position}))
+            elif events:
+                position = events[-1].id
+                chunk = ''.join(stream.format_event(e.id, e.type, e.data) for e in events
+                                if e.account_id is None or e.account_id == account_id)
+                # A bare id moves the client's Last-Event-ID past other accounts' events
+                yield chunk or f"id: {position}\n\n"
+            else:
+                yield ": keepalive\n\n"
+
+    response = Response(generate(last_event_id), mimetype='text/event-stream')
+    # Also runs when the client goes away before the body started
+    response.call_on_close(stream_broadcaster.unsubscribe)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # keep proxies from buffering the stream
+    return response
+
+
+# Request instrumentation
+request_metrics = perf.RequestMetrics()
+profile_sampler = perf.ProfileSampler(app.config['PROFILE_SAMPLE_RATE'], app.config['PROFILE_SLOW_MS'] / 1000)
+
+def _request_sample():
+    return g.get('perf_sample') if has_app_context() else None
+
+def _count_rows(count):
+    sample = _request_sample()
+    if sample is not None:
+        sample['rows'] += count
+
+perf.CountingCursor.on_rows = _count_rows
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info['statement_started'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_statement_time(conn, cursor, statement, parameters, context, executemany):
+    sample = _request_sample()
+    if sample is not None:
+        sample['sql_statements'] += 1
+        sample['sql_seconds'] += time.perf_counter() - conn.info['statement_started']
+
+@app.before_request
+def start_request_sample():
+    if app.config['PERF_INSTRUMENTATION']:
+        g.perf_sample = {'started': time.perf_counter(), 'sql_statements': 0, 'sql_seconds': 0.0, 'rows': 0,
+                         'bytes': 0, 'profiler': profile_sampler.start()}
+
+def _count_streamed_bytes(chunks, sample):
+    try:
+        for chunk in chunks:
+            sample['bytes'] += len(chunk) if isinstance(chunk, bytes) else len(chunk.encode())
+            yield chunk
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+@app.after_request
+def finish_request_sample(response):
+    sample = g.get('perf_sample')
+    if sample is None:
+        return response
+    method, route, status = request.method, request.url_rule.rule if request.url_rule else '<unmatched>', response.status_code
+    if sample['profiler'] is not None:
+        profile_sampler.finish(sample['profiler'], method, request.full_path, time.perf_counter() - sample['started'])
+
+    def record():
+        sample['seconds'] = time.perf_counter() - sample['started']
+        request_metrics.observe(method, route, status, sample)
+
+    if response.is_streamed:
+        # Streamed bodies run after this hook, still counting SQL into the sample; record on close
+        response.response = _count_streamed_bytes(response.response, sample)
+        response.call_on_close(record)
+    else:
+        sample['bytes'] = response.calculate_content_length() or 0
+        record()
+    return response
+
+@app.route('/debug/perf', methods=['GET'])
+def debug_perf():
+    """Per-route request, SQL, row and response-size histograms in the Prometheus text format."""
+    return Response(request_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/debug/perf/profiles', methods=['GET'])
+def debug_perf_profiles():
+    """The most recent cProfile captures of sampled requests slower than PROFILE_SLOW_MS."""
+    return jsonify(list(profile_sampler.captures)), 200
+
+
+# Accounts
+def requested_account_id(data=None):
+    """The account a request acts on: account_id from the JSON body or query string, else the default.
+
+    Raises ValueError when the id is not an integer.
+    """
+    value = data.get('account_id') if isinstance(data, dict) else None
+    if value is None:
+        value = request.args.get('account_id')
+    if value is None or value == '':
+        return DEFAULT_ACCOUNT_ID
+    return int(value)
+
+def load_account(data=None):
+    """The requested Account as (account, None), or (None, error response)."""
+    try:
+        account_id = requested_account_id(data)
+    except (TypeError, ValueError):
+        return None, (jsonify({'error': 'account_id must be an integer'}), 400)
+    account = db.session.get(Account, account_id)
+    if account is None:
+        return None, (jsonify({'error': 'Account not found'}), 404)
+    return account, None
+
+def account_to_dict(account):
+    return {
+        'id': account.id,
+        'name': account.name,
+        'starting_balance': account.starting_balance,
+        'risk_percentage': account.risk_percentage,
+        'balance': account.head_balance,
+        'cumulative_pnl': account.head_pnl,
+        'last_activity': account.head_ts.isoformat(timespec='seconds') if account.head_ts else None,
+        'archived_trades': account.archived_trades,
+        'archived_through': account.archived_ts.isoformat(timespec='seconds') if account.archived_ts else None
+    }
+
+@app.route('/accounts', methods=['POST'])
+def add_account():
+    data = request.json
+    if not isinstance(data, dict) or not data.get('name'):
+        return jsonify({'error': "Account 'name' is required"}), 400
+    try:
+        starting_balance = float(data.get('starting_balance', STARTING_BALANCE))
+        risk_percentage = float(data.get('risk_percentage', DEFAULT_RISK_PERCENTAGE))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'starting_balance and risk_percentage must be numbers'}), 400
+    if starting_balance < 0:
+        return jsonify({'error': 'Starting balance must not be negative'}), 400
+    if not (0 < risk_percentage <= 1):
+        return jsonify({'error': 'Risk percentage must be between 0 and 1'}), 400
+
+    account = Account(name=data['name'], starting_balance=starting_balance, risk_percentage=risk_percentage,
+                      head_balance=starting_balance, head_pnl=0, head_trades=0)
+    db.session.add(account)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'An account with that name already exists'}), 409
+    return jsonify({'message': 'Account added successfully', 'account_id': account.id}), 201
+
+@app.route('/accounts', methods=['GET'])
+@cached_response('account')
+def get_accounts():
+    return jsonify([account_to_dict(account) for account in Account.query.order_by(Account.id)])
+
+# Risk Percentage Management
 @app.route('/set_risk', methods=['POST'])
 def set_risk():
-    global global_risk_percentage  # Ensure the variable is declared as global at the beginning
-    data = request.json
-    global_risk_percentage = data.get('risk_percentage')
+    data = request.json or {}
+    risk_percentage = data.get('risk_percentage')
 
-    if not (0 < global_risk_percentage <= 1):
+    if not isinstance(risk_percentage, (int, float)) or not (0 < risk_percentage <= 1):
         return jsonify({'error': 'Risk percentage must be between 0 and 1'}), 400
 
-    # Set risk percentage globally for this session
-    return jsonify({'message': f'Risk percentage set to {global_risk_percentage * 100}%'})
+    begin_chain_write()
+    account, error = load_account(data)
+    if error:
+        return error
+    account.risk_percentage = risk_percentage
+    db.session.commit()
+    return jsonify({'message': f'Risk percentage set to {risk_percentage * 100}%'})
 
 @app.route('/get_risk', methods=['GET'])
 def get_risk():
-    return jsonify({'risk_percentage': global_risk_percentage})
+    account, error = load_account()
+    if error:
+        return error
+    return jsonify({'risk_percentage': account.risk_percentage})
 
 # Tag Management Routes
 @app.route('/add_trade_setup', methods=['POST'])
@@ -103,11 +815,14 @@ def add_trade_setup():
             if 'name' in item and 'description' in item:
                 setup = TradeSetup(name=item['name'], description=item['description'])
                 db.session.add(setup)
-                setups.append(setup.name)
+                setups.append(setup)
             else:
                 return jsonify({"error": "Each setup object must include 'name' and 'description' fields"}), 400
 
+        db.session.flush()  # assigns the ids
+        publish_event('trade_setup_added', {'trade_setups': [trade_setup_to_dict(setup) for setup in setups]})
         db.session.commit()
+        setups = [setup.name for setup in setups]
         return jsonify({"message": "Trade setups added successfully", "setups": setups}), 201
 
     # Handle single setup addition
@@ -120,6 +835,8 @@ def add_trade_setup():
 
         setup = TradeSetup(name=setup_name, description=description)
         db.session.add(setup)
+        db.session.flush()  # assigns the ids
+        publish_event('trade_setup_added', {'trade_setups': [trade_setup_to_dict(setup)]})
         db.session.commit()
         return jsonify({"message": "Trade setup added successfully", "setup_id": setup.id}), 201
 
@@ -128,9 +845,12 @@ def add_trade_setup():
         return jsonify({"error": "Invalid data format. Expected a JSON object or list."}), 400
 
 @app.route('/get_trade_setups', methods=['GET'])
+@cached_response('trade_setup')
 def get_trade_setups():
-    setups = TradeSetup.query.all()
-    return jsonify([{'id': setup.id, 'name': setup.name, 'description': setup.description} for setup in setups])
+    return jsonify([trade_setup_to_dict(setup) for setup in TradeSetup.query.all()])
+
+def trade_setup_to_dict(setup):
+    return {'id': setup.id, 'name': setup.name, 'description': setup.description}
 
 @app.route('/delete_trade_setup', methods=['DELETE'])
 def delete_trade_setup():
@@ -140,6 +860,7 @@ def delete_trade_setup():
         return jsonify({'error': 'Trade setup not found'}), 404
 
     db.session.delete(setup)
+    publish_event('trade_setup_deleted', {'trade_setup_id': setup.id})
     db.session.commit()
     return jsonify({'message': 'Trade setup deleted successfully'})
 
@@ -155,11 +876,14 @@ def add_market():
             if 'name' in item:
                 market = Market(name=item['name'])
                 db.session.add(market)
-                markets.append(market.name)
+                markets.append(market)
             else:
                 return jsonify({"error": "Each market object must include a 'name' field"}), 400
 
+        db.session.flush()  # assigns the ids
+        publish_event('market_added', {'markets': [{'id': m.id, 'name': m.name} for m in markets]})
         db.session.commit()
+        markets = [market.name for market in markets]
         return jsonify({"message": f"Markets added successfully", "markets": markets}), 201
 
     # Handle single market addition
@@ -171,6 +895,8 @@ def add_market():
         # Create and add market
         market = Market(name=market_name)
         db.session.add(market)
+        db.session.flush()  # assigns the ids
+        publish_event('market_added', {'markets': [{'id': market.id, 'name': market.name}]})
         db.session.commit()
         return jsonify({"message": "Market added successfully", "market_id": market.id}), 201
 
@@ -180,6 +906,7 @@ def add_market():
 
 
 @app.route('/get_markets', methods=['GET'])
+@cached_response('market')
 def get_markets():
     markets = Market.query.all()
     return jsonify([{'id': m.id, 'name': m.name} for m in markets])
@@ -192,6 +919,7 @@ def delete_market():
         return jsonify({'error': 'Market not found'}), 404
 
     db.session.delete(market)
+    publish_event('market_deleted', {'market_id': market.id})
     db.session.commit()
     return jsonify({'message': 'Market deleted successfully'})
 
@@ -200,31 +928,47 @@ def delete_market():
 def add_trade():
     data = request.json
     trade_ids = []
+    begin_chain_write()
+    # A batch names its account in the query string, a single trade in its body or the query string
+    account, error = load_account(data)
+    if error:
+        return error
+    ensure_metrics_aggregate(account.id)
 
     # Handle batch addition if input is a list
     if isinstance(data, list):
-        for item in data:
-            try:
-                process_trade(item, trade_ids)
-            except KeyError as e:
-                return jsonify({"error": f"Missing required field: {str(e)}"}), 400
+        started = time.perf_counter()
+        trade_ids, errors = ingest_trades(account, data)
+        if trade_ids:
+            publish_trades('trades_added', account, trade_ids)
         db.session.commit()
-        return jsonify({"message": "Trades added successfully", "trade_ids": trade_ids}), 201
+        elapsed = time.perf_counter() - started
+        trades_per_second = len(trade_ids) / elapsed if elapsed > 0 else None
+        app.logger.info("Ingested %d trades (%d rejected) in %.3fs", len(trade_ids), len(errors), elapsed)
+
+        response = {"trade_ids": trade_ids, "errors": errors, "trades_per_second": trades_per_second}
+        if not trade_ids and errors:
+            return jsonify({"error": "No valid trades in batch", **response}), 400
+        return jsonify({"message": "Trades added successfully", **response}), 201
 
     # Handle single trade addition if input is a dictionary
     elif isinstance(data, dict):
         try:
-            process_trade(data, trade_ids)
+            process_trade(account, data, trade_ids)
+            publish_trades('trades_added', account, trade_ids)
             db.session.commit()
             return jsonify({"message": "Trade added successfully", "trade_id": trade_ids[0]}), 201
         except KeyError as e:
             return jsonify({"error": f"Missing required field: {str(e)}"}), 400
+        except ArchivedHistoryError as e:
+            return jsonify({"error": str(e)}), 400
 
     # Invalid format
     else:
         return jsonify({"error": "Invalid data format. Expected a JSON object or list."}), 400
 
-def process_trade(data, trade_ids):
+def trade_fields(data):
+    """Parse a trade payload into column values, leaving the balance chain fields to chain_trade()."""
     # Parse dates
     date_entered = datetime.strptime(data['date_entered'], "%Y-%m-%dT%H:%M:%S") if 'date_entered' in data and data['date_entered'] else datetime.utcnow()
     date_exited = datetime.strptime(data['date_exited'], "%Y-%m-%dT%H:%M:%S") if 'date_exited' in data and data['date_exited'] else None
@@ -235,108 +979,1284 @@ def process_trade(data, trade_ids):
     actual_return = data.get('actual_return', 0)
     planned_rr = (planned_return / risk) if risk > 0 else 0
     actual_rr = (actual_return / risk) if risk > 0 else 0
-
-    # Retrieve previous trade's balance and cumulative P&L
-    previous_trade = Trade.query.order_by(Trade.id.desc()).first()
-    previous_balance = previous_trade.account_balance if previous_trade else 1000  # Default starting balance
     result = data.get('result', 0)  # Result is the profit/loss from the trade
 
-    new_account_balance = previous_balance + result
-    cumulative_pnl = previous_trade.cumulative_pnl + result if previous_trade else result
-
-    # Create trade object
-    trade = Trade(
-        date_entered=date_entered,
-        date_exited=date_exited,
-        asset=data['asset'],
-        market_id=data['market_id'],
-        direction=data['direction'],
-        trade_setup_id=data['trade_setup_id'],
-        number_of_confluences=data['number_of_confluences'],
-        planned_rr=planned_rr,
-        planned_return=planned_return,
-        actual_rr=actual_rr,
-        actual_return=actual_return,
-        risk=risk,
-        position_size=data['position_size'],
-        roi_on_position=(result / risk * 100) if risk > 0 else 0,
-        account_change=result,
-        account_change_percentage=(result / previous_balance * 100) if previous_balance != 0 else 0,
-        cumulative_pnl=cumulative_pnl,
-        account_balance=new_account_balance,
-        pre_trade_notes=data.get('pre_trade_notes'),
-        post_trade_notes=data.get('post_trade_notes'),
-        feelings_after_trade=data.get('feelings_after_trade')
+    return {
+        'date_entered': date_entered,
+        'date_exited': date_exited,
+        'asset': data['asset'],
+        'market_id': data['market_id'],
+        'direction': data['direction'],
+        'trade_setup_id': data['trade_setup_id'],
+        'number_of_confluences': data['number_of_confluences'],
+        'planned_rr': planned_rr,
+        'planned_return': planned_return,
+        'actual_rr': actual_rr,
+        'actual_return': actual_return,
+        'risk': risk,
+        'position_size': data['position_size'],
+        'roi_on_position': (result / risk * 100) if risk > 0 else 0,
+        'account_change': result,
+        'pre_trade_notes': data.get('pre_trade_notes'),
+        'post_trade_notes': data.get('post_trade_notes'),
+        'feelings_after_trade': data.get('feelings_after_trade')
+    }
+
+def chain_trade(fields, previous_balance, previous_pnl):
+    """Link a trade onto the running balance chain; returns the new (balance, cumulative P&L)."""
+    result = fields['account_change']
+    fields['account_change_percentage'] = (result / previous_balance * 100) if previous_balance != 0 else 0
+    fields['cumulative_pnl'] = previous_pnl + result
+    fields['account_balance'] = previous_balance + result
+    return fields['account_balance'], fields['cumulative_pnl']
+
+def chain_head(account, before=None):
+    """Balance and cumulative P&L at the end of the account's chain, or just before `before`.
+
+    Trades are chained by (date_entered, id) and cash flows from Transaction are folded in
+    by date, so the head is the last trade plus any deposits/withdrawals recorded after it.
+    The end of the chain is cached on the Account row; only a point inside it is queried.
+    """
+    if before is None or account.head_ts is None or before > account.head_ts:
+        return account.head_balance, account.head_pnl
+
+    previous_trade = Trade.query.filter(Trade.account_id == account.id, Trade.date_entered < before).order_by(
+        Trade.date_entered.desc(), Trade.id.desc()
+    ).first()
+
+    if previous_trade is None:
+        # Nothing hot before it: continue from the start of the chain or the last archived trade
+        base_ts, base_balance, base_pnl = None, account.starting_balance, 0
+        boundary = archive_boundary(account)
+        if boundary is not None:
+            base_ts, base_balance, base_pnl = boundary.ts, boundary.balance, boundary.cumulative_pnl
+    else:
+        base_ts = previous_trade.date_entered
+        base_balance, base_pnl = previous_trade.account_balance, previous_trade.cumulative_pnl or 0
+
+    flows = db.session.query(func.coalesce(func.sum(Transaction.amount), 0)).filter(
+        Transaction.account_id == account.id, Transaction.date <= before
     )
+    if base_ts is not None:
+        flows = flows.filter(Transaction.date > base_ts)
+    return base_balance + flows.scalar(), base_pnl
+
+def archive_boundary(account):
+    """The checkpoint at the account's last archived trade, or None when nothing is archived."""
+    if not account.archived_trades:
+        return None
+    return db.session.get(BalanceCheckpoint, (account.id, account.archived_trades))
+
+class ArchivedHistoryError(ValueError):
+    """A write dated inside an account's archived history, which is read-only."""
+
+def check_not_archived(account, ts, flow=False):
+    """Raise ArchivedHistoryError if an event at `ts` would land at or before the last archived trade.
+
+    A cash flow at that trade's timestamp sorts before it, so it is refused as well.
+    """
+    if account.archived_ts is not None and (ts < account.archived_ts or flow and ts == account.archived_ts):
+        raise ArchivedHistoryError(f"{ts.isoformat(timespec='seconds')} falls in the archived history "
+                                   f"(through {account.archived_ts.isoformat(timespec='seconds')}), which is read-only")
+
+def next_trade_id():
+    """The id for the next new trade: one past any id held in the trade table or the archive.
+
+    Archived trades leave the trade table, so its own MAX(id) can fall back below theirs; a
+    new trade must never take an archived trade's id. Only safe inside a transaction started
+    with begin_chain_write(), which keeps other writers from taking the same ids.
+    """
+    newest = db.session.query(func.max(Trade.id)).scalar() or 0
+    if app.config['ARCHIVE_DATABASE']:
+        newest = max(newest, db.session.execute(text(archive.MAX_ID_SQL)).scalar() or 0)
+    return newest + 1
+
+def advance_chain_head(account, rows, trade_ids):
+    """Move the account's cached chain head past appended trades, chained rows in chain order.
+
+    Checkpoints the chain at every CHECKPOINT_INTERVAL-th trade passed; the head itself is
+    flushed with the caller's writes.
+    """
+    checkpoints = []
+    for fields, trade_id in zip(rows, trade_ids):
+        account.head_trades += 1
+        if account.head_trades % CHECKPOINT_INTERVAL == 0:
+            checkpoints.append({
+                'account_id': account.id, 'trade_count': account.head_trades, 'ts': fields['date_entered'],
+                'trade_id': trade_id, 'balance': fields['account_balance'], 'cumulative_pnl': fields['cumulative_pnl']
+            })
+    if checkpoints:
+        db.session.execute(insert(BalanceCheckpoint), checkpoints)
+    account.head_balance, account.head_pnl = rows[-1]['account_balance'], rows[-1]['cumulative_pnl']
+    if account.head_ts is None or rows[-1]['date_entered'] > account.head_ts:
+        account.head_ts = rows[-1]['date_entered']
+
+def process_trade(account, data, trade_ids):
+    fields = trade_fields(data)
+    check_not_archived(account, fields['date_entered'])
+    fields['account_id'] = account.id
+    back_dated = account.head_ts is not None and fields['date_entered'] < account.head_ts
+    new_account_balance, _ = chain_trade(fields, account.head_balance, account.head_pnl)
+
+    trade = Trade(id=next_trade_id(), **fields)
     db.session.add(trade)
+    db.session.flush()
     trade_ids.append(trade.id)
+    apply_metrics_delta(account.id, _metrics_delta([fields]))
+    apply_trade_rollups(account.id, [fields])
 
-    # Log daily balance
-    log_daily_balance(date_entered, new_account_balance)
+    if back_dated:
+        # Back-dated: relink this trade and everything after it
+        rechain_from(account, fields['date_entered'], trade.id)
+    else:
+        advance_chain_head(account, [fields], [trade.id])
+        # Log daily balance
+        log_daily_balance(account.id, fields['date_entered'], new_account_balance)
+
+def ingest_trades(account, items):
+    """Validate a batch up front and write every valid trade in one set of bulk statements.
+
+    The running balance and cumulative P&L start from the account's cached chain head and
+    are carried in memory, so the whole batch costs one executemany insert and one
+    daily-balance upsert. Must run in a transaction started with begin_chain_write().
+    Returns the new trade ids and a list of {'index', 'error'} entries for the rows that
+    were rejected.
+    """
+    market_ids = {market_id for (market_id,) in db.session.query(Market.id)}
+    setup_ids = {setup_id for (setup_id,) in db.session.query(TradeSetup.id)}
+
+    rows, errors = [], []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({"index": index, "error": "Each trade must be a JSON object"})
+            continue
+        try:
+            fields = trade_fields(item)
+        except KeyError as e:
+            errors.append({"index": index, "error": f"Missing required field: {str(e)}"})
+            continue
+        except (TypeError, ValueError) as e:
+            errors.append({"index": index, "error": f"Invalid value: {str(e)}"})
+            continue
+        if fields['market_id'] not in market_ids:
+            errors.append({"index": index, "error": f"Unknown market_id: {fields['market_id']}"})
+            continue
+        if fields['trade_setup_id'] not in setup_ids:
+            errors.append({"index": index, "error": f"Unknown trade_setup_id: {fields['trade_setup_id']}"})
+            continue
+        try:
+            check_not_archived(account, fields['date_entered'])
+        except ArchivedHistoryError as e:
+            errors.append({"index": index, "error": str(e)})
+            continue
+        fields['account_id'] = account.id
+        rows.append(fields)
+
+    if not rows:
+        return [], errors
+
+    tail = account.head_ts
+    in_order = all(a['date_entered'] <= b['date_entered'] for a, b in zip(rows, rows[1:]))
+    back_dated = not in_order or (tail is not None and rows[0]['date_entered'] < tail)
+
+    balance, pnl = account.head_balance, account.head_pnl
+    daily_balances = {}
+    for fields in rows:
+        balance, pnl = chain_trade(fields, balance, pnl)
+        daily_balances[fields['date_entered'].date()] = balance
+
+    # Ids are assigned here so the insert needs no RETURNING and goes out as a single executemany
+    first_id = next_trade_id()
+    trade_ids = list(range(first_id, first_id + len(rows)))
+    for trade_id, fields in zip(trade_ids, rows):
+        fields['id'] = trade_id
+    db.session.execute(insert(Trade), rows)
+    mark_tables_changed('trade')
+    apply_metrics_delta(account.id, _metrics_delta(rows))
+    apply_trade_rollups(account.id, rows)
+    if back_dated:
+        # The in-memory chain assumed append order; relink from the earliest row instead
+        rechain_from(account, min(fields['date_entered'] for fields in rows))
+    else:
+        advance_chain_head(account, rows, trade_ids)
+        upsert_daily_balances(account.id, daily_balances)
+    return trade_ids, errors
+
+# Streaming import
+IMPORT_BATCH_SIZE = 1000
+IMPORT_ERROR_LIMIT = 100  # errors echoed back; the full count is kept on the TradeImport row
+IMPORT_FLOAT_FIELDS = ('risk', 'planned_return', 'actual_return', 'result', 'position_size')
+IMPORT_INT_FIELDS = ('market_id', 'trade_setup_id', 'number_of_confluences')
+
+def read_import_records(stream, fmt):
+    """Yield one dict per CSV row or NDJSON line from a text stream without buffering the file.
+
+    Lines that cannot be decoded are yielded as ValueError instances so they count as rows.
+    """
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    elif fmt == 'ndjson':
+        for line in stream:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield ValueError(f"Invalid JSON: {str(e)}")
+    else:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+def _import_record(record, column_map, markets, setups):
+    """Map a broker record onto /add_trade fields, resolving market/setup names to ids."""
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError("Each record must be an object")
+    item = {}
+    for key, value in record.items():
+        if value is None or value == '':
+            continue
+        item[column_map.get(key, key)] = value
+
+    if 'market_id' not in item and 'market' in item:
+        if item['market'] not in markets:
+            raise ValueError(f"Unknown market: {item['market']}")
+        item['market_id'] = markets[item['market']]
+    if 'trade_setup_id' not in item and 'trade_setup' in item:
+        if item['trade_setup'] not in setups:
+            raise ValueError(f"Unknown trade setup: {item['trade_setup']}")
+        item['trade_setup_id'] = setups[item['trade_setup']]
+
+    for field in IMPORT_FLOAT_FIELDS:
+        if field in item:
+            item[field] = float(item[field])
+    for field in IMPORT_INT_FIELDS:
+        if field in item:
+            item[field] = int(item[field])
+    for field in ('date_entered', 'date_exited'):
+        if field in item:
+            item[field] = datetime.fromisoformat(str(item[field])).strftime("%Y-%m-%dT%H:%M:%S")
+    return item
+
+def import_trade_stream(records, source, account_id=DEFAULT_ACCOUNT_ID, column_map=None, batch_size=IMPORT_BATCH_SIZE,
+                        restart=False, on_chunk=None):
+    """Import trades into an account from an iterable of records in fixed-size committed chunks.
+
+    Progress is tracked per source on a TradeImport row; calling again with the same
+    source skips the rows already committed and keeps importing into the account it
+    started with. Only one chunk is held in memory at a time.
+    Returns the TradeImport row and up to IMPORT_ERROR_LIMIT row errors.
+    """
+    column_map = column_map or {}
+    markets = {name: market_id for market_id, name in db.session.query(Market.id, Market.name)}
+    setups = {name: setup_id for setup_id, name in db.session.query(TradeSetup.id, TradeSetup.name)}
+
+    job = TradeImport.query.filter_by(source=source).first()
+    if job is None:
+        job = TradeImport(source=source, account_id=account_id, status='running', rows_committed=0,
+                          trades_imported=0, rows_rejected=0)
+        db.session.add(job)
+    elif restart:
+        job.status, job.rows_committed, job.trades_imported, job.rows_rejected = 'running', 0, 0, 0
+        job.account_id = account_id
+        job.started_at = datetime.utcnow()
+    elif job.status == 'completed':
+        return job, []
+    # Read before the commit expires them, so no read transaction lingers
+    resume_from, account_id = job.rows_committed, job.account_id
+    db.session.commit()
 
+    records = iter(records)
+    for _ in itertools.islice(records, resume_from):
+        pass  # already committed by an earlier, interrupted run
+
+    errors = []
+    while True:
+        chunk = list(itertools.islice(records, batch_size))
+        if not chunk:
+            break
+        begin_chain_write()
+        account = db.session.get(Account, account_id)
+        ensure_metrics_aggregate(account_id)
+
+        items, positions, chunk_errors = [], [], []
+        for offset, record in enumerate(chunk):
+            row = job.rows_committed + offset
+            try:
+                items.append(_import_record(record, column_map, markets, setups))
+                positions.append(row)
+            except (TypeError, ValueError) as e:
+                chunk_errors.append({"row": row, "error": str(e)})
+
+        trade_ids, rejected = ingest_trades(account, items)
+        chunk_errors.extend({"row": positions[error['index']], "error": error['error']} for error in rejected)
+
+        job.rows_committed += len(chunk)
+        job.trades_imported += len(trade_ids)
+        job.rows_rejected += len(chunk_errors)
+        job.updated_at = datetime.utcnow()
+        db.session.commit()
 
+        errors.extend(chunk_errors[:IMPORT_ERROR_LIMIT - len(errors)])
+        if on_chunk:
+            on_chunk(job)
+            db.session.commit()  # end the read that refreshed job, so the next chunk's BEGIN IMMEDIATE is the first
+
+    job.status = 'completed'
+    job.updated_at = datetime.utcnow()
+    db.session.commit()
+    return job, errors
+
+def _import_format(fmt, filename, content_type):
+    if fmt:
+        return fmt
+    if (filename and filename.endswith('.csv')) or (content_type and 'csv' in content_type):
+        return 'csv'
+    return 'ndjson'
+
+@app.route('/import_trades', methods=['POST'])
+def import_trades():
+    """Stream a CSV or NDJSON request body into the journal.
+
+    Query parameters: source (resume key, required), account_id, format (csv or ndjson),
+    batch_size, restart, and repeated map=broker_column:trade_field pairs. With async=1 the
+    body is staged and imported by a background job; the response is the job (see /jobs).
+    """
+    source = request.args.get('source')
+    if not source:
+        return jsonify({"error": "An import 'source' key is required so the import can be resumed"}), 400
+    account, error = load_account()
+    if error:
+        return error
+    account_id = account.id
+    fmt = _import_format(request.args.get('format'), source, request.content_type)
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({"error": "Format must be 'csv' or 'ndjson'"}), 400
+    try:
+        batch_size = int(request.args.get('batch_size', IMPORT_BATCH_SIZE))
+    except ValueError:
+        return jsonify({"error": "batch_size must be an integer"}), 400
+    column_map = dict(pair.split(':', 1) for pair in request.args.getlist('map') if ':' in pair)
+    restart = request.args.get('restart') in ('1', 'true')
+
+    if request.args.get('async') in ('1', 'true'):
+        # Stage the body on disk and import it in a background job (see /jobs)
+        upload_dir = os.path.join(app.instance_path, 'job_uploads')
+        os.makedirs(upload_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile('wb', dir=upload_dir, suffix=f'.{fmt}', delete=False) as staged:
+            shutil.copyfileobj(request.stream, staged, 1024 * 1024)
+        params = {'path': staged.name, 'source': source, 'account_id': account_id, 'format': fmt,
+                  'column_map': column_map, 'batch_size': max(batch_size, 1), 'restart': restart}
+        job, created = submit_job('import_trades', params, dedup_key=f"import_trades:{source}")
+        if not created:
+            _discard_staged_upload(params)
+        return _job_submitted(job, created)
+
+    stream = io.TextIOWrapper(io.BufferedReader(request.stream), encoding='utf-8', newline='')
+    job, errors = import_trade_stream(
+        read_import_records(stream, fmt), source, account_id, column_map=column_map,
+        batch_size=max(batch_size, 1), restart=restart
+    )
+    return jsonify({
+        "import_id": job.id,
+        "status": job.status,
+        "rows_committed": job.rows_committed,
+        "trades_imported": job.trades_imported,
+        "rows_rejected": job.rows_rejected,
+        "errors": errors
+    }), 200
+
+
+# Trade listing
+TRADE_PAGE_SIZE = 100
+TRADE_PAGE_LIMIT = 1000
+TRADE_STREAM_CHUNK = 1000  # rows fetched per keyset step when streaming a full export
+
+def encode_trade_cursor(date_entered, trade_id):
+    raw = json.dumps([date_entered.isoformat(), trade_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_trade_cursor(cursor):
+    date_entered, trade_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return datetime.fromisoformat(date_entered), int(trade_id)
+
+def wants_history(args):
+    """Whether a request asked for archived trades as well as hot ones (include_archived=1)."""
+    return args.get('include_archived') in ('1', 'true')
+
+def filter_trades(query, args, model=Trade):
+    """Apply the account, date range, market, setup, direction and asset filters from request args."""
+    query = query.filter(model.account_id == int(args.get('account_id') or DEFAULT_ACCOUNT_ID))
+    if args.get('start'):
+        query = query.filter(model.date_entered >= datetime.fromisoformat(args['start']))
+    if args.get('end'):
+        query = query.filter(model.date_entered <= datetime.fromisoformat(args['end']))
+    if args.get('market_id'):
+        query = query.filter(model.market_id == int(args['market_id']))
+    if args.get('trade_setup_id'):
+        query = query.filter(model.trade_setup_id == int(args['trade_setup_id']))
+    if args.get('direction'):
+        query = query.filter(model.direction == args['direction'])
+    if args.get('asset'):
+        query = query.filter(model.asset == args['asset'])
+    return query
+
+def _keyset_page(query, after, limit, model=Trade):
+    if after is not None:
+        query = query.filter(tuple_(model.date_entered, model.id) > tuple_(*after))
+    return query.order_by(model.date_entered, model.id).limit(limit).all()
+
+def _keyset_pages(sources, after, limit):
+    """_keyset_page over each (query, model) in turn; an account's archived trades all precede its hot ones."""
+    rows = []
+    for query, model in sources:
+        rows += _keyset_page(query, after, limit - len(rows), model)
+        if len(rows) >= limit:
+            break
+    return rows
+
+def trade_listing_query(args, model=Trade):
+    """Trade columns with market and setup names joined in, so serializing a row issues no queries."""
+    query = db.session.query(
+        *(getattr(model, c.name) for c in Trade.__table__.c),
+        Market.name.label('market_name'),
+        TradeSetup.name.label('trade_setup_name')
+    ).outerjoin(Market, Market.id == model.market_id).outerjoin(TradeSetup, TradeSetup.id == model.trade_setup_id)
+    return filter_trades(query, args, model)
+
+def trade_listing_sources(args):
+    """(query, model) pairs to list in order: the archive first when history was asked for."""
+    models = (ArchivedTrade, Trade) if wants_history(args) else (Trade,)
+    return [(trade_listing_query(args, model), model) for model in models]
+
+def trade_to_dict(row):
+    return {
+        "id": row.id,
+        "date_entered": row.date_entered.isoformat(timespec='seconds') if row.date_entered else None,
+        "date_exited": row.date_exited.isoformat(timespec='seconds') if row.date_exited else None,
+        "asset": row.asset,
+        "market_name": row.market_name or "Unknown",  # Handle missing market
+        "direction": row.direction,
+        "trade_setup_name": row.trade_setup_name or "Unknown",  # Handle missing trade setup
+        "number_of_confluences": row.number_of_confluences,
+        "planned_rr": row.planned_rr,
+        "planned_return": row.planned_return,
+        "actual_rr": row.actual_rr,
+        "actual_return": row.actual_return,
+        "risk": row.risk,
+        "position_size": row.position_size,
+        "roi_on_position": row.roi_on_position,
+        "account_change": row.account_change,
+        "account_change_percentage": row.account_change_percentage,
+        "cumulative_pnl": row.cumulative_pnl,
+        "account_balance": row.account_balance,
+        "pre_trade_notes": row.pre_trade_notes,
+        "post_trade_notes": row.post_trade_notes,
+        "feelings_after_trade": row.feelings_after_trade
+    }
+
+def iter_trade_rows(sources, after=None, limit=None):
+    """Walk listing queries in keyset order one chunk at a time, never holding the full result.
+
+    Streamed responses run this after the view's session was already torn down, so the query
+    reopens that session; it is closed here to hand its connection and read transaction back.
+    """
+    remaining = limit
+    try:
+        while remaining is None or remaining > 0:
+            chunk_size = TRADE_STREAM_CHUNK if remaining is None else min(remaining, TRADE_STREAM_CHUNK)
+            rows = _keyset_pages(sources, after, chunk_size)
+            yield from rows
+            if len(rows) < chunk_size:
+                return
+            after = (rows[-1].date_entered, rows[-1].id)
+            if remaining is not None:
+                remaining -= len(rows)
+    finally:
+        sources[0][0].session.close()
 
 @app.route('/get_trades', methods=['GET'])
+@cached_response('trade', 'market', 'trade_setup')
 def get_trades():
-    trades = Trade.query.all()
-    trades_data = []
-    for trade in trades:
-        trades_data.append({
-            "id": trade.id,
-            "date_entered": trade.date_entered.strftime("%Y-%m-%dT%H:%M:%S") if trade.date_entered else None,
-            "date_exited": trade.date_exited.strftime("%Y-%m-%dT%H:%M:%S") if trade.date_exited else None,
-            "asset": trade.asset,
-            "market_name": trade.market.name if trade.market else "Unknown",  # Handle missing market
-            "direction": trade.direction,
-            "trade_setup_name": trade.trade_setup.name if trade.trade_setup else "Unknown",  # Handle missing trade setup
-            "number_of_confluences": trade.number_of_confluences,
-            "planned_rr": trade.planned_rr,
-            "planned_return": trade.planned_return,
-            "actual_rr": trade.actual_rr,
-            "actual_return": trade.actual_return,
-            "risk": trade.risk,
-            "position_size": trade.position_size,
-            "roi_on_position": trade.roi_on_position,
-            "account_change": trade.account_change,
-            "account_change_percentage": trade.account_change_percentage,
-            "cumulative_pnl": trade.cumulative_pnl,
-            "account_balance": trade.account_balance,
-            "pre_trade_notes": trade.pre_trade_notes,
-            "post_trade_notes": trade.post_trade_notes,
-            "feelings_after_trade": trade.feelings_after_trade
-        })
-    return jsonify(trades_data)
+    """List trades ordered by (date_entered, id).
+
+    Filters: account_id, start, end, market_id, trade_setup_id, direction, asset. Passing limit or cursor
+    returns one page plus a next_cursor; format=ndjson streams one trade per line; otherwise
+    the full JSON array is streamed in chunks. include_archived=1 lists archived trades too.
+    """
+    try:
+        sources = trade_listing_sources(request.args)
+        after = decode_trade_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+    except (TypeError, ValueError, binascii.Error):
+        return jsonify({"error": "Invalid filter, cursor or limit"}), 400
+
+    if request.args.get('format') == 'ndjson':
+        def generate_ndjson():
+            for row in iter_trade_rows(sources, after, limit):
+                yield json.dumps(trade_to_dict(row)) + "\n"
+        return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+
+    if limit is not None or after is not None:
+        limit = min(max(limit or TRADE_PAGE_SIZE, 1), TRADE_PAGE_LIMIT)
+        rows = _keyset_pages(sources, after, limit + 1)
+        next_cursor = encode_trade_cursor(rows[limit - 1].date_entered, rows[limit - 1].id) if len(rows) > limit else None
+        return jsonify({"trades": [trade_to_dict(row) for row in rows[:limit]], "next_cursor": next_cursor})
+
+    def generate_array():
+        yield "["
+        separator = ""
+        for row in iter_trade_rows(sources):
+            yield separator + json.dumps(trade_to_dict(row))
+            separator = ","
+        yield "]"
+    return Response(stream_with_context(generate_array()), mimetype='application/json')
+
+
+# Search
+SEARCH_PAGE_SIZE = 50
+SEARCH_PAGE_LIMIT = 500
+SEARCH_SNIPPET_TOKENS = 12
+trade_fts = table('trade_fts', column('rowid'), *(column(name) for name in TRADE_SEARCH_COLUMNS))
+
+@app.route('/search_trades', methods=['GET'])
+@cached_response('trade', 'market', 'trade_setup')
+def search_trades():
+    """Full-text search over asset, setup name and the three notes columns, best match first.
+
+    q uses FTS5 query syntax: words, "exact phrases", prefix*, AND/OR/NOT and column filters
+    such as feelings_after_trade:fomo. Combines with the /get_trades filters; limit and offset page.
+    sort=newest orders by trade id instead of relevance, which skips scoring every match and
+    stays fast for terms that appear in most notes. Only hot trades are indexed: archiving a
+    trade removes it from the index along with the trade row.
+    """
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({"error": "q is required"}), 400
+    sort = request.args.get('sort', 'rank')
+    if sort not in ('rank', 'newest'):
+        return jsonify({"error": "sort must be 'rank' or 'newest'"}), 400
+    try:
+        limit = min(int(request.args.get('limit', SEARCH_PAGE_SIZE)), SEARCH_PAGE_LIMIT)
+        offset = max(int(request.args.get('offset', 0)), 0)
+        query = trade_listing_query(request.args)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid filter or paging value"}), 400
+
+    fts = literal_column('trade_fts')
+    rank = literal_column('trade_fts.rank')  # bm25(); lower is a better match
+    query = query.join(trade_fts, trade_fts.c.rowid == Trade.id).filter(fts.match(q)).add_columns(
+        func.snippet(fts, -1, '<mark>', '</mark>', '…', SEARCH_SNIPPET_TOKENS).label('snippet'),
+        rank.label('rank')
+    ).order_by(rank if sort == 'rank' else trade_fts.c.rowid.desc()).limit(limit).offset(offset)
+    try:
+        rows = query.all()
+    except OperationalError as e:
+        db.session.rollback()
+        return jsonify({"error": f"Invalid search query: {e.orig}"}), 400
+
+    return jsonify({
+        "results": [{**trade_to_dict(row), "snippet": row.snippet, "score": -row.rank} for row in rows],
+        "next_offset": offset + limit if len(rows) == limit else None
+    }), 200
+
+def rebuild_trade_search_index():
+    """Create the search table and triggers if needed and re-index every trade."""
+    connection = db.session.connection()
+    for statement in TRADE_SEARCH_DDL:
+        connection.exec_driver_sql(statement)
+    db.session.execute(text("DELETE FROM trade_fts"))
+    db.session.execute(text(
+        f"INSERT INTO trade_fts (rowid, {', '.join(TRADE_SEARCH_COLUMNS)}) {_TRADE_SEARCH_ROW.format(trade='trade')} FROM trade"
+    ))
+    db.session.execute(text("INSERT INTO trade_fts (trade_fts) VALUES ('optimize')"))
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Build the trade notes search index, e.g. for a database created before it existed."""
+    started = time.perf_counter()
+    rebuild_trade_search_index()
+    db.session.commit()
+    click.echo(f"Indexed {Trade.query.count()} trades in {time.perf_counter() - started:.2f}s.")
 
 
 @app.route('/delete_trade/<int:trade_id>', methods=['DELETE'])
 def delete_trade(trade_id):
+    begin_chain_write()
     trade = Trade.query.get(trade_id)
     if not trade:
         return jsonify({'error': 'Trade not found'}), 404  # Trade not found
 
+    account = db.session.get(Account, trade.account_id)
+    ensure_metrics_aggregate(account.id)
+    delta = _metrics_delta([{field: getattr(trade, field) for field in METRIC_FIELDS}])
+    position = (trade.date_entered, trade.id)
+    # Serialized before it goes, so stream clients can take it out of their own totals
+    removed = stream_trade_rows(account, [trade_id])
+    apply_trade_rollups(account.id, [{'date_entered': trade.date_entered, 'account_change': trade.account_change}],
+                        sign=-1)
     db.session.delete(trade)
+    db.session.flush()
+    apply_metrics_delta(account.id, delta, sign=-1)
+    rechained = rechain_from(account, *position)
+    publish_event('trade_deleted', {'trade_id': trade_id, 'trade': removed[0], 'rechained_trades': rechained}, account)
     db.session.commit()
-    return jsonify({'message': 'Trade deleted successfully'}), 200
+    return jsonify({'message': 'Trade deleted successfully', 'rechained_trades': rechained}), 200
 
-def log_daily_balance(date, balance):
-    # This function should correctly update or create a balance log for the day
-    balance_log = AccountBalanceLog.query.filter_by(date=date.date()).first()
-    if balance_log:
-        balance_log.balance = balance  # Update existing log
-    else:
-        new_log = AccountBalanceLog(date=date.date(), balance=balance)  # Create new log
-        db.session.add(new_log)
-    db.session.commit()
+@app.route('/update_trade/<int:trade_id>', methods=['PUT'])
+def update_trade(trade_id):
+    begin_chain_write()
+    trade = Trade.query.get(trade_id)
+    if not trade:
+        return jsonify({'error': 'Trade not found'}), 404
 
-if __name__ == '__main__':
-    app.run(debug=True)
+    data = request.json
+    if not isinstance(data, dict):
+        return jsonify({"error": "Invalid data format. Expected a JSON object."}), 400
+
+    # Start from the stored trade so partial updates keep every other field
+    current = {
+        'date_entered': trade.date_entered.strftime("%Y-%m-%dT%H:%M:%S") if trade.date_entered else None,
+        'date_exited': trade.date_exited.strftime("%Y-%m-%dT%H:%M:%S") if trade.date_exited else None,
+        'result': trade.account_change or 0
+    }
+    for column in ('asset', 'market_id', 'direction', 'trade_setup_id', 'number_of_confluences', 'planned_return',
+                   'actual_return', 'risk', 'position_size', 'pre_trade_notes', 'post_trade_notes',
+                   'feelings_after_trade'):
+        current[column] = getattr(trade, column)
+    current.update(data)
+    try:
+        fields = trade_fields(current)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid value: {str(e)}"}), 400
 
+    account = db.session.get(Account, trade.account_id)
+    try:
+        check_not_archived(account, fields['date_entered'])
+    except ArchivedHistoryError as e:
+        return jsonify({"error": str(e)}), 400
+    ensure_metrics_aggregate(account.id)
+    old_metrics = {field: getattr(trade, field) for field in METRIC_FIELDS}
+    new_metrics = {field: fields.get(field) for field in METRIC_FIELDS}
+    # rechain_from() accounts for the change in account_change_percentage
+    old_metrics['account_change_percentage'] = new_metrics['account_change_percentage'] = 0
+    old_rollup = {'date_entered': trade.date_entered, 'account_change': trade.account_change}
+
+    start = min(trade.date_entered, fields['date_entered'])
+    for column, value in fields.items():
+        setattr(trade, column, value)
+    # Flushed first: removing the old values re-reads the extremes when the trade held one,
+    # and that re-read has to see the edited row
+    db.session.flush()
+    apply_metrics_delta(account.id, _metrics_delta([old_metrics]), sign=-1)
+    apply_trade_rollups(account.id, [old_rollup], sign=-1)
+    apply_metrics_delta(account.id, _metrics_delta([new_metrics]))
+    apply_trade_rollups(account.id, [fields])
+    rechained = rechain_from(account, start)
+    publish_trades('trade_updated', account, [trade_id], rechained_trades=rechained)
+    db.session.commit()
+    return jsonify({'message': 'Trade updated successfully', 'rechained_trades': rechained}), 200
+
+def log_daily_balance(account_id, date, balance):
+    # Record the end-of-day balance; the caller commits
+    upsert_daily_balances(account_id, {date.date(): balance})
+
+def _parse_timestamp(value):
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S") if value else datetime.utcnow()
+
+def upsert_daily_balances(account_id, balances):
+    """Insert or overwrite one AccountBalanceLog row per date in a single executemany."""
+    if not balances:
+        return
+    stmt = sqlite_insert(AccountBalanceLog.__table__)
+    stmt = stmt.on_conflict_do_update(index_elements=['account_id', 'date'], set_={
+        'balance': stmt.excluded.balance, 'updated_at': stmt.excluded.updated_at
+    })
+    now = datetime.utcnow()
+    db.session.execute(stmt, [{'account_id': account_id, 'date': date, 'balance': balance, 'updated_at': now}
+                              for date, balance in balances.items()])
+    refresh_rollup_balances(account_id, min(balances))
+
+# Ledger recompute
+# One account's trades and cash flows merged into one stream ordered by (timestamp, kind,
+# id), with cash flows (kind 0) ahead of trades (kind 1) at the same timestamp. Running
+# sums are seeded from the anchor, the last trade whose chain values are still valid. The
+# suffix is materialized once into a temp table and shared by the trade and daily-log
+# rewrites and the chain head refresh.
+_CHAIN_SUFFIX = """
+CREATE TEMP TABLE chain_suffix AS
+WITH events AS (
+    SELECT date_entered AS ts, 1 AS kind, id, COALESCE(account_change, 0) AS pnl, 0 AS flow
+    FROM trade WHERE account_id = :account_id AND (date_entered, id) > (:anchor_ts, :anchor_id)
+    UNION ALL
+    SELECT date, 0, id, 0, amount FROM "transaction" WHERE account_id = :account_id AND date > :anchor_ts
+)
+SELECT ts, kind, id, pnl,
+       :base_pnl + SUM(pnl) OVER chain AS cumulative_pnl,
+       :base_balance + SUM(pnl + flow) OVER chain AS balance,
+       :base_trades + SUM(kind) OVER chain AS trade_count
+FROM events
+WINDOW chain AS (ORDER BY ts, kind, id ROWS UNBOUNDED PRECEDING)
+"""
+
+_RECHAIN_TRADES = """
+UPDATE trade SET
+    cumulative_pnl = chain_suffix.cumulative_pnl,
+    account_balance = chain_suffix.balance,
+    account_change_percentage = CASE WHEN chain_suffix.balance - chain_suffix.pnl != 0
+        THEN chain_suffix.pnl * 100.0 / (chain_suffix.balance - chain_suffix.pnl) ELSE 0 END,
+    updated_at = :now
+FROM chain_suffix
+WHERE chain_suffix.kind = 1 AND trade.id = chain_suffix.id
+  AND (trade.cumulative_pnl IS NOT chain_suffix.cumulative_pnl OR trade.account_balance IS NOT chain_suffix.balance)
+"""
+
+_RECHAIN_DAILY_BALANCES = """
+INSERT INTO account_balance_log (account_id, date, balance, updated_at)
+SELECT :account_id, day, balance, :now FROM (
+    SELECT date(ts) AS day, balance,
+           ROW_NUMBER() OVER (PARTITION BY date(ts) ORDER BY ts DESC, kind DESC, id DESC) AS position
+    FROM (
+        SELECT ts, kind, id, balance FROM chain_suffix
+        UNION ALL
+        SELECT :anchor_ts, 1, :anchor_id, :base_balance WHERE :has_anchor
+    )
+) WHERE position = 1
+"""
+
+_SUFFIX_PERCENTAGE_SUM = """
+SELECT COALESCE(SUM(account_change_percentage), 0) FROM trade
+WHERE account_id = :account_id AND (date_entered, id) > (:anchor_ts, :anchor_id)
+"""
+
+_CHAIN_SUFFIX_HEAD = """
+SELECT balance, cumulative_pnl, ts, trade_count FROM chain_suffix ORDER BY ts DESC, kind DESC, id DESC LIMIT 1
+"""
+
+_RECHAIN_CHECKPOINTS = """
+INSERT INTO balance_checkpoint (account_id, trade_count, ts, trade_id, balance, cumulative_pnl)
+SELECT :account_id, trade_count, ts, id, balance, cumulative_pnl FROM chain_suffix
+WHERE kind = 1 AND trade_count % :interval = 0
+"""
+
+def chain_trade_count(account_id, ts, trade_id):
+    """Trades of the account's chain up to and including (ts, trade_id).
+
+    Counted from the nearest checkpoint at or before that point, so at most one
+    checkpoint interval of trades is read.
+    """
+    position = tuple_(ts, trade_id)
+    checkpoint = BalanceCheckpoint.query.filter(
+        BalanceCheckpoint.account_id == account_id, tuple_(BalanceCheckpoint.ts, BalanceCheckpoint.trade_id) <= position
+    ).order_by(BalanceCheckpoint.ts.desc(), BalanceCheckpoint.trade_id.desc()).first()
+    query = db.session.query(func.count(Trade.id)).filter(
+        Trade.account_id == account_id, tuple_(Trade.date_entered, Trade.id) <= position
+    )
+    if checkpoint is None:
+        return query.scalar()
+    query = query.filter(tuple_(Trade.date_entered, Trade.id) > tuple_(checkpoint.ts, checkpoint.trade_id))
+    return checkpoint.trade_count + query.scalar()
+
+def rechain_from(account, ts, trade_id=0):
+    """Relink the account's balance chain from the event at (ts, trade_id) onward.
+
+    Only the suffix after the last unaffected trade is rewritten, with one window-function
+    UPDATE for the trades and one INSERT each for the daily balance log and the balance
+    checkpoints. Returns the number of trade rows touched.
+    """
+    anchor = Trade.query.filter(
+        Trade.account_id == account.id, tuple_(Trade.date_entered, Trade.id) < tuple_(ts, trade_id)
+    ).order_by(Trade.date_entered.desc(), Trade.id.desc()).first()
+    return rechain(account, anchor)
+
+def rechain(account, anchor=None):
+    """Recompute every trade of the account after `anchor` (or every hot trade when None).
+
+    Also resets the account's cached chain head and rewrites its checkpoints after the
+    anchor. Returns the number of trade rows touched.
+    """
+    db.session.flush()
+    # Archived trades are never relinked: without a hot anchor the chain resumes after them
+    boundary = archive_boundary(account) if anchor is None else None
+    if boundary is not None:
+        params = {'anchor_ts': boundary.ts, 'anchor_id': boundary.trade_id, 'base_pnl': boundary.cumulative_pnl,
+                  'base_balance': boundary.balance, 'base_trades': boundary.trade_count, 'has_anchor': 1}
+    elif anchor is None:
+        params = {'anchor_ts': datetime.min, 'anchor_id': 0, 'base_pnl': 0,
+                  'base_balance': account.starting_balance, 'base_trades': 0, 'has_anchor': 0}
+    else:
+        params = {'anchor_ts': anchor.date_entered, 'anchor_id': anchor.id, 'base_pnl': anchor.cumulative_pnl or 0,
+                  'base_balance': anchor.account_balance,
+                  'base_trades': chain_trade_count(account.id, anchor.date_entered, anchor.id), 'has_anchor': 1}
+    params['account_id'] = account.id
+    params['interval'] = CHECKPOINT_INTERVAL
+    params['now'] = datetime.utcnow()
+    binds = [bindparam('anchor_ts', type_=db.DateTime)]
+    now_bind = bindparam('now', type_=db.DateTime)
+
+    percentage_sum = text(_SUFFIX_PERCENTAGE_SUM).bindparams(*binds)
+    percentage_before = db.session.execute(percentage_sum, params).scalar()
+
+    db.session.execute(text("DROP TABLE IF EXISTS temp.chain_suffix"))
+    db.session.execute(text(_CHAIN_SUFFIX).bindparams(*binds), params)
+    # Only rows whose balances actually moved are rewritten (and stamped for incremental exports)
+    touched = db.session.execute(text(_RECHAIN_TRADES).bindparams(now_bind), params).rowcount
+    if touched:
+        mark_tables_changed('trade')
+    db.session.execute(delete(AccountBalanceLog).where(
+        AccountBalanceLog.account_id == account.id, AccountBalanceLog.date >= params['anchor_ts'].date()
+    ))
+    db.session.execute(text(_RECHAIN_DAILY_BALANCES).bindparams(*binds, now_bind), params)
+    db.session.execute(delete(BalanceCheckpoint).where(
+        BalanceCheckpoint.account_id == account.id, BalanceCheckpoint.trade_count > params['base_trades']
+    ))
+    db.session.execute(text(_RECHAIN_CHECKPOINTS), params)
+
+    # The chain head is the suffix's last event, or the anchor when nothing follows it
+    head = db.session.execute(text(_CHAIN_SUFFIX_HEAD).columns(
+        column('balance', db.Float), column('cumulative_pnl', db.Float), column('ts', db.DateTime),
+        column('trade_count', db.Integer)
+    )).first()
+    if head is None:
+        head = (params['base_balance'], params['base_pnl'], params['anchor_ts'] if params['has_anchor'] else None,
+                params['base_trades'])
+    db.session.execute(update(Account).where(Account.id == account.id).values(
+        head_balance=head[0], head_pnl=head[1], head_ts=head[2], head_trades=head[3]
+    ))
+    mark_tables_changed('account')
+    db.session.execute(text("DROP TABLE temp.chain_suffix"))
+    refresh_rollup_balances(account.id, params['anchor_ts'].date())
+
+    percentage_after = db.session.execute(percentage_sum, params).scalar()
+
+    # account_change_percentage is part of the metrics aggregate
+    agg = MetricsAggregate.__table__.c
+    db.session.execute(update(MetricsAggregate).where(agg.account_id == account.id).values(
+        sum_account_change_percentage=agg.sum_account_change_percentage + (percentage_after - percentage_before)
+    ))
+    db.session.expire_all()
+    return touched
+
+# P&L rollups
+ROLLUP_PERIODS = ('day', 'week', 'month')
+ROLLUP_COUNTERS = ('pnl', 'trade_count', 'wins', 'losses', 'gross_profit', 'gross_loss', 'deposits', 'withdrawals')
+
+# SQLite expressions for each period's start; 'weekday 0' moves to the coming Sunday
+_ROLLUP_PERIOD_START_SQL = {
+    'day': "date({column})",
+    'week': "date({column}, 'weekday 0', '-6 days')",
+    'month': "date({column}, 'start of month')",
+}
+_ROLLUP_PERIOD_END_SQL = {
+    'day': "period_start",
+    'week': "date(period_start, '+6 days')",
+    'month': "date(period_start, '+1 month', '-1 day')",
+}
+
+def period_start(period, day):
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return day
+
+def _apply_rollup_increments(account_id, increments, sign):
+    if not increments:
+        return
+    table = PnlRollup.__table__
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['account_id', 'period', 'period_start'],
+        set_={name: table.c[name] + stmt.excluded[name] for name in ROLLUP_COUNTERS}
+    )
+    db.session.execute(stmt, [
+        {'account_id': account_id, 'period': key[0], 'period_start': key[1],
+         **{name: sign * value for name, value in counters.items()}}
+        for key, counters in increments.items()
+    ])
+    if sign < 0:
+        db.session.execute(delete(PnlRollup).where(
+            PnlRollup.account_id == account_id,
+            PnlRollup.trade_count == 0, PnlRollup.deposits == 0, PnlRollup.withdrawals == 0
+        ).where(tuple_(PnlRollup.period, PnlRollup.period_start).in_(list(increments))))
+
+def _rollup_increments(day, **counters):
+    row = dict.fromkeys(ROLLUP_COUNTERS, 0)
+    row.update(counters)
+    return {(period, period_start(period, day)): row for period in ROLLUP_PERIODS}
+
+def apply_trade_rollups(account_id, trades, sign=1):
+    """Add (sign=1) or remove (sign=-1) trade rows (mappings with date_entered, account_change)."""
+    increments = {}
+    for trade in trades:
+        pnl = trade['account_change'] or 0
+        for key, row in _rollup_increments(trade['date_entered'].date(), pnl=pnl, trade_count=1,
+                                           wins=int(pnl > 0), losses=int(pnl < 0),
+                                           gross_profit=max(pnl, 0), gross_loss=max(-pnl, 0)).items():
+            total = increments.setdefault(key, dict.fromkeys(ROLLUP_COUNTERS, 0))
+            for name, value in row.items():
+                total[name] += value
+    _apply_rollup_increments(account_id, increments, sign)
+
+def apply_cash_flow_rollups(account_id, date, amount):
+    # amount follows Transaction.amount: positive for deposits, negative for withdrawals
+    _apply_rollup_increments(
+        account_id, _rollup_increments(date.date(), deposits=max(amount, 0), withdrawals=max(-amount, 0)), 1
+    )
 
-@app.route('/metrics', methods=['GET'])
-def metrics():
-    trades = Trade.query.order_by(Trade.id.asc()).all()
+def refresh_rollup_balances(account_id, since):
+    """Reset closing_balance for every period ending on or after `since` from the daily balance log."""
+    for period in ROLLUP_PERIODS:
+        period_end = _ROLLUP_PERIOD_END_SQL[period]
+        db.session.execute(text(f"""
+            UPDATE pnl_rollup SET closing_balance = (
+                SELECT balance FROM account_balance_log
+                WHERE account_id = pnl_rollup.account_id AND date <= {period_end} ORDER BY date DESC LIMIT 1
+            )
+            WHERE account_id = :account_id AND period = :period AND period_start >= :since
+        """), {'account_id': account_id, 'period': period, 'since': period_start(period, since).isoformat()})
+
+def rebuild_rollups():
+    """Recompute every account's rollup rows from the trade history and transaction tables."""
+    db.session.execute(delete(PnlRollup))
+    for period in ROLLUP_PERIODS:
+        trade_start = _ROLLUP_PERIOD_START_SQL[period].format(column='date_entered')
+        flow_start = _ROLLUP_PERIOD_START_SQL[period].format(column='date')
+        db.session.execute(text(f"""
+            INSERT INTO pnl_rollup (account_id, period, period_start, pnl, trade_count, wins, losses, gross_profit,
+                                    gross_loss, deposits, withdrawals)
+            SELECT account_id, :period, start, SUM(pnl), SUM(trades), SUM(wins), SUM(losses), SUM(gross_profit),
+                   SUM(gross_loss), SUM(deposits), SUM(withdrawals)
+            FROM (
+                SELECT account_id, {trade_start} AS start, COALESCE(account_change, 0) AS pnl, 1 AS trades,
+                       account_change > 0 AS wins, account_change < 0 AS losses,
+                       MAX(COALESCE(account_change, 0), 0) AS gross_profit,
+                       MAX(-COALESCE(account_change, 0), 0) AS gross_loss, 0 AS deposits, 0 AS withdrawals
+                FROM trade_history WHERE date_entered IS NOT NULL
+                UNION ALL
+                SELECT account_id, {flow_start}, 0, 0, 0, 0, 0, 0, MAX(amount, 0), MAX(-amount, 0)
+                FROM "transaction" WHERE date IS NOT NULL
+            )
+            GROUP BY account_id, start
+        """), {'period': period})
+    for (account_id,) in db.session.query(Account.id).all():
+        refresh_rollup_balances(account_id, date.min)
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Backfill the day/week/month P&L rollups from existing trades and transactions."""
+    started = time.perf_counter()
+    rebuild_rollups()
+    db.session.commit()
+    click.echo(f"Rebuilt {PnlRollup.query.count()} rollup rows in {time.perf_counter() - started:.2f}s.")
+
+@app.route('/calendar', methods=['GET'])
+@cached_response('trade', 'transaction')
+def calendar():
+    """One account's P&L rollups for one period type (day, week or month) between start and end dates."""
+    period = request.args.get('period', 'day')
+    if period not in ROLLUP_PERIODS:
+        return jsonify({"error": "period must be one of 'day', 'week' or 'month'"}), 400
+    try:
+        account_id = requested_account_id()
+    except ValueError:
+        return jsonify({"error": "account_id must be an integer"}), 400
+    query = PnlRollup.query.filter(PnlRollup.account_id == account_id, PnlRollup.period == period)
+    try:
+        if request.args.get('start'):
+            query = query.filter(PnlRollup.period_start >= period_start(period, date.fromisoformat(request.args['start'])))
+        if request.args.get('end'):
+            query = query.filter(PnlRollup.period_start <= date.fromisoformat(request.args['end']))
+    except ValueError:
+        return jsonify({"error": "start and end must be YYYY-MM-DD dates"}), 400
+
+    return jsonify([{
+        "period_start": row.period_start.isoformat(),
+        "pnl": row.pnl,
+        "trade_count": row.trade_count,
+        "wins": row.wins,
+        "losses": row.losses,
+        "gross_profit": row.gross_profit,
+        "gross_loss": row.gross_loss,
+        "deposits": row.deposits,
+        "withdrawals": row.withdrawals,
+        "closing_balance": row.closing_balance
+    } for row in query.order_by(PnlRollup.period_start)])
+
+@app.cli.command('rechain')
+def rechain_command():
+    """Recompute every account's balance chain, chain head and daily balance log."""
+    started = time.perf_counter()
+    touched = 0
+    for account in Account.query.order_by(Account.id).all():
+        ensure_metrics_aggregate(account.id)
+        touched += rechain(account)
+    db.session.commit()
+    click.echo(f"Rechained {touched} trades in {time.perf_counter() - started:.2f}s.")
+
+# Archiving (see archive.py)
+ARCHIVE_COLUMNS = [c.name for c in Trade.__table__.c]
+
+def _archive_sql(sql):
+    return text(sql).bindparams(*(bindparam(name, type_=db.DateTime) for name in ('after_ts', 'through_ts', 'horizon')
+                                  if f":{name}" in sql))
+
+def archive_horizon(days=None):
+    """Trades closed before this are archived: ARCHIVE_AFTER_DAYS (or `days`) days ago."""
+    return datetime.utcnow() - timedelta(days=app.config['ARCHIVE_AFTER_DAYS'] if days is None else days)
+
+def archive_trades(account_id, horizon, on_batch=None):
+    """Move the account's trades closed before `horizon` into the archive; returns the number moved.
+
+    Trades go in chain order, one checkpoint interval per batch, stopping at the first batch
+    that still holds an open trade or one closed on or after the horizon. Each batch is
+    copied into the archive without the write lock, then a short BEGIN IMMEDIATE
+    transaction checks the batch is unchanged, deletes it from the trade table and advances
+    the account's watermark; a batch written to in between is copied again. on_batch(moved)
+    runs after each batch.
+    """
+    if not app.config['ARCHIVE_DATABASE']:
+        raise RuntimeError("ARCHIVE_DATABASE is not configured")
+    moved = 0
+    while True:
+        account = db.session.get(Account, account_id)
+        checkpoint = BalanceCheckpoint.query.filter(
+            BalanceCheckpoint.account_id == account_id, BalanceCheckpoint.trade_count > account.archived_trades
+        ).order_by(BalanceCheckpoint.trade_count).first()
+        if checkpoint is None or checkpoint.ts >= horizon:
+            db.session.rollback()
+            return moved
+        boundary = (checkpoint.trade_count, checkpoint.ts, checkpoint.trade_id, checkpoint.balance,
+                    checkpoint.cumulative_pnl)
+        watermark = (account.archived_trades, account.archived_ts, account.archived_trade_id)
+        params = {'account_id': account_id, 'after_ts': account.archived_ts or datetime.min,
+                  'after_id': account.archived_trade_id or 0, 'through_ts': checkpoint.ts,
+                  'through_id': checkpoint.trade_id, 'horizon': horizon}
+        if db.session.execute(_archive_sql(archive.BATCH_BLOCKERS_SQL), params).scalar():
+            db.session.rollback()
+            return moved
+
+        # Copy: only the archive is written, so chain writes carry on meanwhile
+        db.session.execute(_archive_sql(archive.PURGE_SQL), params)
+        db.session.execute(_archive_sql(archive.copy_statement(ARCHIVE_COLUMNS)), params)
+        copied = tuple(db.session.execute(_archive_sql(archive.BATCH_STATE_SQL), params).one())
+        db.session.commit()
+
+        # Switch: only the main database is written, so readers move over atomically
+        begin_chain_write()
+        account = db.session.get(Account, account_id)
+        checkpoint = db.session.get(BalanceCheckpoint, (account_id, boundary[0]))
+        current = tuple(db.session.execute(_archive_sql(archive.BATCH_STATE_SQL), params).one())
+        if (checkpoint is None or current != copied
+                or (account.archived_trades, account.archived_ts, account.archived_trade_id) != watermark
+                or (checkpoint.trade_count, checkpoint.ts, checkpoint.trade_id, checkpoint.balance,
+                    checkpoint.cumulative_pnl) != boundary):
+            db.session.rollback()
+            continue
+        db.session.execute(_archive_sql(archive.DELETE_BATCH_SQL), params)
+        mark_tables_changed('trade')
+        account.archived_trades, account.archived_ts, account.archived_trade_id = boundary[:3]
+        db.session.commit()
+        moved += copied[0]
+        if on_batch is not None:
+            on_batch(moved)
+
+@app.cli.command('archive-trades')
+@click.option('--days', type=click.IntRange(min=0), default=None,
+              help="Archive trades closed more than this many days ago (default: ARCHIVE_AFTER_DAYS).")
+def archive_trades_command(days):
+    """Move every account's old closed trades into the ARCHIVE_DATABASE file."""
+    if not app.config['ARCHIVE_DATABASE']:
+        raise click.ClickException("Set ARCHIVE_DATABASE to the archive file's path first.")
+    started = time.perf_counter()
+    horizon = archive_horizon(days)
+    moved = 0
+    for (account_id,) in db.session.query(Account.id).order_by(Account.id).all():
+        moved += archive_trades(account_id, horizon)
+    click.echo(f"Archived {moved} trades closed before {horizon:%Y-%m-%d} in {time.perf_counter() - started:.2f}s.")
+
+# Metrics aggregate maintenance
+METRIC_FIELDS = ('actual_return', 'planned_rr', 'actual_rr', 'account_change_percentage', 'trade_setup_id', 'market_id')
+
+def _metrics_delta(trades):
+    """Fold trade rows (mappings of METRIC_FIELDS) into their increments to the metrics aggregate."""
+    delta = {
+        'total_trades': 0,
+        'winning_trades': 0,
+        'sum_actual_return': 0.0,
+        'sum_planned_rr': 0.0,
+        'sum_actual_rr': 0.0,
+        'sum_account_change_percentage': 0.0,
+        'max_actual_return': None,
+        'min_actual_return': None,
+        'setups': {},
+        'markets': {},
+    }
+    for trade in trades:
+        delta['total_trades'] += 1
+        if trade['actual_return'] is not None:
+            if trade['actual_return'] > 0:
+                delta['winning_trades'] += 1
+            delta['sum_actual_return'] += trade['actual_return']
+            if delta['max_actual_return'] is None or trade['actual_return'] > delta['max_actual_return']:
+                delta['max_actual_return'] = trade['actual_return']
+            if delta['min_actual_return'] is None or trade['actual_return'] < delta['min_actual_return']:
+                delta['min_actual_return'] = trade['actual_return']
+        delta['sum_planned_rr'] += trade['planned_rr'] or 0
+        delta['sum_actual_rr'] += trade['actual_rr'] or 0
+        delta['sum_account_change_percentage'] += trade['account_change_percentage'] or 0
+        delta['setups'][trade['trade_setup_id']] = delta['setups'].get(trade['trade_setup_id'], 0) + 1
+        delta['markets'][trade['market_id']] = delta['markets'].get(trade['market_id'], 0) + 1
+    return delta
+
+def _bump_counters(model, key, account_id, counts, sign):
+    if not counts:
+        return
+    table = model.__table__
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.account_id, table.c[key]],
+        set_={'trade_count': table.c.trade_count + stmt.excluded.trade_count}
+    )
+    db.session.execute(stmt, [{'account_id': account_id, key: k, 'trade_count': sign * v} for k, v in counts.items()])
+
+def ensure_metrics_aggregate(account_id):
+    # Must run before the caller flushes its own writes, otherwise a first-time
+    # rebuild would count them and the delta would be applied twice.
+    if db.session.get(MetricsAggregate, account_id) is None:
+        rebuild_metrics_aggregate(account_id)
+
+def apply_metrics_delta(account_id, delta, sign=1):
+    """Add (sign=1) or remove (sign=-1) a delta from the aggregate with atomic column updates."""
+    agg = MetricsAggregate.__table__.c
+    values = {
+        name: agg[name] + sign * delta[name]
+        for name in ('total_trades', 'winning_trades', 'sum_actual_return', 'sum_planned_rr',
+                     'sum_actual_rr', 'sum_account_change_percentage')
+    }
+    if sign > 0 and delta['max_actual_return'] is not None:
+        values['max_actual_return'] = func.max(func.coalesce(agg.max_actual_return, delta['max_actual_return']),
+                                               delta['max_actual_return'])
+        values['min_actual_return'] = func.min(func.coalesce(agg.min_actual_return, delta['min_actual_return']),
+                                               delta['min_actual_return'])
+    db.session.execute(update(MetricsAggregate).where(agg.account_id == account_id).values(**values))
+    _bump_counters(SetupTradeCount, 'trade_setup_id', account_id, delta['setups'], sign)
+    _bump_counters(MarketTradeCount, 'market_id', account_id, delta['markets'], sign)
+
+    if sign < 0 and delta['max_actual_return'] is not None:
+        # Extremes cannot be decremented; re-read them only when a removed trade held one.
+        aggregate = db.session.get(MetricsAggregate, account_id)
+        db.session.refresh(aggregate)
+        if (aggregate.max_actual_return is None or delta['max_actual_return'] >= aggregate.max_actual_return
+                or delta['min_actual_return'] <= aggregate.min_actual_return):
+            # One index seek per table; MIN/MAX over the trade_history union would scan the account
+            extremes = [db.session.query(func.max(model.actual_return), func.min(model.actual_return)).filter(
+                model.account_id == account_id).one() for model in (Trade, ArchivedTrade)]
+            aggregate.max_actual_return = max((high for high, _ in extremes if high is not None), default=None)
+            aggregate.min_actual_return = min((low for _, low in extremes if low is not None), default=None)
+
+def record_cash_flow_metrics(account_id, amount):
+    # amount follows Transaction.amount: positive for deposits, negative for withdrawals
+    agg = MetricsAggregate.__table__.c
+    if amount >= 0:
+        values = {'total_deposits': agg.total_deposits + amount}
+    else:
+        values = {'total_withdrawals': agg.total_withdrawals - amount}
+    db.session.execute(update(MetricsAggregate).where(agg.account_id == account_id).values(**values))
+
+def rebuild_metrics_aggregate(account_id):
+    """Recompute an account's aggregate and its per-setup/per-market counters from the base tables.
+
+    Archived trades count too: the aggregate covers the account's whole history.
+    """
+    row = db.session.query(
+        func.count(TradeHistory.id),
+        func.count(TradeHistory.id).filter(TradeHistory.actual_return > 0),
+        func.coalesce(func.sum(TradeHistory.actual_return), 0),
+        func.coalesce(func.sum(TradeHistory.planned_rr), 0),
+        func.coalesce(func.sum(TradeHistory.actual_rr), 0),
+        func.coalesce(func.sum(TradeHistory.account_change_percentage), 0),
+        func.max(TradeHistory.actual_return),
+        func.min(TradeHistory.actual_return)
+    ).filter(TradeHistory.account_id == account_id).one()
+    deposits, withdrawals = db.session.query(
+        func.coalesce(func.sum(Transaction.amount).filter(Transaction.amount >= 0), 0),
+        func.coalesce(func.sum(Transaction.amount).filter(Transaction.amount < 0), 0)
+    ).filter(Transaction.account_id == account_id).one()
+
+    aggregate = db.session.get(MetricsAggregate, account_id)
+    if aggregate is None:
+        aggregate = MetricsAggregate(account_id=account_id)
+        db.session.add(aggregate)
+    (aggregate.total_trades, aggregate.winning_trades, aggregate.sum_actual_return, aggregate.sum_planned_rr,
+     aggregate.sum_actual_rr, aggregate.sum_account_change_percentage, aggregate.max_actual_return,
+     aggregate.min_actual_return) = row
+    aggregate.total_deposits = deposits
+    aggregate.total_withdrawals = -withdrawals
+
+    SetupTradeCount.query.filter_by(account_id=account_id).delete()
+    MarketTradeCount.query.filter_by(account_id=account_id).delete()
+    trades = db.session.query(TradeHistory).filter(TradeHistory.account_id == account_id)
+    setup_counts = dict(trades.with_entities(TradeHistory.trade_setup_id, func.count(TradeHistory.id))
+                        .group_by(TradeHistory.trade_setup_id))
+    market_counts = dict(trades.with_entities(TradeHistory.market_id, func.count(TradeHistory.id))
+                         .group_by(TradeHistory.market_id))
+    _bump_counters(SetupTradeCount, 'trade_setup_id', account_id, setup_counts, 1)
+    _bump_counters(MarketTradeCount, 'market_id', account_id, market_counts, 1)
+    db.session.flush()
+    return aggregate
+
+def _named_counts(model, key, name_model, account_id):
+    rows = db.session.query(name_model.name, model.trade_count).outerjoin(
+        name_model, name_model.id == getattr(model, key)
+    ).filter(model.account_id == account_id, model.trade_count > 0).all()
+    counts = {}
+    for name, count in rows:
+        name = name or "Unknown"
+        counts[name] = counts.get(name, 0) + count
+    return counts
+
+def aggregate_metrics(account):
+    """Return (payload, setup counts, market counts) from the account's aggregate, or None without trades."""
+    aggregate = db.session.get(MetricsAggregate, account.id)
+    if aggregate is None or aggregate.total_trades <= 0:
+        return None
+    total_trades = aggregate.total_trades
+
+    setup_counts = _named_counts(SetupTradeCount, 'trade_setup_id', TradeSetup, account.id)
+    market_counts = _named_counts(MarketTradeCount, 'market_id', Market, account.id)
+
+    return {
+        "total_trades": total_trades,
+        "win_rate": aggregate.winning_trades / total_trades * 100,
+        "cumulative_pnl": aggregate.sum_actual_return,
+        "average_planned_rr": aggregate.sum_planned_rr / total_trades,
+        "average_actual_rr": aggregate.sum_actual_rr / total_trades,
+        "account_balance": account.starting_balance + aggregate.sum_actual_return,
+        "account_balance_change": aggregate.sum_actual_return,
+        "average_account_change_percentage": aggregate.sum_account_change_percentage / total_trades,
+        "largest_win": aggregate.max_actual_return if aggregate.max_actual_return is not None else 0,
+        "largest_loss": aggregate.min_actual_return if aggregate.min_actual_return is not None else 0,
+        "most_common_setup": max(setup_counts, key=setup_counts.get) if setup_counts else "None",
+        "most_traded_market": max(market_counts, key=market_counts.get) if market_counts else "None",
+        "total_deposits": aggregate.total_deposits,
+        "total_withdrawals": aggregate.total_withdrawals
+    }, setup_counts, market_counts
+
+def scan_metrics(account):
+    """Full-scan reference for aggregate_metrics(), used to verify the aggregate.
+
+    Scans archived trades as well, as plain rows with the setup and market names looked up
+    once rather than through the ORM relationships.
+    """
+    trades = db.session.query(
+        *(getattr(TradeHistory, name) for name in ('actual_return', 'planned_rr', 'actual_rr',
+                                                   'account_change_percentage', 'trade_setup_id', 'market_id'))
+    ).filter(TradeHistory.account_id == account.id).all()
     if not trades:
-        return jsonify({"message": "No trades available to calculate metrics"}), 200
+        return None
+    setup_names = dict(db.session.query(TradeSetup.id, TradeSetup.name))
+    market_names = dict(db.session.query(Market.id, Market.name))
 
     # Initialize variables for calculations
     total_trades = len(trades)
@@ -348,7 +2268,7 @@ def metrics():
     avg_actual_rr = sum(trade.actual_rr for trade in trades if trade.actual_rr is not None) / total_trades if total_trades > 0 else 0
 
     # Dynamically calculate account balance based on trades
-    starting_balance = 1000  # Assume a starting balance
+    starting_balance = account.starting_balance
     account_balance = starting_balance
     for trade in trades:
         if trade.actual_return is not None:
@@ -365,16 +2285,18 @@ def metrics():
 
     setup_counts = {}
     for trade in trades:
-        setup_name = trade.trade_setup.name if trade.trade_setup else "Unknown"
+        setup_name = setup_names.get(trade.trade_setup_id, "Unknown")
         setup_counts[setup_name] = setup_counts.get(setup_name, 0) + 1
     most_common_setup = max(setup_counts, key=setup_counts.get) if setup_counts else "None"
 
     market_counts = {}
     for trade in trades:
-        market_name = trade.market.name if trade.market else "Unknown"
+        market_name = market_names.get(trade.market_id, "Unknown")
         market_counts[market_name] = market_counts.get(market_name, 0) + 1
     most_traded_market = max(market_counts, key=market_counts.get) if market_counts else "None"
 
+    transactions = Transaction.query.filter_by(account_id=account.id).all()
+
     # Construct the response
     metrics_data = {
         "total_trades": total_trades,
@@ -388,12 +2310,770 @@ def metrics():
         "largest_win": largest_win,
         "largest_loss": largest_loss,
         "most_common_setup": most_common_setup,
-        "most_traded_market": most_traded_market
+        "most_traded_market": most_traded_market,
+        "total_deposits": sum(t.amount for t in transactions if t.amount >= 0),
+        "total_withdrawals": -sum(t.amount for t in transactions if t.amount < 0)
     }
 
+    return metrics_data, setup_counts, market_counts
+
+def verify_metrics_aggregate(account):
+    """Compare the account's metrics aggregate with a full scan; returns (trades scanned, mismatches)."""
+    expected, actual = scan_metrics(account), aggregate_metrics(account)
+    if expected is None or actual is None:
+        if expected is not actual:
+            return 0, ["Aggregate and full scan disagree on whether any trades exist"]
+        return 0, []
+
+    expected_data, expected_setups, expected_markets = expected
+    actual_data, actual_setups, actual_markets = actual
+    mismatches = []
+    for key, value in expected_data.items():
+        if key in ('most_common_setup', 'most_traded_market'):
+            continue  # ties may resolve differently; the counters are compared below
+        if not math.isclose(value, actual_data[key], rel_tol=1e-9, abs_tol=1e-6):
+            mismatches.append(f"{key}: scan={value} aggregate={actual_data[key]}")
+    if expected_setups != actual_setups:
+        mismatches.append(f"setup counts: scan={expected_setups} aggregate={actual_setups}")
+    if expected_markets != actual_markets:
+        mismatches.append(f"market counts: scan={expected_markets} aggregate={actual_markets}")
+    return expected_data['total_trades'], mismatches
+
+def verify_all_metrics_aggregates(accounts):
+    """verify_metrics_aggregate() over several accounts, with each mismatch prefixed by its account."""
+    total_trades, mismatches = 0, []
+    for account in accounts:
+        trades, account_mismatches = verify_metrics_aggregate(account)
+        total_trades += trades
+        mismatches.extend(f"account {account.id}: {mismatch}" for mismatch in account_mismatches)
+    return total_trades, mismatches
+
+@app.cli.command('rebuild-metrics')
+def rebuild_metrics_command():
+    """Rebuild every account's metrics aggregate from scratch and check it against a full scan."""
+    accounts = Account.query.order_by(Account.id).all()
+    for account in accounts:
+        rebuild_metrics_aggregate(account.id)
+    db.session.commit()
+
+    total_trades, mismatches = verify_all_metrics_aggregates(accounts)
+    if mismatches:
+        raise click.ClickException("Metrics aggregate does not match full scan:\n" + "\n".join(mismatches))
+    if not total_trades:
+        click.echo("No trades; metrics aggregates reset.")
+        return
+    click.echo(f"Metrics aggregates rebuilt and verified over {total_trades} trades in {len(accounts)} accounts.")
+
+@app.route('/metrics', methods=['GET'])
+@cached_response('trade', 'transaction', 'market', 'trade_setup')
+def metrics():
+    account, error = load_account()
+    if error:
+        return error
+    result = aggregate_metrics(account)
+    if result is None and db.session.get(MetricsAggregate, account.id) is None:
+        # First request for an account, or against a database that predates the aggregate
+        db.session.commit()
+        begin_chain_write()
+        ensure_metrics_aggregate(account.id)
+        db.session.commit()
+        result = aggregate_metrics(account)
+    if result is None:
+        return jsonify({"message": "No trades available to calculate metrics"}), 200
+
+    metrics_data = result[0]
     return jsonify(metrics_data), 200
 
 
+@app.route('/analytics', methods=['GET'])
+@cached_response('trade', 'market', 'trade_setup')
+def trade_analytics():
+    """Drawdown, risk-adjusted return, expectancy, streak and R-multiple statistics of one account.
+
+    Optional start/end bound date_entered; include_archived=1 covers archived trades too.
+    Columns are loaded into NumPy arrays in one query and every statistic is vectorized; see
+    analytics.py.
+    """
+    try:
+        account_id = requested_account_id()
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({"error": "start and end must be ISO dates and account_id an integer"}), 400
+
+    connection = db.session.connection().connection.driver_connection
+    trades = analytics.load_trade_arrays(connection, account_id, start, end, history=wants_history(request.args))
+    stats = analytics.trade_statistics(trades)
+    if stats is None:
+        return jsonify({"message": "No trades available to calculate analytics"}), 200
+
+    setup_names = dict(db.session.query(TradeSetup.id, TradeSetup.name))
+    market_names = dict(db.session.query(Market.id, Market.name))
+    stats['by_setup'] = [{"id": setup_id, "name": setup_names.get(setup_id, "Unknown"), **group}
+                         for setup_id, group in stats['by_setup'].items()]
+    stats['by_market'] = [{"id": market_id, "name": market_names.get(market_id, "Unknown"), **group}
+                          for market_id, group in stats['by_market'].items()]
+    return jsonify(stats), 200
+
+
+EQUITY_CURVE_POINTS = 2000
+EQUITY_CURVE_MAX_POINTS = 10000
+
+def equity_curve(account_id, resolution='day', start=None, end=None, points=EQUITY_CURVE_POINTS, method='lttb',
+                 history=False):
+    """The account's balance series between start and end, downsampled to at most `points` points."""
+    connection = db.session.connection().connection.driver_connection
+    x, y = analytics.load_balance_series(connection, account_id, resolution, start, end, history)
+    timestamps, balances = analytics.downsample_series(x, y, points, method, unit='D' if resolution == 'day' else 's')
+    return {
+        "resolution": resolution,
+        "method": method,
+        "source_points": len(x),
+        "timestamps": timestamps,
+        "balances": balances
+    }
+
+@app.route('/equity_curve', methods=['GET'])
+@cached_response('trade', 'transaction')
+def get_equity_curve():
+    """Downsampled balance series for charts.
+
+    resolution=day (end-of-day balance log) or trade (balance after every trade);
+    method=lttb or minmax; points caps the response size. Zooming is a narrower start/end,
+    which re-samples only that window. The trade resolution covers archived trades only with
+    include_archived=1.
+    """
+    resolution = request.args.get('resolution', 'day')
+    method = request.args.get('method', 'lttb')
+    if resolution not in ('day', 'trade'):
+        return jsonify({"error": "resolution must be 'day' or 'trade'"}), 400
+    if method not in analytics.DOWNSAMPLERS:
+        return jsonify({"error": "method must be 'lttb' or 'minmax'"}), 400
+    try:
+        account_id = requested_account_id()
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else None
+        points = int(request.args.get('points', EQUITY_CURVE_POINTS))
+    except ValueError:
+        return jsonify({"error": "start and end must be ISO dates, points and account_id integers"}), 400
+    points = min(max(points, 4), EQUITY_CURVE_MAX_POINTS)
+    return jsonify(equity_curve(account_id, resolution, start, end, points, method, wants_history(request.args))), 200
+
+
+# Cash-flow ledger (see ledger.py)
+LEDGER_PAGE_SIZE = 100
+LEDGER_PAGE_LIMIT = 1000
+BALANCE_AS_OF_LIMIT = 1000
+
+def parse_ledger_window(args):
+    """Optional start/end datetimes bounding the ledger; raises ValueError."""
+    start = datetime.fromisoformat(args['start']) if args.get('start') else None
+    end = datetime.fromisoformat(args['end']) if args.get('end') else None
+    return start, end
+
+@app.route('/ledger', methods=['GET'])
+@cached_response('trade', 'transaction')
+def get_ledger():
+    """Trades, deposits and withdrawals of one account as one timeline with running balances.
+
+    Entries are in chain order, limit (default 100) per page; pass next_cursor back as cursor
+    for the next page. start/end bound the timeline.
+    """
+    account, error = load_account()
+    if error:
+        return error
+    try:
+        start, end = parse_ledger_window(request.args)
+        position = ledger.decode_position(request.args['cursor']) if request.args.get('cursor') else ledger.start_position(start)
+        limit = int(request.args.get('limit', LEDGER_PAGE_SIZE))
+    except (TypeError, ValueError, binascii.Error):
+        return jsonify({"error": "Invalid start, end, cursor or limit"}), 400
+    limit = min(max(limit, 1), LEDGER_PAGE_LIMIT)
+
+    connection = db.session.connection().connection.driver_connection
+    page = ledger.timeline_page(connection, account.id, account.starting_balance, position, end, limit)
+    return jsonify({"account_id": account.id, **page}), 200
+
+@app.route('/ledger/returns', methods=['GET'])
+@cached_response('trade', 'transaction')
+def get_ledger_returns():
+    """Opening and closing balance, trading P&L, cash flows and time- and money-weighted returns.
+
+    start/end bound the period, which is replayed in one streaming pass over both tables.
+    """
+    account, error = load_account()
+    if error:
+        return error
+    try:
+        start, end = parse_ledger_window(request.args)
+    except ValueError:
+        return jsonify({"error": "start and end must be ISO dates"}), 400
+
+    connection = db.session.connection().connection.driver_connection
+    result = ledger.ledger_returns(connection, account.id, account.starting_balance, start, end)
+    return jsonify({"account_id": account.id, **result}), 200
+
+@app.route('/balance_as_of', methods=['GET'])
+@cached_response('trade', 'transaction')
+def balance_as_of():
+    """Balance, cumulative P&L, trade count and net cash flow of one account as of each `at`.
+
+    Repeat at (up to 1000 times) for a batch; every event at or before the timestamp counts,
+    so a bare date means its midnight. Each answer is a checkpoint seek plus a short replay.
+    """
+    account, error = load_account()
+    if error:
+        return error
+    try:
+        moments = [datetime.fromisoformat(value) for value in request.args.getlist('at')]
+    except ValueError:
+        return jsonify({"error": "at must be an ISO timestamp"}), 400
+    if not moments or len(moments) > BALANCE_AS_OF_LIMIT:
+        return jsonify({"error": f"Pass between 1 and {BALANCE_AS_OF_LIMIT} 'at' timestamps"}), 400
+
+    connection = db.session.connection().connection.driver_connection
+    balances = ledger.balances_as_of(connection, account.id, account.starting_balance, moments)
+    return jsonify({"account_id": account.id, "balances": balances}), 200
+
+@app.route('/balance_between', methods=['GET'])
+@cached_response('trade', 'transaction')
+def balance_between():
+    """The change in balance, P&L, trade count and net cash flow after `start` up to `end`."""
+    account, error = load_account()
+    if error:
+        return error
+    try:
+        start, end = parse_ledger_window(request.args)
+    except ValueError:
+        return jsonify({"error": "start and end must be ISO dates"}), 400
+    if start is None or end is None or start > end:
+        return jsonify({"error": "start and end are required, start not after end"}), 400
+
+    connection = db.session.connection().connection.driver_connection
+    opening, closing = ledger.balances_as_of(connection, account.id, account.starting_balance, [start, end])
+    return jsonify({
+        "account_id": account.id,
+        "start": opening,
+        "end": closing,
+        "balance_change": closing["balance"] - opening["balance"],
+        "pnl": closing["cumulative_pnl"] - opening["cumulative_pnl"],
+        "trades": closing["trade_count"] - opening["trade_count"],
+        "net_cash_flow": closing["net_cash_flow"] - opening["net_cash_flow"]
+    }), 200
+
+
+SIMULATION_PATHS = 10000
+SIMULATION_MAX_PATHS = 100000
+SIMULATION_TRADES = 500
+SIMULATION_MAX_TRADES = 10000
+SIMULATION_TIME_BUDGET = 10.0
+SIMULATION_MAX_TIME_BUDGET = 60.0
+
+def parse_simulation_request(data):
+    """Validate a /simulate body into simulation options; returns (options, error message)."""
+    risks = data.get('risk_percentages')  # None: the account's risk percentage when the simulation runs
+    method = data.get('method', 'bootstrap')
+    if risks is not None and (not isinstance(risks, list) or not risks
+                              or not all(isinstance(risk, (int, float)) and 0 < risk <= 1 for risk in risks)):
+        return None, "risk_percentages must be a list of numbers between 0 and 1"
+    if method not in simulation.RESAMPLERS:
+        return None, "method must be 'bootstrap' or 'block'"
+    try:
+        options = {
+            'account_id': requested_account_id(data),
+            'risks': risks,
+            'paths': int(data.get('paths', SIMULATION_PATHS)),
+            'trades': int(data.get('trades', SIMULATION_TRADES)),
+            'method': method,
+            'block_size': int(data['block_size']) if data.get('block_size') is not None else None,
+            'ruin_level': float(data.get('ruin_level', 0.5)),
+            'seed': int(data['seed']) if data.get('seed') is not None else None,
+            'time_budget': float(data.get('time_budget', SIMULATION_TIME_BUDGET)),
+            'start': datetime.fromisoformat(data['start']).isoformat() if data.get('start') else None,
+            'end': datetime.fromisoformat(data['end']).isoformat() if data.get('end') else None,
+            'market_id': int(data['market_id']) if data.get('market_id') is not None else None,
+            'trade_setup_id': int(data['trade_setup_id']) if data.get('trade_setup_id') is not None else None,
+        }
+    except (TypeError, ValueError):
+        return None, ("paths, trades, block_size, seed and ids must be integers, "
+                      "ruin_level and time_budget numbers, start and end ISO dates")
+    if db.session.get(Account, options['account_id']) is None:
+        return None, "Account not found"
+    if not (0 < options['ruin_level'] < 1):
+        return None, "ruin_level must be between 0 and 1"
+    if options['block_size'] is not None and options['block_size'] < 1:
+        return None, "block_size must be at least 1"
+    if options['seed'] is not None and options['seed'] < 0:
+        return None, "seed must not be negative"
+    options['paths'] = min(max(options['paths'], 100), SIMULATION_MAX_PATHS)
+    options['trades'] = min(max(options['trades'], 1), SIMULATION_MAX_TRADES)
+    options['time_budget'] = min(max(options['time_budget'], 0.1), SIMULATION_MAX_TIME_BUDGET)
+    return options, None
+
+def simulate_journal(options):
+    """Run a simulation over an account's R multiples; None when there are too few trades."""
+    start = datetime.fromisoformat(options['start']) if options['start'] else None
+    end = datetime.fromisoformat(options['end']) if options['end'] else None
+    account = db.session.get(Account, options['account_id'])
+    connection = db.session.connection().connection.driver_connection
+    r_multiples = simulation.load_r_multiples(connection, account.id, start, end, options['market_id'],
+                                              options['trade_setup_id'])
+    if len(r_multiples) < 2:
+        return None
+    starting_balance, _ = chain_head(account)
+    risks = options['risks'] or [account.risk_percentage]
+    # Release the read transaction; the simulation itself does not touch the database
+    db.session.commit()
+
+    result = simulation.run_simulation(
+        r_multiples, risks, starting_balance, options['paths'], options['trades'], options['method'],
+        options['block_size'], options['ruin_level'], options['seed'], options['time_budget'],
+        app.config['SIMULATION_WORKERS'])
+    if result['truncated']:
+        app.logger.info("Simulation stopped at %d of %d paths after its %.1fs budget",
+                        result['paths'], options['paths'], options['time_budget'])
+    return result
+
+@app.route('/simulate', methods=['POST'])
+def simulate():
+    """Monte Carlo equity paths from an account's realised R multiples at one or more risk fractions.
+
+    JSON body, every field optional: account_id, risk_percentages (defaults to the account's risk), paths,
+    trades per path, method=bootstrap or block (block_size consecutive trades), ruin_level
+    as a fraction of the starting balance, seed, time_budget in seconds, and start/end/
+    market_id/trade_setup_id to pick the history. See simulation.py; POST /jobs with kind
+    'simulate' runs the same in the background.
+    """
+    options, error = parse_simulation_request(request.json or {})
+    if error:
+        return jsonify({"error": error}), 400
+    result = simulate_journal(options)
+    if result is None:
+        return jsonify({"message": "At least two trades with risk are needed to simulate"}), 200
+    return jsonify(result), 200
+
+
+# Columnar export (see export.py)
+@app.route('/export/arrow', methods=['GET'])
+def export_arrow():
+    """Stream one table as an Arrow IPC stream, optionally only rows updated after `since`.
+
+    table is trade (with market and setup names), transaction or account_balance_log;
+    compression=zstd or lz4 compresses each record batch. A since carried over from an
+    earlier export should go back export.WRITE_TRANSACTION_LAG before it was taken.
+    """
+    table = request.args.get('table', 'trade')
+    if table not in export.EXPORT_TABLES:
+        return jsonify({"error": f"table must be one of {', '.join(export.EXPORT_TABLES)}"}), 400
+    compression = request.args.get('compression') or None
+    if compression not in (None, 'zstd', 'lz4'):
+        return jsonify({"error": "compression must be 'zstd' or 'lz4'"}), 400
+    try:
+        since = datetime.fromisoformat(request.args['since']) if request.args.get('since') else None
+    except ValueError:
+        return jsonify({"error": "since must be an ISO timestamp"}), 400
+
+    def generate():
+        # Its own connection and read transaction, held only while the body streams
+        with db.engine.connect() as connection, connection.begin():
+            yield from export.iter_ipc_stream(connection.connection.driver_connection, table, since, compression)
+    return Response(stream_with_context(generate()), mimetype='application/vnd.apache.arrow.stream',
+                    headers={'Content-Disposition': f'attachment; filename={table}.arrows'})
+
+@app.cli.command('export-snapshot')
+@click.argument('out_dir')
+@click.option('--format', 'fmt', type=click.Choice(list(export.EXPORT_FORMATS)), default='parquet')
+@click.option('--incremental', is_flag=True, help="Only rows changed since the last export into OUT_DIR")
+def export_snapshot_command(out_dir, fmt, incremental):
+    """Write trades, transactions and daily balances as compressed Parquet or Arrow files."""
+    os.makedirs(out_dir, exist_ok=True)
+    started = time.perf_counter()
+    with db.engine.connect() as connection, connection.begin():
+        manifest = export.export_snapshot(connection.connection.driver_connection, out_dir, fmt, incremental)
+    for table, details in manifest['tables'].items():
+        click.echo(f"{table}: {details['rows']} of {details['table_rows']} rows -> {details['file']}")
+    click.echo(f"{manifest['kind'].capitalize()} export in {time.perf_counter() - started:.2f}s, watermark {manifest['watermark']}.")
+
+
+# Background jobs (see jobs.py)
+JOB_ACTIVE_STATUSES = ('queued', 'running')
+JOB_PAGE_SIZE = 50
+JOB_PAGE_LIMIT = 500
+
+job_runner = jobs.JobRunner(app.config['JOB_WORKERS'], app.config['JOB_MAX_QUEUED'])
+
+# kind -> (function(context, params), reuse_tables, parse_params, submittable through POST /jobs)
+JOB_KINDS = {}
+
+def job_kind(name, reuse_tables=(), parse_params=None, public=True):
+    """Register function(context, params) -> JSON-able result as a job kind.
+
+    A finished job's result is handed back to identical submissions for as long as the data
+    versions of `reuse_tables` are unchanged. parse_params validates the params of POST
+    /jobs into (params, error message); kinds without it take no params.
+    """
+    def decorator(function):
+        JOB_KINDS[name] = (function, reuse_tables, parse_params, public)
+        return function
+    return decorator
+
+def parse_account_params(params):
+    """Validate the params of a job over one account, {"account_id": ...}, into (params, error message)."""
+    unknown = set(params) - {'account_id'}
+    if unknown:
+        return None, f"Unknown params: {', '.join(sorted(unknown))}"
+    try:
+        account_id = requested_account_id(params)
+    except (TypeError, ValueError):
+        return None, "account_id must be an integer"
+    if db.session.get(Account, account_id) is None:
+        return None, "Account not found"
+    return {'account_id': account_id}, None
+
+@job_kind('metrics_scan', reuse_tables=('trade', 'transaction', 'market', 'trade_setup'),
+          parse_params=parse_account_params)
+def metrics_scan_job(context, params):
+    """The full-scan metrics report of one account, with trade counts per setup and market."""
+    context.progress(0, "Scanning trades")
+    scanned = scan_metrics(db.session.get(Account, params['account_id']))
+    if scanned is None:
+        return {"message": "No trades available to calculate metrics"}
+    metrics_data, setup_counts, market_counts = scanned
+    return {**metrics_data, "setup_counts": setup_counts, "market_counts": market_counts}
+
+@job_kind('verify_metrics')
+def verify_metrics_job(context, params):
+    """Rebuild every account's metrics aggregate and check it against a full scan."""
+    context.progress(0, "Rebuilding the metrics aggregates")
+    begin_chain_write()
+    accounts = Account.query.order_by(Account.id).all()
+    for account in accounts:
+        rebuild_metrics_aggregate(account.id)
+    mark_tables_changed('trade')  # /metrics responses are cached on the trade version
+    db.session.commit()
+    context.progress(0.5, "Verifying against a full scan")
+    trades, mismatches = verify_all_metrics_aggregates(accounts)
+    return {"trades": trades, "mismatches": mismatches}
+
+@job_kind('rechain')
+def rechain_job(context, params):
+    """Recompute every account's balance chain, chain head, daily balance log and rollup balances."""
+    context.progress(0, "Rechaining")
+    begin_chain_write()
+    accounts = Account.query.order_by(Account.id).all()
+    touched = 0
+    for index, account in enumerate(accounts):
+        context.progress(index / len(accounts), f"Rechaining account {account.id}")
+        ensure_metrics_aggregate(account.id)
+        touched += rechain(account)
+    db.session.commit()
+    return {"trades_rechained": touched}
+
+@job_kind('rebuild_rollups')
+def rebuild_rollups_job(context, params):
+    context.progress(0, "Rebuilding rollups")
+    begin_chain_write()
+    rebuild_rollups()
+    mark_tables_changed('trade')  # /calendar responses are cached on the trade version
+    db.session.commit()
+    return {"rollup_rows": PnlRollup.query.count()}
+
+@job_kind('rebuild_search_index')
+def rebuild_search_index_job(context, params):
+    context.progress(0, "Indexing trades")
+    begin_chain_write()
+    rebuild_trade_search_index()
+    mark_tables_changed('trade')
+    db.session.commit()
+    return {"trades_indexed": Trade.query.count()}
+
+def parse_archive_params(params):
+    """Validate the params of an archive job, {"days": ...} (optional), into (params, error message)."""
+    if not app.config['ARCHIVE_DATABASE']:
+        return None, "ARCHIVE_DATABASE is not configured"
+    unknown = set(params) - {'days'}
+    if unknown:
+        return None, f"Unknown params: {', '.join(sorted(unknown))}"
+    if params.get('days') is None:
+        return {}, None
+    if not isinstance(params['days'], int) or isinstance(params['days'], bool) or params['days'] < 0:
+        return None, "days must be a non-negative integer"
+    return {'days': params['days']}, None
+
+@job_kind('archive_trades', parse_params=parse_archive_params)
+def archive_trades_job(context, params):
+    """Move every account's trades closed before the horizon into the archive database."""
+    horizon = archive_horizon(params.get('days'))
+    account_ids = [account_id for (account_id,) in db.session.query(Account.id).order_by(Account.id)]
+    db.session.rollback()
+    moved = {}
+    for index, account_id in enumerate(account_ids):
+        message = f"Archiving account {account_id}"
+        context.progress(index / len(account_ids), message)
+        moved[account_id] = archive_trades(account_id, horizon, on_batch=lambda count: context.progress(
+            message=f"{message}: {count} trades moved"))
+    return {"horizon": horizon.isoformat(timespec='seconds'), "trades_archived": sum(moved.values()),
+            "by_account": {str(account_id): count for account_id, count in moved.items()}}
+
+@job_kind('simulate', reuse_tables=('trade', 'transaction', 'account'), parse_params=parse_simulation_request)
+def simulate_job(context, params):
+    context.progress(0, "Simulating")
+    result = simulate_journal(params)
+    return result if result is not None else {"message": "At least two trades with risk are needed to simulate"}
+
+@job_kind('import_trades', public=False)
+def import_trades_job(context, params):
+    """Import an upload staged by POST /import_trades?async=1, reporting progress by bytes read."""
+    try:
+        size = os.path.getsize(params['path']) or 1
+        with open(params['path'], 'rb') as raw:
+            stream = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+
+            def on_chunk(trade_import):
+                context.progress(raw.tell() / size, f"{trade_import.rows_committed} rows committed")
+
+            trade_import, errors = import_trade_stream(
+                read_import_records(stream, params['format']), params['source'], params['account_id'],
+                column_map=params['column_map'],
+                batch_size=params['batch_size'], restart=params['restart'], on_chunk=on_chunk
+            )
+    finally:
+        _discard_staged_upload(params)
+    return {
+        "import_id": trade_import.id,
+        "status": trade_import.status,
+        "rows_committed": trade_import.rows_committed,
+        "trades_imported": trade_import.trades_imported,
+        "rows_rejected": trade_import.rows_rejected,
+        "errors": errors
+    }
+
+def _discard_staged_upload(params):
+    if params.get('path') and os.path.exists(params['path']):
+        os.remove(params['path'])
+
+def _job_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _process_alive(pid):
+    if os.name != 'posix':
+        return True  # os.kill(pid, 0) would terminate it on Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def job_to_dict(job):
+    live = job_runner.progress(job.id) if job.status == 'running' else None
+    progress, message = live if live is not None else (job.progress, job.message)
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": round(progress, 4),
+        "message": message,
+        "params": {key: value for key, value in json.loads(job.params).items() if key != 'path'},
+        "error": job.error,
+        "cancel_requested": job.cancel_requested,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    }
+
+def fail_lost_jobs():
+    """Mark queued or running jobs of exited processes on this host as failed."""
+    owner, host = _job_owner(), socket.gethostname()
+    lost = []
+    for job_id, job_owner in db.session.query(Job.id, Job.owner).filter(Job.status.in_(JOB_ACTIVE_STATUSES)):
+        job_host, _, pid = job_owner.rpartition(':')
+        if job_owner != owner and job_host == host and not _process_alive(int(pid)):
+            lost.append(job_id)
+    db.session.commit()
+    if lost:
+        begin_chain_write()
+        now = datetime.utcnow()
+        db.session.execute(update(Job).where(Job.id.in_(lost), Job.status.in_(JOB_ACTIVE_STATUSES)).values(
+            status='failed', error="The process running this job exited before it finished",
+            finished_at=now, updated_at=now
+        ))
+        for params in db.session.query(Job.params).filter(Job.id.in_(lost), Job.kind == 'import_trades'):
+            _discard_staged_upload(json.loads(params[0]))
+        db.session.commit()
+
+def _persist_job_progress(job_id, fraction, message):
+    """Store a running job's progress; returns whether a cancel was requested through the table.
+
+    Called from the job's own thread and session, so it only writes when the job has no
+    uncommitted changes that the commit would otherwise publish half-done.
+    """
+    session = db.session
+    if session.new or session.dirty or session.deleted or session.info.get('changed_tables'):
+        return False
+    session.execute(update(Job).where(Job.id == job_id).values(
+        progress=fraction, message=message[:255] if message else None, updated_at=datetime.utcnow()
+    ))
+    cancel_requested = session.query(Job.cancel_requested).filter(Job.id == job_id).scalar()
+    session.commit()
+    return bool(cancel_requested)
+
+def run_job(job_id, context):
+    """Run a queued job in a runner thread and record how it ended."""
+    with app.app_context():
+        now = datetime.utcnow()
+        claimed = db.session.execute(update(Job).where(Job.id == job_id, Job.status == 'queued').values(
+            status='running', started_at=now, updated_at=now, owner=_job_owner()
+        )).rowcount
+        db.session.commit()
+        if not claimed:
+            return  # cancelled while it waited
+        job = db.session.get(Job, job_id)
+        kind, params = job.kind, json.loads(job.params)
+        try:
+            result = JOB_KINDS[kind][0](context, params)
+            db.session.commit()
+            outcome = {'status': 'succeeded', 'progress': 1, 'result': json.dumps(result)}
+        except jobs.JobCancelled:
+            db.session.rollback()
+            outcome = {'status': 'cancelled'}
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception("Job %d (%s) failed", job_id, kind)
+            outcome = {'status': 'failed', 'error': str(e) or type(e).__name__}
+        now = datetime.utcnow()
+        db.session.execute(update(Job).where(Job.id == job_id).values(
+            message=context.message, finished_at=now, updated_at=now, **outcome
+        ))
+        db.session.commit()
+
+def submit_job(kind, params, dedup_key=None):
+    """Queue a job unless identical work is queued, running or finished on unchanged data.
+
+    Returns (job, created); job is None when this process's queue is full.
+    """
+    reuse_tables = JOB_KINDS[kind][1]
+    if dedup_key is None:
+        dedup_key = f"{kind}:{hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()}"
+    versions = ','.join(map(str, current_data_versions(reuse_tables))) if reuse_tables else None
+    fail_lost_jobs()
+
+    reusable = Job.status.in_(JOB_ACTIVE_STATUSES)
+    if versions is not None:
+        reusable = reusable | ((Job.status == 'succeeded') & (Job.data_versions == versions))
+    existing = Job.query.filter(Job.dedup_key == dedup_key, reusable).order_by(Job.id.desc()).first()
+    if existing is not None:
+        return existing, False
+    db.session.commit()
+
+    begin_chain_write()
+    job = Job(kind=kind, params=json.dumps(params), dedup_key=dedup_key, data_versions=versions,
+              status='queued', progress=0, cancel_requested=False, owner=_job_owner())
+    db.session.add(job)
+    try:
+        db.session.flush()
+        job_id = job.id
+        db.session.commit()
+    except IntegrityError:
+        # Another request or process queued the same work a moment ago
+        db.session.rollback()
+        return Job.query.filter(Job.dedup_key == dedup_key).order_by(Job.id.desc()).first(), False
+
+    if not job_runner.submit(job_id, functools.partial(run_job, job_id), on_progress=_persist_job_progress):
+        begin_chain_write()
+        db.session.execute(delete(Job).where(Job.id == job_id))
+        db.session.commit()
+        return None, False
+    return job, True
+
+def _job_submitted(job, created):
+    if job is None:
+        return jsonify({"error": "The job queue is full; try again later"}), 503
+    return jsonify({**job_to_dict(job), "deduplicated": not created}), 202 if created else 200
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Queue a background job from {"kind": ..., "params": {...}}.
+
+    Answers 202 with the new job, or 200 with the identical job already queued or running,
+    or finished against data that has not changed since.
+    """
+    data = request.json or {}
+    kind = data.get('kind')
+    public_kinds = [name for name, entry in JOB_KINDS.items() if entry[3]]
+    if kind not in public_kinds:
+        return jsonify({"error": f"kind must be one of {', '.join(public_kinds)}"}), 400
+    params = data.get('params') or {}
+    if not isinstance(params, dict):
+        return jsonify({"error": "params must be an object"}), 400
+    parse_params = JOB_KINDS[kind][2]
+    if parse_params is not None:
+        params, error = parse_params(params)
+        if error:
+            return jsonify({"error": error}), 400
+    elif params:
+        return jsonify({"error": f"Jobs of kind '{kind}' take no params"}), 400
+    return _job_submitted(*submit_job(kind, params))
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """Most recent jobs first, optionally filtered by status and kind."""
+    try:
+        limit = min(max(int(request.args.get('limit', JOB_PAGE_SIZE)), 1), JOB_PAGE_LIMIT)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    fail_lost_jobs()
+    query = Job.query
+    if request.args.get('status'):
+        query = query.filter(Job.status == request.args['status'])
+    if request.args.get('kind'):
+        query = query.filter(Job.kind == request.args['kind'])
+    return jsonify([job_to_dict(job) for job in query.order_by(Job.id.desc()).limit(limit)]), 200
+
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    fail_lost_jobs()
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_to_dict(job)), 200
+
+@app.route('/jobs/<int:job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """The job's result once it succeeded; 202 with its status while it is queued or running."""
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job.status == 'succeeded':
+        return Response(job.result, mimetype='application/json')
+    return jsonify(job_to_dict(job)), 202 if job.status in JOB_ACTIVE_STATUSES else 409
+
+@app.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued job, or ask a running one to stop at its next progress report."""
+    # Dequeue it, or flag it if it runs in this process, before waiting for the write lock its
+    # own transactions may be holding
+    job_runner.cancel(job_id)
+    begin_chain_write()
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job.status not in JOB_ACTIVE_STATUSES:
+        return jsonify({"error": f"Job is already {job.status}"}), 409
+
+    now = datetime.utcnow()
+    dequeued = db.session.execute(update(Job).where(Job.id == job_id, Job.status == 'queued').values(
+        status='cancelled', finished_at=now, updated_at=now
+    )).rowcount
+    if not dequeued:
+        # Running, possibly in another process, which reads the flag with its next progress report
+        db.session.execute(update(Job).where(Job.id == job_id, Job.status == 'running').values(cancel_requested=True))
+    db.session.commit()
+    if dequeued:
+        _discard_staged_upload(json.loads(job.params))
+    return jsonify(job_to_dict(job)), 202
+
 @app.route('/add_deposit', methods=['POST'])
 def add_deposit():
     data = request.json
@@ -408,25 +3088,49 @@ def add_deposit():
     if amount <= 0:
         return jsonify({'error': 'Amount must be greater than 0.'}), 400
 
+    try:
+        date = _parse_timestamp(data.get('date'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Date must be in the format YYYY-MM-DDTHH:MM:SS.'}), 400
+
     # Add deposit logic
-    new_deposit = Transaction(amount=amount, type='deposit')
+    begin_chain_write()
+    account, error = load_account(data)
+    if error:
+        return error
+    try:
+        check_not_archived(account, date, flow=True)
+    except ArchivedHistoryError as e:
+        return jsonify({'error': str(e)}), 400
+    ensure_metrics_aggregate(account.id)
+    new_deposit = Transaction(account_id=account.id, amount=amount, type='deposit', date=date)
     db.session.add(new_deposit)
+    record_cash_flow_metrics(account.id, amount)
+    apply_cash_flow_rollups(account.id, date, amount)
+    rechain_from(account, date)
+    publish_event('transaction_added', {'transaction': transaction_to_dict(new_deposit)}, account)
     db.session.commit()
 
     return jsonify({'message': f'Deposit of {amount} added successfully!'})
 
 
 @app.route('/get_transactions', methods=['GET'])
+@cached_response('transaction')
 def get_transactions():
-    transactions = Transaction.query.all()
-    return jsonify([
-        {
-            'id': t.id,
-            'amount': t.amount,
-            'type': t.type,
-            'date': t.date.strftime('%Y-%m-%d %H:%M:%S')
-        } for t in transactions
-    ])
+    try:
+        account_id = requested_account_id()
+    except ValueError:
+        return jsonify({'error': 'account_id must be an integer'}), 400
+    transactions = Transaction.query.filter(Transaction.account_id == account_id).order_by(Transaction.date).all()
+    return jsonify([transaction_to_dict(t) for t in transactions])
+
+def transaction_to_dict(transaction):
+    return {
+        'id': transaction.id,
+        'amount': transaction.amount,
+        'type': transaction.type,
+        'date': transaction.date.strftime('%Y-%m-%d %H:%M:%S')
+    }
 
 @app.route('/add_withdrawal', methods=['POST'])
 def add_withdrawal():
@@ -436,20 +3140,34 @@ def add_withdrawal():
     if not amount or amount <= 0:
         return jsonify({'error': 'Invalid withdrawal amount'}), 400
 
-    # Add withdrawal to the database
-    withdrawal = Transaction(amount=-amount, type='withdrawal')
-    db.session.add(withdrawal)
-
-    # Update the account balance for the most recent trade
-    last_trade = Trade.query.order_by(Trade.id.desc()).first()
-    new_balance = (last_trade.account_balance if last_trade else 0) - amount
+    try:
+        date = _parse_timestamp(data.get('date'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Date must be in the format YYYY-MM-DDTHH:MM:SS.'}), 400
+
+    # Balance at the time of the withdrawal, before it is applied
+    begin_chain_write()
+    account, error = load_account(data)
+    if error:
+        return error
+    try:
+        check_not_archived(account, date, flow=True)
+    except ArchivedHistoryError as e:
+        return jsonify({'error': str(e)}), 400
+    balance, _ = chain_head(account, before=date)
+    new_balance = balance - amount
 
     if new_balance < 0:
         return jsonify({'error': 'Withdrawal would result in negative balance'}), 400
 
-    if last_trade:
-        last_trade.account_balance = new_balance
-
+    # Add withdrawal to the database and relink any trades recorded after it
+    ensure_metrics_aggregate(account.id)
+    withdrawal = Transaction(account_id=account.id, amount=-amount, type='withdrawal', date=date)
+    db.session.add(withdrawal)
+    record_cash_flow_metrics(account.id, -amount)
+    apply_cash_flow_rollups(account.id, date, -amount)
+    rechain_from(account, date)
+    publish_event('transaction_added', {'transaction': transaction_to_dict(withdrawal)}, account)
     db.session.commit()
 
     return jsonify({'message': 'Withdrawal recorded successfully', 'new_balance': new_balance})
@@ -459,24 +3177,31 @@ def system_settings():
     return render_template('system_settings.html')
 
 
-# Database Initialization
-if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-    app.run(debug=False)
-
 @app.route('/')
 @app.route('/dashboard')
 def dashboard():
-    trades = Trade.query.all()
-    labels = [t.date.strftime('%Y-%m-%d') for t in trades]
-    account_balances = [t.account_balance for t in trades]
-    return render_template('dashboard.html', labels=labels, account_balances=account_balances)
+    # A bounded, downsampled curve; the page can zoom through /equity_curve
+    try:
+        account_id = requested_account_id()
+    except ValueError:
+        return jsonify({"error": "account_id must be an integer"}), 400
+    curve = equity_curve(account_id)
+    return render_template('dashboard.html', labels=curve['timestamps'], account_balances=curve['balances'])
 
 @app.route('/trades')
 def trades():
-    all_trades = Trade.query.all()
-    return render_template('trades.html', trades=all_trades)
+    # One keyset page with market and setup loaded in the same query
+    try:
+        query = filter_trades(Trade.query.options(joinedload(Trade.market), joinedload(Trade.trade_setup)), request.args)
+        after = decode_trade_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except (TypeError, ValueError, binascii.Error):
+        return jsonify({"error": "Invalid filter or cursor"}), 400
+    page = _keyset_page(query, after, TRADE_PAGE_SIZE + 1)
+    next_cursor = None
+    if len(page) > TRADE_PAGE_SIZE:
+        page = page[:TRADE_PAGE_SIZE]
+        next_cursor = encode_trade_cursor(page[-1].date_entered, page[-1].id)
+    return render_template('trades.html', trades=page, next_cursor=next_cursor)
 
 @app.route('/transactions')
 def transactions():
@@ -490,3 +3215,9 @@ def tags():
 def markets():
     return render_template('markets.html')
 
+
+# Database Initialization
+if __name__ == '__main__':
+    with app.app_context():
+        db.create_all()
+    app.run(debug=False)
@@ -0,0 +1,101 @@
+"""Cold storage for old closed trades: a second SQLite file ATTACHed to every connection as `archive`.
+
+Trades leave the main table in chain order, one balance-checkpoint interval at a time, so
+an account's archived trades all precede its hot ones and the boundary between them is
+always a checkpoint. The chain, metrics aggregate, rollups, daily balance log and
+checkpoints stay in the main database and keep covering the archived range, so nothing
+but an explicit history read touches the archive. Note columns are stored zlib-compressed.
+
+Commits spanning two WAL databases are atomic per file only, so no transaction writes
+both. A batch is first copied into the archive, where it stays invisible: archived rows
+are only read up to the account's watermark (Account.archived_ts/archived_trade_id), which
+lives in the main database. A second, main-only transaction then deletes the batch from
+the trade table and advances the watermark, switching readers over atomically. Copies
+left behind by an interrupted batch lie past the watermark and are purged by the next run.
+
+Every connection gets two temp views, whether or not an archive is configured:
+archived_trade (the archive up to the watermark, notes decompressed; empty without one)
+and trade_history (archived_trade UNION ALL main.trade). SQLite pushes WHERE terms into
+both arms of the union, so filtered aggregates over trade_history use each table's
+indexes, but ordering the union needs a sort: ordered reads walk archived_trade and then
+trade instead.
+"""
+import zlib
+
+NOTE_COLUMNS = ('pre_trade_notes', 'post_trade_notes', 'feelings_after_trade')
+COMPRESSION_LEVEL = 6
+
+# One account's trades after the watermark (after_ts, after_id) up to and including (through_ts, through_id)
+_BATCH_RANGE = ("account_id = :account_id AND (date_entered, id) > (:after_ts, :after_id)"
+                " AND (date_entered, id) <= (:through_ts, :through_id)")
+# An account's archive rows past its watermark, left behind by an interrupted batch
+PURGE_SQL = ("DELETE FROM archive.trade_archive"
+             " WHERE account_id = :account_id AND (date_entered, id) > (:after_ts, :after_id)")
+# Fingerprint of a batch in the main table: any insert, delete or update into it changes it
+BATCH_STATE_SQL = f"SELECT COUNT(*), MAX(updated_at) FROM main.trade WHERE {_BATCH_RANGE}"
+# Trades of a batch that are still open or were closed on or after :horizon
+BATCH_BLOCKERS_SQL = (f"SELECT COUNT(*) FROM main.trade WHERE {_BATCH_RANGE}"
+                      " AND (date_exited IS NULL OR date_exited >= :horizon)")
+DELETE_BATCH_SQL = f"DELETE FROM main.trade WHERE {_BATCH_RANGE}"
+# Every id ever archived, including rows past the watermark, which a later batch will copy again
+MAX_ID_SQL = "SELECT MAX(id) FROM archive.trade_archive"
+
+
+def compress_note(value):
+    return None if value is None else zlib.compress(value.encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def decompress_note(value):
+    return None if value is None else zlib.decompress(value).decode('utf-8')
+
+
+def _archive_ddl(columns):
+    # Untyped columns keep whatever storage class the main table's values had
+    definitions = ', '.join('id INTEGER PRIMARY KEY' if name == 'id' else name for name in columns)
+    return (
+        f"CREATE TABLE IF NOT EXISTS archive.trade_archive ({definitions})",
+        "CREATE INDEX IF NOT EXISTS archive.ix_trade_archive_account_date"
+        " ON trade_archive (account_id, date_entered, id)",
+        "CREATE INDEX IF NOT EXISTS archive.ix_trade_archive_account_actual_return"
+        " ON trade_archive (account_id, actual_return)",
+    )
+
+
+def configure_connection(dbapi_connection, columns, path=None, pragmas=None):
+    """Register the note codecs, attach the archive at `path` and create the history views.
+
+    `dbapi_connection` is a sqlite3 connection and `columns` the trade table's column names
+    in order. The archive file and its schema are created on first use, and `pragmas`
+    (per-database ones such as journal_mode) are applied to it. Without a path the
+    archived_trade view is empty, so history reads work unchanged. Run it after setting
+    temp_store, which drops every temp view.
+    """
+    dbapi_connection.create_function('compress_note', 1, compress_note, deterministic=True)
+    dbapi_connection.create_function('decompress_note', 1, decompress_note, deterministic=True)
+    names = ', '.join(columns)
+    cursor = dbapi_connection.cursor()
+    try:
+        if path:
+            cursor.execute("ATTACH DATABASE ? AS archive", (path,))
+            for pragma, value in (pragmas or {}).items():
+                cursor.execute(f"PRAGMA archive.{pragma} = {value}")
+            for statement in _archive_ddl(columns):
+                cursor.execute(statement)
+            selected = ', '.join(f"decompress_note(t.{name}) AS {name}" if name in NOTE_COLUMNS else f"t.{name}"
+                                 for name in columns)
+            archived = (f"SELECT {selected} FROM archive.trade_archive AS t JOIN main.account AS a ON a.id = t.account_id"
+                        " WHERE (t.date_entered, t.id) <= (a.archived_ts, a.archived_trade_id)")
+        else:
+            archived = f"SELECT {names} FROM main.trade WHERE 0"
+        cursor.execute(f"CREATE TEMP VIEW IF NOT EXISTS archived_trade AS {archived}")
+        cursor.execute(f"CREATE TEMP VIEW IF NOT EXISTS trade_history AS"
+                       f" SELECT {names} FROM archived_trade UNION ALL SELECT {names} FROM main.trade")
+    finally:
+        cursor.close()
+
+
+def copy_statement(columns):
+    """SQL copying one batch of an account's trades into the archive with their notes compressed."""
+    names = ', '.join(columns)
+    selected = ', '.join(f"compress_note({name})" if name in NOTE_COLUMNS else name for name in columns)
+    return f"INSERT INTO archive.trade_archive ({names}) SELECT {selected} FROM main.trade WHERE {_BATCH_RANGE}"
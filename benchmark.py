@@ -0,0 +1,237 @@
+"""Endpoint benchmarks against generated journals, compared with a saved JSON baseline.
+
+Usage: python benchmark.py [--sizes 1000,100000] [--requests 30] [--baseline benchmark_baseline.json]
+                           [--save] [--tolerance 0.25] [--data-dir DIR]
+
+For every size a deterministic journal is generated with initialize_db.py (cached in
+--data-dir when given), then each scenario is driven through the Flask test client in a fresh
+process. The response cache is disabled so every request does its real work. Per scenario the
+run records latency percentiles, SQL statements per request and the peak Python memory of
+one traced request. --save writes the results as the new baseline; otherwise they are compared
+with it and the exit status is 1 if any scenario regressed beyond --tolerance.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+DEFAULT_SIZES = '1000,100000'
+SEED = 7
+MIN_LATENCY_DELTA_MS = 2.0
+
+TRADE = {
+    'asset': 'EURUSD', 'market_id': 1, 'direction': 'Long', 'trade_setup_id': 1, 'number_of_confluences': 2,
+    'planned_return': 20, 'actual_return': 12.5, 'risk': 10, 'position_size': 1, 'result': 12.3,
+    'pre_trade_notes': 'Benchmark entry at the level.', 'feelings_after_trade': 'Calm.'
+}
+
+# name, method, url, payload, largest size to run it at (None for all). Reads run before
+# writes so they see the generated journal as is. New trades and cash flows default to now,
+# after the generated history, so they append to the chain.
+SCENARIOS = [
+    ('get_trades_page', 'GET', '/get_trades?limit=100', None, None),
+    ('get_trades_deep_page', 'GET', '/get_trades?limit=100&cursor={middle_cursor}', None, None),
+    ('get_trades_filtered', 'GET', '/get_trades?limit=100&market_id=2&start=2020-01-01', None, None),
+    ('get_trades_all', 'GET', '/get_trades', None, 100000),
+    ('metrics', 'GET', '/metrics', None, None),
+    # The dashboard page renders this series; its template is not part of the repository
+    ('dashboard', 'GET', '/equity_curve', None, None),
+    ('ledger_page', 'GET', '/ledger?limit=100', None, None),
+    ('ledger_returns', 'GET', '/ledger/returns', None, None),
+    ('balance_as_of_12', 'GET', '/balance_as_of?' + '&'.join(f'at=20{year}-{month:02d}-15' for year in (21, 22, 23) for month in (1, 4, 7, 10)), None, None),
+    ('add_trade', 'POST', '/add_trade', TRADE, None),
+    ('add_trade_batch_100', 'POST', '/add_trade', [TRADE] * 100, None),
+    ('add_deposit', 'POST', '/add_deposit', {'amount': 250}, None),
+    ('add_withdrawal', 'POST', '/add_withdrawal', {'amount': 10}, None),
+]
+
+
+def _load_app(database_path):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + database_path
+    import logging
+    logging.disable(logging.INFO)
+    import app as journal
+    return journal
+
+
+def generate(database_path, size):
+    journal = _load_app(database_path)
+    import initialize_db
+    with journal.app.app_context():
+        journal.db.create_all()
+        initialize_db.load_journal(size, seed=SEED)
+
+
+def prepare_database(size, data_dir):
+    """Path of a fresh copy of the generated journal for `size` trades, and the seconds spent generating."""
+    work_path = os.path.join(tempfile.mkdtemp(prefix='trading_journal_bench_'), 'bench.db')
+    cached = os.path.join(data_dir, f'journal_{size}_{SEED}.db') if data_dir else None
+    started = time.perf_counter()
+    if not (cached and os.path.exists(cached)):
+        target = cached or work_path
+        context = multiprocessing.get_context('spawn')
+        process = context.Process(target=generate, args=(target, size))
+        process.start()
+        process.join()
+        if process.exitcode:
+            raise RuntimeError(f"Generating {size} trades failed")
+    generate_seconds = time.perf_counter() - started
+    if cached:
+        shutil.copyfile(cached, work_path)
+    return work_path, generate_seconds
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def run_scenarios(database_path, size, requests, results):
+    journal = _load_app(database_path)
+    journal.response_cache.max_bytes = 0  # never store, so reads are measured cold
+    client = journal.app.test_client()
+    statements = [0]
+
+    with journal.app.app_context():
+        journal.event.listen(journal.db.engine, 'before_cursor_execute',
+                             lambda *args: statements.__setitem__(0, statements[0] + 1))
+        Trade = journal.Trade
+        middle = journal.db.session.query(Trade.date_entered, Trade.id).order_by(
+            Trade.date_entered, Trade.id).offset(size // 2).first()
+        middle_cursor = journal.encode_trade_cursor(*middle) if middle else ''
+        journal.db.session.remove()
+
+    def call(method, url, payload):
+        response = client.open(url, method=method, json=payload)
+        body = response.get_data()
+        # Streamed responses hold their request context, and its session, until closed, as a
+        # WSGI server would do after sending them
+        response.close()
+        return response.status_code, len(body)
+
+    measured = {}
+    for name, method, url, payload, max_size in SCENARIOS:
+        if max_size is not None and size > max_size:
+            continue
+        url = url.format(middle_cursor=middle_cursor)
+        repeat = requests if max_size is None else max(3, requests // 10)
+        latencies, counts, errors, response_bytes = [], [], 0, 0
+        for _ in range(repeat):
+            before = statements[0]
+            started = time.perf_counter()
+            status, response_bytes = call(method, url, payload)
+            latencies.append((time.perf_counter() - started) * 1000)
+            counts.append(statements[0] - before)
+            errors += status >= 400
+
+        # One more request under tracemalloc, which is too slow to leave on for the timings
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        call(method, url, payload)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        measured[name] = {
+            'requests': repeat,
+            'errors': errors,
+            'p50_ms': round(_percentile(latencies, 0.5), 3),
+            'p90_ms': round(_percentile(latencies, 0.9), 3),
+            'p99_ms': round(_percentile(latencies, 0.99), 3),
+            'mean_ms': round(statistics.fmean(latencies), 3),
+            'queries': int(statistics.median(counts)),
+            'peak_memory_kb': round(peak / 1024, 1),
+            'response_bytes': response_bytes,
+        }
+    results.put(measured)
+
+
+def run_size(size, requests, data_dir):
+    database_path, generate_seconds = prepare_database(size, data_dir)
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=run_scenarios, args=(database_path, size, requests, results))
+    process.start()
+    measured = results.get()
+    process.join()
+    shutil.rmtree(os.path.dirname(database_path), ignore_errors=True)
+    return measured, generate_seconds
+
+
+def compare(baseline, current, tolerance):
+    """Print each scenario against the baseline; returns the regressions found."""
+    regressions = []
+    print(f"{'size':>8} {'scenario':<22}{'p50 ms':>10}{'base':>10}{'change':>9}{'queries':>9}{'base':>6}"
+          f"{'peak KB':>10}{'base':>10}")
+    for size, scenarios in current['results'].items():
+        for name, result in scenarios.items():
+            previous = baseline.get('results', {}).get(size, {}).get(name)
+            if previous is None:
+                print(f"{size:>8} {name:<22}{result['p50_ms']:>10.2f}{'-':>10}{'new':>9}{result['queries']:>9}")
+                continue
+            change = result['p50_ms'] / previous['p50_ms'] - 1 if previous['p50_ms'] else 0
+            problems = []
+            # Sub-millisecond swings on fast endpoints are timer and scheduler noise
+            if change > tolerance and result['p50_ms'] - previous['p50_ms'] > MIN_LATENCY_DELTA_MS:
+                problems.append('latency')
+            if result['queries'] > previous['queries']:
+                problems.append('queries')
+            if previous['peak_memory_kb'] and result['peak_memory_kb'] > previous['peak_memory_kb'] * (1 + tolerance):
+                problems.append('memory')
+            if result['errors'] > previous['errors']:
+                problems.append('errors')
+            print(f"{size:>8} {name:<22}{result['p50_ms']:>10.2f}{previous['p50_ms']:>10.2f}{change:>+9.0%}"
+                  f"{result['queries']:>9}{previous['queries']:>6}{result['peak_memory_kb']:>10.0f}"
+                  f"{previous['peak_memory_kb']:>10.0f}  {' '.join(problems)}")
+            regressions.extend((size, name, problem) for problem in problems)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help="Comma-separated trade counts, e.g. 1000,100000,1000000")
+    parser.add_argument('--requests', type=int, default=30, help="Timed requests per scenario")
+    parser.add_argument('--baseline', default='benchmark_baseline.json')
+    parser.add_argument('--save', action='store_true', help="Write this run as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed p50 latency and memory growth")
+    parser.add_argument('--data-dir', help="Keep generated journals here and reuse them across runs")
+    args = parser.parse_args()
+
+    current = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'seed': SEED,
+        'requests': args.requests,
+        'generate_seconds': {},
+        'results': {},
+    }
+    for size in (int(value) for value in args.sizes.split(',')):
+        measured, generate_seconds = run_size(size, args.requests, args.data_dir)
+        current['results'][str(size)] = measured
+        current['generate_seconds'][str(size)] = round(generate_seconds, 1)
+        print(f"{size} trades: generated in {generate_seconds:.1f}s, {len(measured)} scenarios")
+
+    if args.save or not os.path.exists(args.baseline):
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(current, baseline_file, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        compare({}, current, args.tolerance)
+        return
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare(baseline, current, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} regressions against {args.baseline}")
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""Run every route's SQL through EXPLAIN QUERY PLAN and fail if a large table is scanned.
+
+Usage: python check_query_plans.py
+
+Works against a throwaway SQLite database seeded with a little data, so it is safe to
+run anywhere. Exits with status 1 and prints the offending statements when a query on
+a large table degrades to a full scan or a whole-table sort.
+"""
+import os
+import re
+import sys
+import tempfile
+from datetime import datetime
+
+_db_dir = tempfile.mkdtemp(prefix='trading_journal_plans_')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_db_dir, 'plans.db')
+os.environ['ARCHIVE_DATABASE'] = os.path.join(_db_dir, 'archive.db')
+
+from sqlalchemy import event
+
+from app import (app, db, Account, BalanceCheckpoint, Market, Trade, TradeSetup, DEFAULT_ACCOUNT_ID, archive_trades,
+                 rebuild_metrics_aggregate)
+
+# Tables that grow with the journal; small lookup tables may be scanned freely.
+LARGE_TABLES = ('trade', 'transaction', 'account_balance_log', 'pnl_rollup', 'balance_checkpoint', 'trade_archive')
+
+# Routes that return an entire table by design.
+FULL_READ_ROUTES = {
+    '/get_transactions',
+}
+
+ROUTES = [
+    ('POST', '/add_market', {'name': 'Stocks'}),
+    ('POST', '/add_trade_setup', {'name': 'Swing Failure', 'description': 'Failed swings'}),
+    ('POST', '/add_deposit', {'amount': 500, 'date': '2024-01-01T09:00:00'}),
+    ('POST', '/add_trade', [
+        {'date_entered': f'2024-01-{day:02d}T10:00:00', 'asset': 'EURUSD', 'market_id': 1, 'direction': 'Long',
+         'trade_setup_id': 1 + day % 2, 'number_of_confluences': 2, 'position_size': 1, 'risk': 10,
+         'actual_return': day - 10, 'result': day - 10}
+        for day in range(1, 21)
+    ]),
+    ('POST', '/add_trade', {'date_entered': '2024-01-05T12:00:00', 'asset': 'GBPUSD', 'market_id': 2,
+                            'direction': 'Short', 'trade_setup_id': 1, 'number_of_confluences': 1,
+                            'position_size': 1, 'result': 5, 'actual_return': 5}),
+    ('PUT', '/update_trade/3', {'result': 12, 'actual_return': 12}),
+    ('DELETE', '/delete_trade/4', None),
+    ('POST', '/add_withdrawal', {'amount': 50, 'date': '2024-01-10T09:00:00'}),
+    ('POST', '/accounts', {'name': 'Second', 'starting_balance': 5000}),
+    ('POST', '/add_trade', {'account_id': 2, 'date_entered': '2024-01-02T10:00:00', 'asset': 'EURUSD', 'market_id': 1,
+                            'direction': 'Long', 'trade_setup_id': 1, 'number_of_confluences': 1,
+                            'position_size': 1, 'result': 20, 'actual_return': 20}),
+    ('POST', '/add_trade', {'account_id': 2, 'date_entered': '2024-01-01T10:00:00', 'asset': 'EURUSD', 'market_id': 1,
+                            'direction': 'Short', 'trade_setup_id': 1, 'number_of_confluences': 1,
+                            'position_size': 1, 'result': -10, 'actual_return': -10}),
+    ('POST', '/add_deposit', {'account_id': 2, 'amount': 100, 'date': '2024-01-03T09:00:00'}),
+    ('POST', '/set_risk', {'account_id': 2, 'risk_percentage': 0.01}),
+    ('GET', '/get_risk?account_id=2', None),
+    ('GET', '/accounts', None),
+    ('GET', '/get_trades', None),
+    ('GET', '/get_trades?limit=5', None),
+    ('GET', '/get_trades?limit=5&market_id=1&start=2024-01-03', None),
+    ('GET', '/get_trades?trade_setup_id=2&format=ndjson', None),
+    ('GET', '/get_trades?asset=EURUSD&limit=5', None),
+    ('GET', '/get_trades?account_id=2&limit=5', None),
+    ('GET', '/get_trades?include_archived=1&limit=5', None),
+    ('GET', '/get_trades?include_archived=1&market_id=1&format=ndjson', None),
+    ('GET', '/get_transactions', None),
+    ('GET', '/get_markets', None),
+    ('GET', '/get_trade_setups', None),
+    ('GET', '/metrics', None),
+    ('GET', '/metrics?account_id=2', None),
+    ('GET', '/analytics?account_id=2', None),
+    ('GET', '/equity_curve?account_id=2&resolution=trade', None),
+    ('GET', '/analytics?include_archived=1', None),
+    ('GET', '/equity_curve?resolution=trade&include_archived=1', None),
+    ('GET', '/ledger?limit=5', None),
+    ('GET', '/ledger?account_id=2&start=2024-01-02', None),
+    ('GET', '/ledger/returns?start=2024-01-05&end=2024-01-15', None),
+    ('GET', '/balance_as_of?at=2024-01-08&at=2024-01-03T12:00:00', None),
+    ('GET', '/balance_between?account_id=2&start=2024-01-01&end=2024-01-04', None),
+    ('GET', '/calendar?period=week&start=2024-01-01&end=2024-01-31', None),
+    ('GET', '/search_trades?q=euro*&market_id=1', None),
+    ('GET', '/search_trades?q=eurusd&sort=newest', None),
+    ('GET', '/jobs?status=succeeded', None),
+    ('GET', '/jobs?kind=rechain', None),
+]
+
+_SCAN = re.compile(r'^SCAN (\w+)(?! USING)')
+_SORT = re.compile(r'USE TEMP B-TREE FOR ORDER BY')
+
+
+def _table_problems(plan):
+    problems = []
+    for _, parent, _, detail in plan:
+        scan = _SCAN.match(detail)
+        if scan and scan.group(1) in LARGE_TABLES:
+            problems.append(detail)
+        elif _SORT.search(detail) and any(
+            re.match(rf'^(SCAN|SEARCH) {table}\b', row[3]) for table in LARGE_TABLES for row in plan
+            if row[1] == parent
+        ):
+            problems.append(detail)
+    return problems
+
+
+def seed():
+    """Start from a non-empty journal so the plans reflect steady state, not first-write paths."""
+    db.create_all()
+    db.session.add_all([Market(name='Forex'), TradeSetup(name='Range Breakout', description='Breakouts')])
+    db.session.flush()
+    db.session.add(Trade(date_entered=datetime(2023, 12, 31, 10), date_exited=datetime(2023, 12, 31, 11), asset='EURUSD',
+                         market_id=1, direction='Long', trade_setup_id=1, account_change=0, cumulative_pnl=0,
+                         account_balance=1000))
+    # A checkpoint after it, so the archiving pass below has a batch to move
+    db.session.add(BalanceCheckpoint(account_id=DEFAULT_ACCOUNT_ID, trade_count=1, ts=datetime(2023, 12, 31, 10),
+                                     trade_id=1, balance=1000, cumulative_pnl=0))
+    account = db.session.get(Account, DEFAULT_ACCOUNT_ID)
+    account.head_ts, account.head_trades = datetime(2023, 12, 31, 10), 1
+    rebuild_metrics_aggregate(DEFAULT_ACCOUNT_ID)
+    db.session.commit()
+
+
+def main():
+    with app.app_context():
+        seed()
+        plans = []
+        current_route = [None]
+
+        def explain(conn, cursor, statement, parameters, context, executemany):
+            # Plain INSERT ... VALUES never scans; INSERT ... SELECT is explained for its SELECT
+            if not re.match(r'\s*(SELECT|UPDATE|DELETE|WITH|CREATE TEMP TABLE|INSERT\b.*\bSELECT\b)', statement, re.I | re.S):
+                return
+            if executemany:
+                parameters = parameters[0] if parameters else ()
+            explain_cursor = conn.connection.dbapi_connection.cursor()
+            try:
+                plan = explain_cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+            finally:
+                explain_cursor.close()
+            plans.append((current_route[0], statement, plan))
+
+        event.listen(db.engine, 'before_cursor_execute', explain)
+        current_route[0] = 'archive_trades'
+        archive_trades(DEFAULT_ACCOUNT_ID, datetime(2024, 1, 1))
+        client = app.test_client()
+        for method, path, body in ROUTES:
+            current_route[0] = path.split('?')[0]
+            response = client.open(path, method=method, json=body)
+            response.get_data()  # drain streamed bodies so their queries run
+            if response.status_code >= 400:
+                print(f"{method} {path} returned {response.status_code}; its queries may be incomplete")
+        event.remove(db.engine, 'before_cursor_execute', explain)
+
+    failures, checked = [], set()
+    for route, statement, plan in plans:
+        if (route, statement) in checked:
+            continue
+        checked.add((route, statement))
+        problems = _table_problems(plan)
+        if problems and route not in FULL_READ_ROUTES:
+            failures.append((route, statement, problems))
+
+    for route, statement, problems in failures:
+        print(f"\n{route}: {'; '.join(problems)}\n    {' '.join(statement.split())}")
+    print(f"\nChecked {len(checked)} distinct statements across {len(ROUTES)} requests: {len(failures)} degraded.")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
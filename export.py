@@ -0,0 +1,217 @@
+"""Columnar exports of the trade, transaction and balance log tables.
+
+Rows are read from SQLite with a raw DB-API cursor in fixed-size batches and converted to
+typed Arrow record batches (timestamps as microseconds, dates as days), so memory stays
+bounded by one batch whatever the table size. The batches are written as Parquet or
+Arrow IPC files, or as an Arrow IPC stream for HTTP responses.
+
+Incremental exports select rows whose updated_at is after the previous export's watermark,
+less WRITE_TRANSACTION_LAG: updated_at is stamped when a row is flushed, but the row is
+only visible once its transaction commits, so a row stamped just before one export's
+watermark may commit after that export has read. Consecutive incrementals overlap by the
+lag to pick such rows up, and the rows they share are merged like any other. Deleted rows leave no trace to select, so each manifest also records every table's current
+row count: a consumer whose merged copy disagrees should take a full snapshot. Merge trades
+and transactions by id and daily balances by (account_id, date), since rechains re-insert
+those rows. Every account is exported; each row carries its account_id. Archived trades
+(see archive.py) come as archived_trade; archiving moves rows there without touching
+updated_at, so it shows up as a drop in trade's row count and calls for a full snapshot.
+"""
+import json
+import os
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+EXPORT_BATCH_SIZE = 65536
+EXPORT_FORMATS = {'parquet': 'parquet', 'arrow': 'arrow'}  # format -> file extension
+EXPORT_STATE_FILE = 'export_state.json'
+SQLITE_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+# The longest a write transaction may stay open after stamping a row. Request writes commit
+# within seconds; the rechain and rebuild commands commit once, so after one that ran longer
+# than this on a large journal, take a full snapshot.
+WRITE_TRANSACTION_LAG = timedelta(minutes=10)
+
+
+def _micros(column):
+    # SQLAlchemy stores DateTime as 'YYYY-MM-DD HH:MM:SS.ffffff'; keep the microseconds exact
+    return (f"CAST(strftime('%s', {column}) AS INTEGER) * 1000000"
+            f" + CAST(COALESCE(NULLIF(substr({column}, 21, 6), ''), '0') AS INTEGER)")
+
+
+def _days(column):
+    return f"CAST(julianday({column}) - 2440587.5 AS INTEGER)"
+
+
+def _trade_table(table):
+    """Export definition of the trade table or the archived_trade view, with names joined in."""
+    return (f"{table} LEFT JOIN market ON market.id = {table}.market_id "
+            f"LEFT JOIN trade_setup ON trade_setup.id = {table}.trade_setup_id", [
+        ('id', f'{table}.id', pa.int64()),
+        ('account_id', f'{table}.account_id', pa.int64()),
+        ('date_entered', _micros(f'{table}.date_entered'), pa.timestamp('us')),
+        ('date_exited', _micros(f'{table}.date_exited'), pa.timestamp('us')),
+        ('asset', f'{table}.asset', pa.string()),
+        ('market_id', f'{table}.market_id', pa.int64()),
+        ('market_name', 'market.name', pa.string()),
+        ('direction', f'{table}.direction', pa.string()),
+        ('trade_setup_id', f'{table}.trade_setup_id', pa.int64()),
+        ('trade_setup_name', 'trade_setup.name', pa.string()),
+        ('number_of_confluences', f'{table}.number_of_confluences', pa.int64()),
+        ('planned_rr', f'{table}.planned_rr', pa.float64()),
+        ('planned_return', f'{table}.planned_return', pa.float64()),
+        ('actual_rr', f'{table}.actual_rr', pa.float64()),
+        ('actual_return', f'{table}.actual_return', pa.float64()),
+        ('risk', f'{table}.risk', pa.float64()),
+        ('position_size', f'{table}.position_size', pa.float64()),
+        ('roi_on_position', f'{table}.roi_on_position', pa.float64()),
+        ('account_change', f'{table}.account_change', pa.float64()),
+        ('account_change_percentage', f'{table}.account_change_percentage', pa.float64()),
+        ('cumulative_pnl', f'{table}.cumulative_pnl', pa.float64()),
+        ('account_balance', f'{table}.account_balance', pa.float64()),
+        ('pre_trade_notes', f'{table}.pre_trade_notes', pa.string()),
+        ('post_trade_notes', f'{table}.post_trade_notes', pa.string()),
+        ('feelings_after_trade', f'{table}.feelings_after_trade', pa.string()),
+        ('updated_at', _micros(f'{table}.updated_at'), pa.timestamp('us')),
+    ])
+
+
+# table -> (FROM clause, [(column name, SQL expression, Arrow type)])
+EXPORT_TABLES = {
+    'trade': _trade_table('trade'),
+    'archived_trade': _trade_table('archived_trade'),
+    'transaction': ('"transaction"', [
+        ('id', 'id', pa.int64()),
+        ('account_id', 'account_id', pa.int64()),
+        ('date', _micros('date'), pa.timestamp('us')),
+        ('amount', 'amount', pa.float64()),
+        ('type', 'type', pa.string()),
+        ('updated_at', _micros('updated_at'), pa.timestamp('us')),
+    ]),
+    'account_balance_log': ('account_balance_log', [
+        ('id', 'id', pa.int64()),
+        ('account_id', 'account_id', pa.int64()),
+        ('date', _days('date'), pa.date32()),
+        ('balance', 'balance', pa.float64()),
+        ('updated_at', _micros('updated_at'), pa.timestamp('us')),
+    ]),
+}
+
+
+def table_schema(table):
+    return pa.schema([(name, arrow_type) for name, _, arrow_type in EXPORT_TABLES[table][1]])
+
+
+def iter_record_batches(connection, table, since=None, batch_size=EXPORT_BATCH_SIZE):
+    """Yield `table` as Arrow record batches, optionally only rows updated after `since`.
+
+    `connection` is a DB-API sqlite3 connection; run every table of one snapshot inside the
+    same read transaction for a consistent cut.
+    """
+    source, columns = EXPORT_TABLES[table]
+    key = source.split()[0]
+    sql = f"SELECT {', '.join(expression for _, expression, _ in columns)} FROM {source}"
+    params = []
+    if since is not None:
+        sql += f" WHERE {key}.updated_at > ?"
+        params.append(since.strftime(SQLITE_TIMESTAMP_FORMAT))
+    sql += f" ORDER BY {key}.id"
+
+    schema = table_schema(table)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+    finally:
+        cursor.close()
+
+
+def write_table(connection, table, path, fmt='parquet', since=None):
+    """Write one table to a Parquet or Arrow IPC file batch by batch; returns the row count."""
+    schema = table_schema(table)
+    rows = 0
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(path, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_file(path, schema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+    with writer:
+        for batch in iter_record_batches(connection, table, since):
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    return rows
+
+
+def export_snapshot(connection, out_dir, fmt='parquet', incremental=False, lag=WRITE_TRANSACTION_LAG):
+    """Export every table into a new directory under out_dir and return its manifest.
+
+    Incremental exports start `lag` before the watermark recorded by the previous export in
+    out_dir (falling back to a full export when there is none). The new watermark is taken
+    before reading, so rows changed during the export are picked up again next time, and
+    the lag covers rows stamped before it that had not committed yet.
+    """
+    state_path = os.path.join(out_dir, EXPORT_STATE_FILE)
+    since = None
+    if incremental and os.path.exists(state_path):
+        with open(state_path) as state_file:
+            since = datetime.fromisoformat(json.load(state_file)['watermark']) - lag
+    watermark = datetime.utcnow()
+
+    kind = 'incremental' if since is not None else 'full'
+    snapshot_dir = os.path.join(out_dir, f"{kind}-{watermark.strftime('%Y%m%dT%H%M%S%f')}")
+    os.makedirs(snapshot_dir)
+    manifest = {
+        'kind': kind,
+        'format': fmt,
+        'since': since.isoformat() if since else None,
+        'watermark': watermark.isoformat(),
+        'tables': {},
+    }
+    for table in EXPORT_TABLES:
+        filename = f"{table}.{EXPORT_FORMATS[fmt]}"
+        rows = write_table(connection, table, os.path.join(snapshot_dir, filename), fmt, since)
+        total = connection.execute(f"SELECT COUNT(*) FROM {EXPORT_TABLES[table][0].split()[0]}").fetchone()[0]
+        manifest['tables'][table] = {'file': filename, 'rows': rows, 'table_rows': total}
+
+    with open(os.path.join(snapshot_dir, 'manifest.json'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    with open(state_path, 'w') as state_file:
+        json.dump({'watermark': manifest['watermark'], 'snapshot': os.path.basename(snapshot_dir)}, state_file)
+    return manifest
+
+
+class _ChunkSink:
+    """Write-only file object that hands back whatever was written since the last drain."""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def iter_ipc_stream(connection, table, since=None, compression=None):
+    """Yield the bytes of an Arrow IPC stream of `table`, one record batch at a time."""
+    sink = _ChunkSink()
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    with pa.ipc.new_stream(sink, table_schema(table), options=options) as writer:
+        yield sink.drain()  # the schema message
+        for batch in iter_record_batches(connection, table, since):
+            writer.write_batch(batch)
+            yield sink.drain()
+    yield sink.drain()  # end-of-stream marker
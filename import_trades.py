@@ -0,0 +1,38 @@
+import argparse
+import os
+
+from app import app, import_trade_stream, read_import_records, IMPORT_BATCH_SIZE
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Stream a broker CSV/NDJSON export into the trading journal.")
+    parser.add_argument('path', help="CSV or NDJSON file to import")
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help="Defaults to the file extension")
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help="Rows committed per chunk")
+    parser.add_argument('--map', action='append', default=[], metavar='COLUMN:FIELD',
+                        help="Rename a broker column to a trade field, e.g. --map Symbol:asset")
+    parser.add_argument('--restart', action='store_true', help="Ignore earlier progress for this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    source = os.path.abspath(args.path)
+    fmt = args.format or ('csv' if source.endswith('.csv') else 'ndjson')
+    column_map = dict(pair.split(':', 1) for pair in args.map if ':' in pair)
+
+    def report(job):
+        print(f"Committed {job.rows_committed} rows ({job.trades_imported} trades, {job.rows_rejected} rejected)")
+
+    with app.app_context(), open(source, newline='', encoding='utf-8') as stream:
+        job, errors = import_trade_stream(
+            read_import_records(stream, fmt), source, column_map=column_map,
+            batch_size=args.batch_size, restart=args.restart, on_chunk=report
+        )
+        for error in errors:
+            print(f"Row {error['row']}: {error['error']}")
+        print(f"Import {job.status}: {job.trades_imported} trades imported, {job.rows_rejected} rows rejected.")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,76 +1,236 @@
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
-
-# Assuming your models are defined in a separate file called models.py
-# from models import Trade, Market, TradeSetup, AccountBalanceLog
-
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///yourdatabase.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
-
-class Market(db.Model):
-    __tablename__ = 'markets'
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(50), nullable=False)
-
-class TradeSetup(db.Model):
-    __tablename__ = 'trade_setups'
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(50), nullable=False)
-    description = db.Column(db.String(200))
-
-class Trade(db.Model):
-    __tablename__ = 'trades'
-    id = db.Column(db.Integer, primary_key=True)
-    date_entered = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    date_exited = db.Column(db.DateTime)
-    asset = db.Column(db.String(50), nullable=False)
-    market_id = db.Column(db.Integer, db.ForeignKey('markets.id'), nullable=False)
-    direction = db.Column(db.String(10))
-    trade_setup_id = db.Column(db.Integer, db.ForeignKey('trade_setups.id'))
-    number_of_confluences = db.Column(db.Integer)
-    planned_return = db.Column(db.Float)
-    actual_return = db.Column(db.Float)
-    risk = db.Column(db.Float)
-    position_size = db.Column(db.Integer)
-    pre_trade_notes = db.Column(db.Text)
-    post_trade_notes = db.Column(db.Text)
-    feelings_after_trade = db.Column(db.Text)
-
-class AccountBalanceLog(db.Model):
-    __tablename__ = 'account_balance_logs'
-    id = db.Column(db.Integer, primary_key=True)
-    date = db.Column(db.Date, nullable=False)
-    balance = db.Column(db.Float, nullable=False)
-
-def recreate_database():
+"""Recreate the journal database from app.py's schema and optionally fill it with synthetic data.
+
+Usage: python initialize_db.py --database PATH [--trades 0] [--transactions N] [--years 10] [--seed 7] [--force]
+
+Every table of the target database is dropped first, so the target has to be named: --database,
+or DATABASE_URL in the environment. Falling back to app.py's own database, or dropping a
+database that already holds trades, also needs --force. app.py reads DATABASE_URL when it is
+imported, so it is only imported once the target is known.
+With --trades the generator writes a deterministic journal: the same seed and sizes always
+produce the same rows. Trades are spread over business hours in the requested span, with
+per-setup win rates, log-normal winning R multiples, risk sized off the running balance and
+deposits/withdrawals interleaved. The balance chain, daily balance log, metrics aggregate,
+P&L rollups and search index are then derived in bulk, as the maintenance commands would.
+"""
+import argparse
+import math
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import inspect, insert, text
+
+MARKETS = {
+    'Forex': ['EURUSD', 'GBPUSD', 'USDJPY', 'AUDUSD', 'XAUUSD'],
+    'Stocks': ['AAPL', 'MSFT', 'NVDA', 'TSLA', 'SPY'],
+    'Cryptocurrency': ['BTCUSD', 'ETHUSD', 'SOLUSD'],
+    'Options': ['SPX 0DTE', 'QQQ calls', 'AAPL puts'],
+}
+MARKET_WEIGHTS = [0.45, 0.3, 0.15, 0.1]
+
+# name, description, weight, win rate, average winning R
+SETUPS = [
+    ("Range Breakout", "Setup for trading range breakouts.", 0.3, 0.38, 1.6),
+    ("Swing Failure", "Setup for identifying swing failure patterns.", 0.25, 0.5, 1.0),
+    ("Trend Continuation", "Setup for riding the trend.", 0.3, 0.33, 2.0),
+    ("Order Blocks", "Setup for trading based on order blocks.", 0.15, 0.45, 1.1),
+]
+# Position risk is a percentage of the balance, up to this much capital, so long histories
+# grow roughly linearly instead of compounding without bound
+RISK_CAPITAL_CAP = 100000
+
+PRE_TRADE_NOTES = [
+    "Waited for the retest before entering.", "Clean structure, entry at the level.",
+    "News in an hour, sized down.", "Entered early, didn't wait for confirmation.",
+    "Chased the move after missing the first entry.", "Followed the plan, stop below the swing low.",
+    "Third touch of the level, volume confirming.", "Trend aligned on the higher timeframe.",
+]
+POST_TRADE_NOTES = {
+    'win': ["Hit target, managed well.", "Trailed the stop and let it run.", "Took partials at 1R, rest at target."],
+    'loss': ["Stopped out, setup was valid.", "Moved stop to breakeven too early.", "Moved my stop and took a bigger loss.",
+             "Entered against the trend, shouldn't have."],
+    'scratch': ["Closed flat before the news.", "Scratched it, momentum died."],
+}
+FEELINGS = {
+    'win': ["Calm, confident.", "Patient, followed plan.", "A bit greedy near the target."],
+    'loss': ["Frustrated.", "FOMO got me again.", "Anxious, wanted to revenge trade.", "Fine, it was a good loss."],
+    'scratch': ["Neutral.", "Impatient."],
+}
+
+END = datetime(2024, 12, 31, 17, 0)
+DAY_START_HOUR, DAY_HOURS = 8, 9
+
+
+def _business_timestamps(rng, count, start, end):
+    """`count` sorted random timestamps between start and end, on weekdays between 08:00 and 17:00."""
+    days = (end.date() - start.date()).days + 1
+    weekdays = [start.date() + timedelta(days=d) for d in range(days)]
+    weekdays = [day for day in weekdays if day.weekday() < 5]
+    stamps = []
+    for _ in range(count):
+        day = weekdays[int(rng.random() * len(weekdays))]
+        seconds = int(rng.random() * DAY_HOURS * 3600)
+        stamps.append(datetime(day.year, day.month, day.day, DAY_START_HOUR) + timedelta(seconds=seconds))
+    stamps.sort()
+    return stamps
+
+
+def _trade_payload(rng, when, balance, market_ids, setup_ids):
+    market_index = rng.choices(range(len(MARKETS)), MARKET_WEIGHTS)[0]
+    market_name = list(MARKETS)[market_index]
+    setup_index = rng.choices(range(len(SETUPS)), [setup[2] for setup in SETUPS])[0]
+    _, _, _, win_rate, average_win = SETUPS[setup_index]
+
+    risk = max(round(min(balance, RISK_CAPITAL_CAP) * rng.choice([0.005, 0.01, 0.01, 0.015, 0.02]), 2), 1.0)
+    roll = rng.random()
+    if roll < 0.08:
+        outcome, r_multiple = 'scratch', rng.uniform(-0.1, 0.1)
+    elif roll < 0.08 + win_rate * 0.92:
+        outcome, r_multiple = 'win', rng.lognormvariate(math.log(average_win) - 0.125, 0.5)
+    else:
+        outcome, r_multiple = 'loss', -rng.uniform(0.6, 1.1)
+    actual_return = round(r_multiple * risk, 2)
+    fees = round(risk * 0.02, 2)
+    holding_minutes = rng.lognormvariate(math.log(240 if market_name == 'Cryptocurrency' else 45), 0.9)
+
+    return {
+        'date_entered': when.strftime("%Y-%m-%dT%H:%M:%S"),
+        'date_exited': (when + timedelta(minutes=holding_minutes)).strftime("%Y-%m-%dT%H:%M:%S"),
+        'asset': rng.choice(MARKETS[market_name]),
+        'market_id': market_ids[market_index],
+        'direction': 'Long' if rng.random() < 0.55 else 'Short',
+        'trade_setup_id': setup_ids[setup_index],
+        'number_of_confluences': rng.choices([1, 2, 3, 4, 5], [0.1, 0.3, 0.3, 0.2, 0.1])[0],
+        'planned_return': round(risk * average_win * rng.uniform(0.8, 1.5), 2),
+        'actual_return': actual_return,
+        'risk': risk,
+        'position_size': rng.choice([1, 1, 2, 5, 10, 100]),
+        'result': round(actual_return - fees, 2),
+        'pre_trade_notes': rng.choice(PRE_TRADE_NOTES) if rng.random() < 0.8 else None,
+        'post_trade_notes': rng.choice(POST_TRADE_NOTES[outcome]) if rng.random() < 0.6 else None,
+        'feelings_after_trade': rng.choice(FEELINGS[outcome]) if rng.random() < 0.5 else None,
+    }
+
+
+def generate_journal(trades, transactions, market_ids, setup_ids, years=10, seed=7):
+    """Yield ('trade', payload) and ('transaction', row) events in date order.
+
+    Trade payloads are in the /add_trade format; the running balance is simulated so risk
+    scales with the account and withdrawals never exceed it.
+    """
+    from app import STARTING_BALANCE
+
+    rng = random.Random(seed)
+    start = END - timedelta(days=round(365.25 * years))
+    trade_times = _business_timestamps(rng, trades, start, END)
+    flow_times = _business_timestamps(rng, transactions, start, END)
+    balance = STARTING_BALANCE
+
+    def cash_flow(when):
+        nonlocal balance
+        if rng.random() < 0.7 or balance < 2 * STARTING_BALANCE:
+            amount = float(max(round(rng.lognormvariate(math.log(500), 0.8) / 50) * 50, 50))
+        else:
+            amount = -round(balance * rng.uniform(0.05, 0.2), 2)
+        balance += amount
+        return 'transaction', {'date': when, 'amount': amount, 'type': 'deposit' if amount > 0 else 'withdrawal'}
+
+    flows = iter(flow_times)
+    next_flow = next(flows, None)
+    for when in trade_times:
+        while next_flow is not None and next_flow <= when:
+            yield cash_flow(next_flow)
+            next_flow = next(flows, None)
+        payload = _trade_payload(rng, when, balance, market_ids, setup_ids)
+        balance += payload['result']
+        yield 'trade', payload
+    while next_flow is not None:
+        yield cash_flow(next_flow)
+        next_flow = next(flows, None)
+
+
+def populate_sample_data():
+    from app import db, Market, TradeSetup
+
+    markets = [Market(name=name) for name in MARKETS]
+    trade_setups = [TradeSetup(name=name, description=description) for name, description, *_ in SETUPS]
+    db.session.add_all(markets + trade_setups)
+    db.session.commit()
+    print("Sample markets and setups added.")
+    return [market.id for market in markets], [setup.id for setup in trade_setups]
+
+
+def load_journal(trades, transactions=None, years=10, seed=7, batch_size=10000):
+    """Write a generated journal into the (empty) database's default account; returns (trades, transactions) written."""
+    from app import (db, Account, Trade, Transaction, DEFAULT_ACCOUNT_ID, trade_fields, rechain,
+                     rebuild_metrics_aggregate, rebuild_rollups, rebuild_trade_search_index)
+
+    if transactions is None:
+        transactions = max(trades // 40, 12) if trades else 0
+    market_ids, setup_ids = populate_sample_data()
+
+    # Index the notes once at the end instead of row by row
+    db.session.execute(text("DROP TRIGGER IF EXISTS trade_fts_insert"))
+    counts = {'trade': 0, 'transaction': 0}
+    batches = {'trade': [], 'transaction': []}
+    models = {'trade': Trade, 'transaction': Transaction}
+
+    def flush(kind):
+        if batches[kind]:
+            db.session.execute(insert(models[kind]), batches[kind])
+            counts[kind] += len(batches[kind])
+            batches[kind].clear()
+
+    for kind, row in generate_journal(trades, transactions, market_ids, setup_ids, years, seed):
+        batches[kind].append(trade_fields(row) if kind == 'trade' else row)
+        if len(batches[kind]) >= batch_size:
+            flush(kind)
+    flush('trade')
+    flush('transaction')
+
+    rechain(db.session.get(Account, DEFAULT_ACCOUNT_ID))
+    rebuild_metrics_aggregate(DEFAULT_ACCOUNT_ID)
+    rebuild_rollups()
+    rebuild_trade_search_index()
+    db.session.commit()
+    return counts['trade'], counts['transaction']
+
+
+def recreate_database(trades=0, transactions=None, years=10, seed=7, force=False):
+    from app import app, db, Trade
+
     with app.app_context():
+        print(f"Database: {db.engine.url}")
+        if not force and inspect(db.engine).has_table(Trade.__tablename__) and db.session.query(Trade.id).first():
+            raise SystemExit("The database already holds trades; pass --force to drop it anyway.")
         print("Dropping all tables...")
         db.drop_all()
         print("Creating tables...")
         db.create_all()
-        populate_sample_data()
+        started = time.perf_counter()
+        written = load_journal(trades, transactions, years, seed)
+        print(f"Wrote {written[0]} trades and {written[1]} transactions in {time.perf_counter() - started:.1f}s.")
         print("Database has been reset and initialized.")
 
-def populate_sample_data():
-    with app.app_context():
-        markets = [Market(name="Forex"), Market(name="Stocks"), Market(name="Cryptocurrency"), Market(name="Options")]
-        db.session.add_all(markets)
-
-        trade_setups = [
-            TradeSetup(name="Range Breakout", description="Setup for trading range breakouts."),
-            TradeSetup(name="Swing Failure", description="Setup for identifying swing failure patterns."),
-            TradeSetup(name="Trend Continuation", description="Setup for riding the trend."),
-            TradeSetup(name="Order Blocks", description="Setup for trading based on order blocks.")
-        ]
-        db.session.add_all(trade_setups)
 
-        # Add more sample data as needed
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--trades', type=int, default=0, help="Synthetic trades to generate")
+    parser.add_argument('--transactions', type=int, help="Deposits and withdrawals (default: trades / 40)")
+    parser.add_argument('--years', type=float, default=10, help="Span of the generated history, ending 2024-12-31")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--database', help="SQLite file to recreate (default: DATABASE_URL)")
+    parser.add_argument('--force', action='store_true',
+                        help="Allow app.py's default database, and dropping a database that holds trades")
+    args = parser.parse_args()
+    if args.database is None and not os.environ.get('DATABASE_URL') and not args.force:
+        parser.error("name the database to recreate with --database or DATABASE_URL (or pass --force)")
+    return args
 
-        db.session.commit()
-        print("Sample data added successfully.")
 
 if __name__ == '__main__':
-    recreate_database()
+    args = parse_args()
+    if args.database:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(args.database)
+    recreate_database(args.trades, args.transactions, args.years, args.seed, args.force)
@@ -0,0 +1,101 @@
+"""In-process runner for background jobs: a bounded thread pool with cooperative cancellation.
+
+The runner knows nothing about the database. app.py persists each job as a Job row and hands
+the runner a callable per job; the callable reports progress through a JobContext, whose
+progress() is also where a requested cancellation takes effect.
+
+Threads rather than processes: jobs work through the Flask-SQLAlchemy session in an app
+context, and the CPU-heavy ones (simulations) already fan out to their own process pool.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when its cancellation has been requested."""
+
+
+class JobContext:
+    """Handed to a running job to report progress and notice cancellation."""
+
+    def __init__(self, runner, job_id, on_progress=None, persist_interval=1.0):
+        self.runner = runner
+        self.job_id = job_id
+        self.on_progress = on_progress
+        self.persist_interval = persist_interval
+        self.progress_value = 0.0
+        self.message = None
+        self._persisted_at = 0.0
+
+    def progress(self, fraction=None, message=None):
+        """Record progress (0..1) and raise JobCancelled if the job should stop."""
+        if fraction is not None:
+            self.progress_value = min(max(float(fraction), 0.0), 1.0)
+        if message is not None:
+            self.message = message
+        now = time.monotonic()
+        if self.on_progress and now - self._persisted_at >= self.persist_interval:
+            self._persisted_at = now
+            # on_progress returns True when a cancellation was requested elsewhere (another process)
+            if self.on_progress(self.job_id, self.progress_value, self.message):
+                self.runner.cancel(self.job_id)
+        if self.runner.cancel_requested(self.job_id):
+            raise JobCancelled()
+
+
+class JobRunner:
+    """Runs at most `workers` jobs at once and holds at most `max_queued` waiting ones."""
+
+    def __init__(self, workers, max_queued):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.executor = None
+        self.lock = threading.RLock()  # Future.cancel() runs the done callback, which takes it again
+        self.futures = {}
+        self.cancelled = set()
+        self.contexts = {}
+
+    def submit(self, job_id, function, on_progress=None):
+        """Queue function(context) for job_id; returns False when the queue is full."""
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='job')
+            waiting = sum(1 for future in self.futures.values() if not future.running())
+            if waiting >= self.max_queued:
+                return False
+            context = JobContext(self, job_id, on_progress)
+            self.contexts[job_id] = context
+            future = self.executor.submit(function, context)
+            self.futures[job_id] = future
+        future.add_done_callback(lambda _: self._forget(job_id))
+        return True
+
+    def cancel(self, job_id):
+        """Cancel a queued job outright (returns True) or flag a running one to stop."""
+        with self.lock:
+            future = self.futures.get(job_id)
+            if future is not None and future.cancel():
+                return True
+            if future is not None:
+                self.cancelled.add(job_id)
+        return False
+
+    def cancel_requested(self, job_id):
+        with self.lock:
+            return job_id in self.cancelled
+
+    def progress(self, job_id):
+        """(fraction, message) of a job running in this process, or None."""
+        context = self.contexts.get(job_id)
+        return None if context is None else (context.progress_value, context.message)
+
+    def active(self):
+        with self.lock:
+            return len(self.futures)
+
+    def _forget(self, job_id):
+        with self.lock:
+            self.futures.pop(job_id, None)
+            self.contexts.pop(job_id, None)
+            self.cancelled.discard(job_id)
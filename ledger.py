@@ -0,0 +1,345 @@
+"""Unified cash-flow ledger: an account's trades and deposits/withdrawals as one timeline.
+
+Both tables are read through their (account_id, date, id) indexes with one DB-API cursor
+each, and heapq.merge interleaves the two already-sorted cursors row by row, so a pass
+over the whole history holds one row per stream rather than either table. Events are
+ordered like the balance chain: by (timestamp, kind, id), with cash flows (kind 0) ahead
+of trades (kind 1) that share a timestamp.
+
+A timeline page starts from the stored chain just before its cursor position, found with
+two index seeks; the returns summary replays the window event by event. Point-in-time
+lookups start from the nearest balance checkpoint (the chain after every CHECKPOINT_INTERVAL-th
+trade, see app.py) and add up the at most one interval of trades and the cash flows after it.
+
+Archived trades (see archive.py) are part of the timeline: the trade stream walks the
+archived_trade view and then the hot trade table, and seeks try the hot table first.
+"""
+import base64
+import heapq
+import itertools
+import json
+import math
+from datetime import date, datetime
+
+SQLITE_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+MAX_ID = 2 ** 63 - 1
+DAYS_PER_YEAR = 365.25
+IRR_ITERATIONS = 100
+IRR_TOLERANCE = 1e-10
+IRR_FLOOR = -0.9999  # keeps (1 + r) ** -years finite over decades
+
+FLOW, TRADE = 0, 1  # event kinds, in chain order
+TRADE_TABLES = ('archived_trade', 'trade')  # in chain order: an account's archived trades come first
+
+_TRADE_EVENTS_SQL = """
+SELECT date_entered, 1, id, COALESCE(account_change, 0), 'trade', asset, direction FROM {table}
+WHERE account_id = ? AND (date_entered, id) >= (?, ?) {end}
+ORDER BY date_entered, id
+"""
+
+_FLOW_EVENTS_SQL = """
+SELECT date, 0, id, amount, type, NULL, NULL FROM "transaction"
+WHERE account_id = ? AND (date, id) >= (?, ?) {end}
+ORDER BY date, id
+"""
+
+_PREVIOUS_TRADE_SQL = """
+SELECT date_entered, account_balance, cumulative_pnl FROM {table}
+WHERE account_id = ? AND (date_entered, id) < (?, ?)
+ORDER BY date_entered DESC, id DESC LIMIT 1
+"""
+
+_FLOWS_BETWEEN_SQL = """
+SELECT COALESCE(SUM(amount), 0) FROM "transaction"
+WHERE account_id = ? AND date > ? AND (date, id) < (?, ?)
+"""
+
+_CHECKPOINT_SQL = """
+SELECT ts, trade_id, trade_count, balance, cumulative_pnl FROM balance_checkpoint
+WHERE account_id = ? AND ts <= ?
+ORDER BY ts DESC, trade_id DESC LIMIT 1
+"""
+
+_TRADES_THROUGH_SQL = """
+SELECT COUNT(*), COALESCE(SUM(COALESCE(account_change, 0)), 0) FROM trade_history
+WHERE account_id = ? AND (date_entered, id) > (?, ?) AND date_entered <= ?
+"""
+
+_FLOWS_THROUGH_SQL = """
+SELECT COALESCE(SUM(amount), 0) FROM "transaction"
+WHERE account_id = ? AND date > ? AND date <= ?
+"""
+
+
+def _timestamp(value):
+    return value.strftime(SQLITE_TIMESTAMP_FORMAT)
+
+
+def start_position(start):
+    """The position of the first event at or after `start`; None for the very beginning."""
+    return None if start is None else (_timestamp(start), FLOW, 0)
+
+
+def encode_position(position):
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_position(cursor):
+    ts, kind, entry_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    datetime.strptime(ts, SQLITE_TIMESTAMP_FORMAT)  # reject anything that is not a stored timestamp
+    if kind not in (FLOW, TRADE):
+        raise ValueError("Unknown event kind")
+    return ts, kind, int(entry_id)
+
+
+def _bounds(position):
+    """(ts, id) keys splitting the trade and the transaction stream at a (ts, kind, id) position.
+
+    Events before the position have keys below these, the event at it and later ones keys
+    at or above them.
+    """
+    ts, kind, entry_id = position
+    trade_key = (ts, entry_id if kind == TRADE else 0)  # a flow sorts before trades at its timestamp
+    flow_key = (ts, entry_id if kind == FLOW else MAX_ID)  # a trade sorts after flows at its timestamp
+    return trade_key, flow_key
+
+
+def chain_position(connection, account_id, starting_balance, position):
+    """(balance, cumulative P&L) of the stored chain just before `position`.
+
+    Two index seeks: the last trade before the position, plus the cash flows recorded
+    between that trade and the position. The archive is only sought when no hot trade
+    precedes the position.
+    """
+    if position is None:
+        return starting_balance, 0.0
+    trade_key, flow_key = _bounds(position)
+    cursor = connection.cursor()
+    try:
+        for table in reversed(TRADE_TABLES):
+            previous = cursor.execute(_PREVIOUS_TRADE_SQL.format(table=table), (account_id, *trade_key)).fetchone()
+            if previous is not None:
+                break
+        after = previous[0] if previous is not None else ''
+        flows = cursor.execute(_FLOWS_BETWEEN_SQL, (account_id, after, *flow_key)).fetchone()[0]
+    finally:
+        cursor.close()
+    if previous is None:
+        return starting_balance + flows, 0.0
+    return (previous[1] or 0) + flows, previous[2] or 0
+
+
+def _events(connection, sql, column, account_id, from_key, end, table=None):
+    params = [account_id, *from_key]
+    end_filter = ""
+    if end is not None:
+        end_filter = f"AND {column} <= ?"
+        params.append(_timestamp(end))
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql.format(end=end_filter, table=table), params)
+        yield from cursor
+    finally:
+        cursor.close()
+
+
+def iter_events(connection, account_id, position=None, end=None):
+    """Yield (ts, kind, id, amount, type, asset, direction) for every event from `position` on.
+
+    `connection` is a DB-API sqlite3 connection; `position` is a (ts, kind, id) position and
+    `end` an optional datetime bounding the timeline. amount is the trade's account change
+    or the signed cash flow.
+    """
+    trade_key, flow_key = _bounds(position) if position is not None else (('', 0), ('', 0))
+    trades = itertools.chain.from_iterable(
+        _events(connection, _TRADE_EVENTS_SQL, 'date_entered', account_id, trade_key, end, table)
+        for table in TRADE_TABLES
+    )
+    yield from heapq.merge(trades, _events(connection, _FLOW_EVENTS_SQL, 'date', account_id, flow_key, end))
+
+
+def timeline_page(connection, account_id, starting_balance, position=None, end=None, limit=100):
+    """One page of the timeline from `position`, each entry with its running balance and P&L.
+
+    The next page's cursor is the position of the first event left off this one.
+    """
+    balance, cumulative_pnl = chain_position(connection, account_id, starting_balance, position)
+    opening = balance
+    entries, next_position = [], None
+    events = iter_events(connection, account_id, position, end)
+    try:
+        for ts, kind, entry_id, amount, entry_type, asset, direction in events:
+            if len(entries) == limit:
+                next_position = (ts, kind, entry_id)
+                break
+            balance += amount
+            if kind == TRADE:
+                cumulative_pnl += amount
+            entry = {
+                "id": entry_id,
+                "type": entry_type,
+                "date": datetime.strptime(ts, SQLITE_TIMESTAMP_FORMAT).isoformat(timespec='seconds'),
+                "amount": amount,
+                "balance": balance,
+                "cumulative_pnl": cumulative_pnl,
+            }
+            if kind == TRADE:
+                entry["asset"], entry["direction"] = asset, direction
+            entries.append(entry)
+    finally:
+        events.close()
+    return {
+        "opening_balance": opening,
+        "entries": entries,
+        "next_cursor": encode_position(next_position) if next_position else None,
+    }
+
+
+def balances_as_of(connection, account_id, starting_balance, timestamps):
+    """Balance, cumulative P&L, trade count and net cash flow after every event up to each timestamp.
+
+    Timestamps are answered in ascending order, each from the nearest balance checkpoint at
+    or before it or from the previous answer when that is nearer, plus two range aggregates
+    over what lies between. Results come back in the order the timestamps were given.
+    """
+    answers = {}
+    state = ('', 0, 0, starting_balance, 0.0)  # (ts, trade id, trade count, balance, cumulative P&L)
+    cursor = connection.cursor()
+    try:
+        for moment in sorted(set(timestamps)):
+            ts = _timestamp(moment)
+            checkpoint = cursor.execute(_CHECKPOINT_SQL, (account_id, ts)).fetchone()
+            base = checkpoint if checkpoint is not None and checkpoint[0] > state[0] else state
+            trades, pnl = cursor.execute(_TRADES_THROUGH_SQL, (account_id, base[0], base[1], ts)).fetchone()
+            flows = cursor.execute(_FLOWS_THROUGH_SQL, (account_id, base[0], ts)).fetchone()[0]
+            # Everything at ts is included, so the next replay resumes after every id at ts
+            state = (ts, MAX_ID, base[2] + trades, base[3] + pnl + flows, base[4] + pnl)
+            answers[moment] = state
+    finally:
+        cursor.close()
+    return [{
+        "as_of": moment.isoformat(),
+        "balance": answers[moment][3],
+        "cumulative_pnl": answers[moment][4],
+        "trade_count": answers[moment][2],
+        "net_cash_flow": answers[moment][3] - starting_balance - answers[moment][4],
+    } for moment in timestamps]
+
+
+def irr(flows, guess=0.1):
+    """Annual rate r with sum(amount * (1 + r) ** -years) == 0 over (years, amount) flows.
+
+    Newton's method from `guess`, falling back to bisection when it leaves the domain or
+    fails to converge; None when the flows never change sign.
+    """
+    if not any(amount > 0 for _, amount in flows) or not any(amount < 0 for _, amount in flows):
+        return None
+
+    def npv(rate):
+        return sum(amount * (1 + rate) ** -years for years, amount in flows)
+
+    rate = guess
+    try:
+        for _ in range(IRR_ITERATIONS):
+            slope = sum(-years * amount * (1 + rate) ** (-years - 1) for years, amount in flows)
+            if slope == 0:
+                break
+            step = npv(rate) / slope
+            rate -= step
+            if rate <= IRR_FLOOR or not math.isfinite(rate):
+                break
+            if abs(step) < IRR_TOLERANCE:
+                return rate
+    except OverflowError:
+        pass
+
+    low, high = IRR_FLOOR, 1.0
+    while npv(high) * npv(low) > 0 and high < 1e6:
+        high *= 10
+    if npv(high) * npv(low) > 0:
+        return None
+    for _ in range(200):
+        middle = (low + high) / 2
+        if npv(low) * npv(middle) <= 0:
+            high = middle
+        else:
+            low = middle
+        if high - low < IRR_TOLERANCE:
+            break
+    return (low + high) / 2
+
+
+def ledger_returns(connection, account_id, starting_balance, start=None, end=None):
+    """Balances and time- and money-weighted returns of the account over [start, end].
+
+    Time-weighted return chains every trade's return on the balance just before it, so
+    deposits and withdrawals do not move it. Money-weighted return is the annualised IRR of
+    the opening balance, the cash flows (summed per day) and the closing balance. One pass
+    over the merged timeline; memory grows only with the number of days with cash flows.
+    """
+    position = start_position(start)
+    opening, cumulative_pnl = chain_position(connection, account_id, starting_balance, position)
+    balance = opening
+    growth, twr_defined = 1.0, True
+    trading_pnl = deposits = withdrawals = 0.0
+    trades = transactions = 0
+    first = last = None
+    daily_flows = {}
+
+    for ts, kind, _, amount, _, _, _ in iter_events(connection, account_id, position, end):
+        if first is None:
+            first = ts
+        last = ts
+        if kind == TRADE:
+            if balance > 0:
+                growth *= 1 + amount / balance
+            else:
+                twr_defined = False  # a return on no capital has no meaning
+            trading_pnl += amount
+            trades += 1
+        else:
+            if amount >= 0:
+                deposits += amount
+            else:
+                withdrawals -= amount
+            day = ts[:10]
+            daily_flows[day] = daily_flows.get(day, 0.0) + amount
+            transactions += 1
+        balance += amount
+
+    period_start = _day(start) if start is not None else (_day(first) if first else None)
+    period_end = _day(end) if end is not None else (_day(last) if last else None)
+    years = (period_end - period_start) / DAYS_PER_YEAR if period_start is not None else 0.0
+
+    mwr = None
+    if years > 0:
+        # The investor's view: money put in is negative, money taken out and the closing balance positive
+        flows = [(0.0, -opening)] if opening else []
+        flows += [((_day(day) - period_start) / DAYS_PER_YEAR, -amount) for day, amount in sorted(daily_flows.items())]
+        flows.append((years, balance))
+        mwr = irr(flows)
+
+    twr = growth - 1 if twr_defined else None
+    return {
+        "start": start.isoformat() if start is not None else None,
+        "end": end.isoformat() if end is not None else None,
+        "years": round(years, 4),
+        "opening_balance": opening,
+        "closing_balance": balance,
+        "trading_pnl": trading_pnl,
+        "cumulative_pnl": cumulative_pnl + trading_pnl,
+        "deposits": deposits,
+        "withdrawals": withdrawals,
+        "net_cash_flow": deposits - withdrawals,
+        "trades": trades,
+        "transactions": transactions,
+        "time_weighted_return": twr,
+        "time_weighted_return_annualized": (1 + twr) ** (1 / years) - 1 if twr is not None and twr > -1 and years >= 1 else None,
+        "money_weighted_return_annualized": mwr,
+        "money_weighted_return": (1 + mwr) ** years - 1 if mwr is not None else None,
+    }
+
+
+def _day(value):
+    """Day number of a datetime or a stored 'YYYY-MM-DD ...' timestamp; flows are dated by day."""
+    return (date.fromisoformat(value[:10]) if isinstance(value, str) else value.date()).toordinal()
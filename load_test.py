@@ -0,0 +1,176 @@
+"""Concurrent write/read load test for the SQLite storage modes.
+
+Usage: python load_test.py [--processes 4] [--threads 4] [--seconds 10] [--accounts 1] [--modes default,production]
+
+Each mode gets a fresh database. Several processes (standing in for gunicorn workers), each
+running several threads, post single trades to /add_trade, spread over --accounts accounts,
+while the same number read /metrics and /get_trades. Afterwards every account's balance
+chain is walked to check that concurrent inserts never forked it, that the chain head
+cached on the account row matches its last trade and that the balance checkpoints match it.
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+def _load_app(database_path, mode):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + database_path
+    os.environ['STORAGE_MODE'] = mode
+    import logging
+    logging.disable(logging.INFO)
+    import app as journal
+    return journal
+
+
+def seed(database_path, mode, accounts):
+    journal = _load_app(database_path, mode)
+    with journal.app.app_context():
+        journal.db.create_all()
+        client = journal.app.test_client()
+        client.post('/add_market', json={'name': 'Forex'})
+        client.post('/add_trade_setup', json={'name': 'Range Breakout', 'description': 'Breakouts'})
+        for number in range(2, accounts + 1):
+            client.post('/accounts', json={'name': f'Account {number}'})
+
+
+def worker(database_path, mode, role, threads, seconds, accounts, results):
+    journal = _load_app(database_path, mode)
+    counts = {'ok': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def run(thread_index):
+        client = journal.app.test_client()
+        ok = errors = 0
+        i = 0
+        while time.monotonic() < deadline:
+            i += 1
+            account_id = 1 + (thread_index + i) % accounts
+            try:
+                if role == 'writer':
+                    response = client.post('/add_trade', json={
+                        'account_id': account_id, 'asset': 'EURUSD', 'market_id': 1, 'direction': 'Long',
+                        'trade_setup_id': 1, 'number_of_confluences': 2, 'position_size': 1, 'risk': 10,
+                        'result': (i % 7) - 3, 'actual_return': (i % 7) - 3
+                    })
+                elif i % 2:
+                    response = client.get(f'/metrics?account_id={account_id}')
+                else:
+                    response = client.get(f'/get_trades?limit=50&account_id={account_id}')
+                response.get_data()
+                if response.status_code < 400:
+                    ok += 1
+                else:
+                    errors += 1
+            except Exception:
+                errors += 1
+        with lock:
+            counts['ok'] += ok
+            counts['errors'] += errors
+
+    pool = [threading.Thread(target=run, args=(n,)) for n in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put((role, counts['ok'], counts['errors']))
+
+
+def chain_breaks(database_path):
+    """(trades, chain breaks, accounts whose cached head differs from their chain, bad checkpoints).
+
+    A checkpoint is bad when it disagrees with the walked chain at its trade count, or when
+    checkpoints are missing: the first one sits at the checkpoint interval and one is
+    expected at every multiple of it.
+    """
+    connection = sqlite3.connect(database_path)
+    accounts = connection.execute("SELECT id, starting_balance, head_balance, head_trades FROM account").fetchall()
+    trades = breaks = head_mismatches = checkpoint_mismatches = 0
+    for account_id, starting_balance, head_balance, head_trades in accounts:
+        rows = connection.execute(
+            "SELECT id, account_change, account_balance FROM trade WHERE account_id = ? ORDER BY date_entered, id",
+            (account_id,)
+        ).fetchall()
+        balance = starting_balance
+        for _, change, stored in rows:
+            balance += change or 0
+            if abs(balance - stored) > 1e-6:
+                breaks += 1
+                balance = stored
+        trades += len(rows)
+        if abs(balance - head_balance) > 1e-6 or head_trades != len(rows):
+            head_mismatches += 1
+
+        checkpoints = connection.execute(
+            "SELECT trade_count, trade_id, balance FROM balance_checkpoint WHERE account_id = ? ORDER BY trade_count",
+            (account_id,)
+        ).fetchall()
+        for trade_count, trade_id, stored in checkpoints:
+            if trade_count > len(rows) or rows[trade_count - 1][0] != trade_id or abs(rows[trade_count - 1][2] - stored) > 1e-6:
+                checkpoint_mismatches += 1
+        if checkpoints and len(checkpoints) != len(rows) // checkpoints[0][0]:
+            checkpoint_mismatches += abs(len(rows) // checkpoints[0][0] - len(checkpoints))
+    connection.close()
+    return trades, breaks, head_mismatches, checkpoint_mismatches
+
+
+def run_mode(mode, processes, threads, seconds, accounts):
+    database_path = os.path.join(tempfile.mkdtemp(prefix='trading_journal_load_'), 'load.db')
+    context = multiprocessing.get_context('spawn')
+    seeder = context.Process(target=seed, args=(database_path, mode, accounts))
+    seeder.start()
+    seeder.join()
+
+    results = context.Queue()
+    workers = [
+        context.Process(target=worker, args=(database_path, mode, role, threads, seconds, accounts, results))
+        for role in ('writer', 'reader') for _ in range(processes)
+    ]
+    for process in workers:
+        process.start()
+    totals = {'writer': [0, 0], 'reader': [0, 0]}
+    for _ in workers:
+        role, ok, errors = results.get()
+        totals[role][0] += ok
+        totals[role][1] += errors
+    for process in workers:
+        process.join()
+
+    trades, breaks, head_mismatches, checkpoint_mismatches = chain_breaks(database_path)
+    return {
+        'mode': mode,
+        'writes_per_second': totals['writer'][0] / seconds,
+        'write_errors': totals['writer'][1],
+        'reads_per_second': totals['reader'][0] / seconds,
+        'read_errors': totals['reader'][1],
+        'trades': trades,
+        'chain_breaks': breaks,
+        'head_mismatches': head_mismatches,
+        'checkpoint_mismatches': checkpoint_mismatches,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4, help="Writer processes, and as many reader processes")
+    parser.add_argument('--threads', type=int, default=4, help="Threads per process")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--accounts', type=int, default=1, help="Accounts the writes are spread over")
+    parser.add_argument('--modes', default='default,production')
+    args = parser.parse_args()
+
+    print(f"{'mode':<12}{'writes/s':>10}{'w errors':>10}{'reads/s':>10}{'r errors':>10}{'trades':>9}{'breaks':>8}"
+          f"{'heads':>7}{'checkpoints':>13}")
+    for mode in args.modes.split(','):
+        result = run_mode(mode, args.processes, args.threads, args.seconds, max(args.accounts, 1))
+        print(f"{result['mode']:<12}{result['writes_per_second']:>10.1f}{result['write_errors']:>10}"
+              f"{result['reads_per_second']:>10.1f}{result['read_errors']:>10}{result['trades']:>9}"
+              f"{result['chain_breaks']:>8}{result['head_mismatches']:>7}{result['checkpoint_mismatches']:>13}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""index the trade schema for its access paths
+
+Revision ID: d54c55c5b67d
+Revises: 
+Create Date: 2026-10-17 08:31:26.608378
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd54c55c5b67d'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# account_balance_log.date needs none: its unique constraint's index serves date ranges
+INDEXES = (
+    ('ix_trade_date_entered', 'trade', ['date_entered', 'id']),
+    ('ix_trade_market_date', 'trade', ['market_id', 'date_entered']),
+    ('ix_trade_setup_date', 'trade', ['trade_setup_id', 'date_entered']),
+    ('ix_trade_asset_date', 'trade', ['asset', 'date_entered']),
+    ('ix_trade_actual_return', 'trade', ['actual_return']),
+    ('ix_transaction_date', 'transaction', ['date']),
+)
+
+
+def upgrade():
+    # Databases created by db.create_all() since the indexes were declared already have them
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False, if_not_exists=True)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
@@ -0,0 +1,187 @@
+"""scope the journal to accounts
+
+Adds the account table with account 1, "Default", which every existing trade, transaction
+and daily balance is given to, and replaces the indexes of the previous revision with
+account-scoped ones. The default account's cached chain head is set from the existing
+trades and cash flows. The same three tables get the updated_at column that incremental
+exports select on, stamped with the time of the upgrade.
+
+Tables that are new in this version (checkpoints, rollups, the metrics aggregate, the
+search index and so on) are created empty by db.create_all() when the app starts. After
+upgrading, run `flask rechain`, `flask rebuild-rollups` and `flask rebuild-search-index`
+to fill them in and relink balances stored by older versions.
+
+Revision ID: ed104e1543ad
+Revises: d54c55c5b67d
+Create Date: 2026-10-17 08:40:12.511924
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ed104e1543ad'
+down_revision = 'd54c55c5b67d'
+branch_labels = None
+depends_on = None
+
+# app.DEFAULT_ACCOUNT_ID, app.STARTING_BALANCE and app.DEFAULT_RISK_PERCENTAGE
+DEFAULT_ACCOUNT_ID = 1
+STARTING_BALANCE = 1000
+DEFAULT_RISK_PERCENTAGE = 0.02
+
+# Reflected constraints are unnamed in SQLite; name them so batch mode can drop them
+NAMING_CONVENTION = {
+    'uq': 'uq_%(table_name)s_%(column_0_name)s',
+    'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s',
+}
+# SQLAlchemy's DateTime storage format
+NOW = "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
+ACCOUNT_TABLES = ('trade', 'transaction', 'account_balance_log')
+OLD_INDEXES = (
+    ('ix_trade_date_entered', 'trade', ['date_entered', 'id']),
+    ('ix_trade_market_date', 'trade', ['market_id', 'date_entered']),
+    ('ix_trade_setup_date', 'trade', ['trade_setup_id', 'date_entered']),
+    ('ix_trade_asset_date', 'trade', ['asset', 'date_entered']),
+    ('ix_trade_actual_return', 'trade', ['actual_return']),
+    ('ix_transaction_date', 'transaction', ['date']),
+)
+INDEXES = (
+    ('ix_trade_account_date_entered', 'trade', ['account_id', 'date_entered', 'id'], False),
+    ('ix_trade_account_market_date', 'trade', ['account_id', 'market_id', 'date_entered'], False),
+    ('ix_trade_account_setup_date', 'trade', ['account_id', 'trade_setup_id', 'date_entered'], False),
+    ('ix_trade_account_asset_date', 'trade', ['account_id', 'asset', 'date_entered'], False),
+    ('ix_trade_account_actual_return', 'trade', ['account_id', 'actual_return'], False),
+    ('ix_transaction_account_date', 'transaction', ['account_id', 'date'], False),
+    ('ix_account_balance_log_account_date', 'account_balance_log', ['account_id', 'date'], True),
+    ('ix_trade_updated_at', 'trade', ['updated_at'], False),
+    ('ix_transaction_updated_at', 'transaction', ['updated_at'], False),
+    ('ix_account_balance_log_updated_at', 'account_balance_log', ['updated_at'], False),
+)
+
+HEAD_SQL = f"""
+UPDATE account SET
+    head_pnl = (SELECT COALESCE(SUM(account_change), 0) FROM trade WHERE account_id = account.id),
+    head_balance = starting_balance
+        + (SELECT COALESCE(SUM(account_change), 0) FROM trade WHERE account_id = account.id)
+        + (SELECT COALESCE(SUM(amount), 0) FROM "transaction" WHERE account_id = account.id),
+    head_trades = (SELECT COUNT(*) FROM trade WHERE account_id = account.id),
+    head_ts = (SELECT MAX(ts) FROM (
+        SELECT MAX(date_entered) AS ts FROM trade WHERE account_id = account.id
+        UNION ALL
+        SELECT MAX(date) FROM "transaction" WHERE account_id = account.id
+    ))
+WHERE id = {DEFAULT_ACCOUNT_ID}
+"""
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def _drop_triggers():
+    """Drop every trigger and return their SQL to create them again with.
+
+    Batch mode recreates a table by renaming a copy over it, which fails while any trigger
+    (the search index's, on trade and trade_setup) refers to it, and drops the table's own.
+    """
+    triggers = op.get_bind().execute(sa.text("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'")).all()
+    for name, _ in triggers:
+        op.execute(f'DROP TRIGGER "{name}"')
+    return [sql for _, sql in triggers]
+
+
+def _drop_history_views():
+    # The app gives every connection temp views over trade (see archive.py), which would
+    # stop batch mode renaming its copy of the table; new connections create them again
+    op.execute("DROP VIEW IF EXISTS temp.trade_history")
+    op.execute("DROP VIEW IF EXISTS temp.archived_trade")
+
+
+def upgrade():
+    _drop_history_views()
+    tables = sa.inspect(op.get_bind()).get_table_names()
+    if 'account' not in tables:
+        op.create_table(
+            'account',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(length=50), nullable=False),
+            sa.Column('starting_balance', sa.Float(), nullable=False),
+            sa.Column('risk_percentage', sa.Float(), nullable=False),
+            sa.Column('head_balance', sa.Float(), nullable=False),
+            sa.Column('head_pnl', sa.Float(), nullable=False),
+            sa.Column('head_ts', sa.DateTime(), nullable=True),
+            sa.Column('head_trades', sa.Integer(), nullable=False),
+            sa.Column('archived_trades', sa.Integer(), nullable=False),
+            sa.Column('archived_ts', sa.DateTime(), nullable=True),
+            sa.Column('archived_trade_id', sa.Integer(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('name'),
+        )
+    # db.create_all() may have made the table, and the default account, already
+    op.execute(f"""
+        INSERT OR IGNORE INTO account (id, name, starting_balance, risk_percentage, head_balance, head_pnl,
+                                       head_trades, archived_trades, created_at)
+        VALUES ({DEFAULT_ACCOUNT_ID}, 'Default', {STARTING_BALANCE}, {DEFAULT_RISK_PERCENTAGE},
+                {STARTING_BALANCE}, 0, 0, 0, {NOW})
+    """)
+
+    for name, table, _ in OLD_INDEXES:
+        op.drop_index(name, table_name=table, if_exists=True)
+
+    # Databases made by db.create_all() already have every column; their heads are current
+    scoped = 'account_id' not in _columns('trade')
+    triggers = _drop_triggers()
+    for table in ACCOUNT_TABLES:
+        if 'account_id' in _columns(table):
+            continue
+        with op.batch_alter_table(table, recreate='always', naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.add_column(sa.Column('account_id', sa.Integer(), nullable=True), insert_after='id')
+            batch_op.create_foreign_key('fk_%s_account_id_account' % table, 'account', ['account_id'], ['id'])
+            if table == 'account_balance_log':
+                # One row per account and day instead of one per day
+                batch_op.drop_constraint('uq_account_balance_log_date', type_='unique')
+        op.execute(f'UPDATE "{table}" SET account_id = {DEFAULT_ACCOUNT_ID}')
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('account_id', existing_type=sa.Integer(), nullable=False)
+    for sql in triggers:
+        op.execute(sql)
+
+    for table in ACCOUNT_TABLES:
+        if 'updated_at' not in _columns(table):
+            op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+            # Stamped now, so the next incremental export carries every existing row
+            op.execute(f'UPDATE "{table}" SET updated_at = {NOW}')
+
+    for name, table, columns, unique in INDEXES:
+        op.create_index(name, table, columns, unique=unique, if_not_exists=True)
+
+    if scoped:
+        op.execute(HEAD_SQL)
+
+
+def downgrade():
+    _drop_history_views()
+    # The single-journal schema has no room for the other accounts' rows
+    for table in ACCOUNT_TABLES:
+        op.execute(f'DELETE FROM "{table}" WHERE account_id != {DEFAULT_ACCOUNT_ID}')
+    for name, table, _, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
+
+    triggers = _drop_triggers()
+    for table in ACCOUNT_TABLES:
+        with op.batch_alter_table(table, naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.drop_constraint('fk_%s_account_id_account' % table, type_='foreignkey')
+            batch_op.drop_column('account_id')
+            batch_op.drop_column('updated_at')
+            if table == 'account_balance_log':
+                batch_op.create_unique_constraint('uq_account_balance_log_date', ['date'])
+    for sql in triggers:
+        op.execute(sql)
+
+    for name, table, columns in OLD_INDEXES:
+        op.create_index(name, table, columns, unique=False, if_not_exists=True)
+    op.drop_table('account')
@@ -0,0 +1,158 @@
+"""In-process request metrics: fixed-bucket histograms, Prometheus text rendering and
+sampled cProfile captures of slow requests.
+
+Everything here is per process; with several workers each one exposes its own series,
+which Prometheus scrapes and sums as usual.
+"""
+import bisect
+import cProfile
+import io
+import pstats
+import random
+import sqlite3
+import threading
+from collections import deque
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+# name, help text, buckets, key in the request sample
+REQUEST_HISTOGRAMS = (
+    ('journal_request_duration_seconds', 'Wall time per request, including streamed bodies.', DURATION_BUCKETS, 'seconds'),
+    ('journal_request_sql_statements', 'SQL statements executed per request.', COUNT_BUCKETS, 'sql_statements'),
+    ('journal_request_sql_seconds', 'Time spent executing SQL per request.', DURATION_BUCKETS, 'sql_seconds'),
+    ('journal_request_rows_fetched', 'Rows fetched from the database per request.', ROW_BUCKETS, 'rows'),
+    ('journal_response_bytes', 'Response body size.', BYTE_BUCKETS, 'bytes'),
+)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style; callers hold the registry lock."""
+
+    __slots__ = ('bounds', 'counts', 'total', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class RequestMetrics:
+    """Histograms of REQUEST_HISTOGRAMS per (method, route) plus a request counter per status."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.requests = {}
+
+    def observe(self, method, route, status, sample):
+        labels = (method, route)
+        with self.lock:
+            histograms = self.histograms.get(labels)
+            if histograms is None:
+                histograms = self.histograms[labels] = [Histogram(buckets) for _, _, buckets, _ in REQUEST_HISTOGRAMS]
+            for histogram, (_, _, _, key) in zip(histograms, REQUEST_HISTOGRAMS):
+                histogram.observe(sample[key])
+            key = (method, route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def render(self):
+        """The Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self.lock:
+            lines.append('# HELP journal_requests_total Requests served by method, route and status.')
+            lines.append('# TYPE journal_requests_total counter')
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f'journal_requests_total{{method="{method}",route="{_escape(route)}",status="{status}"}} {count}')
+            for index, (name, help_text, buckets, _) in enumerate(REQUEST_HISTOGRAMS):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (method, route), histograms in sorted(self.histograms.items()):
+                    histogram = histograms[index]
+                    labels = f'method="{method}",route="{_escape(route)}"'
+                    cumulative = 0
+                    for bound, count in zip(buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{{labels}}} {histogram.total:.6f}')
+                    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+class ProfileSampler:
+    """Profile a random fraction of requests and keep the captures of those that turn out slow.
+
+    Only one request is profiled at a time, so concurrent threads never share a profiler.
+    """
+
+    def __init__(self, sample_rate, slow_seconds, keep=20, top=30):
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.top = top
+        self.captures = deque(maxlen=keep)
+        self.busy = threading.Lock()
+
+    def start(self):
+        """A running profiler for this request, or None when it is not sampled."""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate or not self.busy.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiler is active in this interpreter
+            self.busy.release()
+            return None
+        return profiler
+
+    def finish(self, profiler, method, path, seconds):
+        profiler.disable()
+        self.busy.release()
+        if seconds < self.slow_seconds:
+            return
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(self.top)
+        self.captures.append({'method': method, 'path': path, 'seconds': round(seconds, 6), 'profile': report.getvalue()})
+
+
+class CountingCursor(sqlite3.Cursor):
+    """Counts the rows SQLAlchemy fetches through fetchone/fetchmany/fetchall.
+
+    Plain iteration (as the NumPy loaders use) is left at C speed and not counted.
+    """
+
+    on_rows = None  # set to a callable taking the row count
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None and CountingCursor.on_rows:
+            CountingCursor.on_rows(1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = super().fetchmany(*args, **kwargs)
+        if CountingCursor.on_rows:
+            CountingCursor.on_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        if CountingCursor.on_rows:
+            CountingCursor.on_rows(len(rows))
+        return rows
+
+
+class CountingConnection(sqlite3.Connection):
+    def cursor(self, factory=CountingCursor):
+        return super().cursor(factory)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
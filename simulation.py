@@ -0,0 +1,218 @@
+"""Monte Carlo equity simulation over the journal's realised R multiples.
+
+Each path draws `trades` R multiples from the history, either independently (bootstrap) or
+in circular blocks of consecutive trades (block), which keeps streaks and clustering intact.
+An account risking a fixed fraction f of its balance per trade grows by (1 + f * R) per
+trade; the paths for every requested fraction reuse the same draws, so fractions are
+compared on identical luck.
+
+Paths are simulated in fixed-size chunks, each seeded from its own child of one
+SeedSequence. Chunks run in a process pool and are independent of how many workers there
+are, so a seed reproduces the same paths on any machine. When the time budget runs out the
+longest run of finished chunks from the start is used, which is a prefix of the full run.
+"""
+import multiprocessing
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+RESAMPLERS = ('bootstrap', 'block')
+PERCENTILES = (5, 25, 50, 75, 95)
+DRAWDOWN_BINS = np.linspace(0, 1, 21)
+BAND_POINTS = 100
+CHUNK_PATHS = 2500
+CHUNK_CELLS = 2000000  # paths * trades per chunk, bounding each worker's arrays to ~16 MB
+
+_R_MULTIPLES_SQL = """
+SELECT actual_rr FROM trade
+WHERE account_id = ? AND actual_rr IS NOT NULL AND risk > 0 {filters}
+ORDER BY date_entered, id
+"""
+
+_pool = None
+_pool_workers = None
+_pool_lock = threading.Lock()
+
+
+def load_r_multiples(connection, account_id, start=None, end=None, market_id=None, trade_setup_id=None):
+    """Read one account's realised R multiples in (date_entered, id) order into a float array.
+
+    `connection` is a DB-API sqlite3 connection. Trades without risk have no R multiple and
+    are left out.
+    """
+    filters, params = "", [account_id]
+    if start is not None:
+        filters += " AND date_entered >= ?"
+        params.append(start.strftime('%Y-%m-%d %H:%M:%S.%f'))
+    if end is not None:
+        filters += " AND date_entered <= ?"
+        params.append(end.strftime('%Y-%m-%d %H:%M:%S.%f'))
+    if market_id is not None:
+        filters += " AND market_id = ?"
+        params.append(market_id)
+    if trade_setup_id is not None:
+        filters += " AND trade_setup_id = ?"
+        params.append(trade_setup_id)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(_R_MULTIPLES_SQL.format(filters=filters), params)
+        return np.fromiter((row[0] for row in cursor), dtype='f8')
+    finally:
+        cursor.close()
+
+
+def default_block_size(history):
+    return max(1, round(history ** (1 / 3)))
+
+
+def _resample_indices(rng, history, paths, trades, method, block_size):
+    if method == 'bootstrap':
+        return rng.integers(0, history, size=(paths, trades))
+    # Circular block bootstrap: consecutive runs of history from random starts, wrapping at the end
+    blocks = -(-trades // block_size)
+    starts = rng.integers(0, history, size=(paths, blocks, 1))
+    indices = (starts + np.arange(block_size)) % history
+    return indices.reshape(paths, blocks * block_size)[:, :trades]
+
+
+def simulate_chunk(r_multiples, risks, paths, trades, method, block_size, ruin_level, steps, seed):
+    """Simulate `paths` equity paths per risk fraction, starting from an equity of 1.
+
+    Returns, per risk, the equity at `steps` (trade counts >= 1), each path's maximum
+    drawdown and whether it fell to `ruin_level` or below.
+    """
+    rng = np.random.default_rng(seed)
+    sampled = r_multiples[_resample_indices(rng, len(r_multiples), paths, trades, method, block_size)]
+    results = []
+    for risk in risks:
+        # A loss of more than the whole balance leaves it at zero, where it stays
+        equity = np.cumprod(np.maximum(1 + risk * sampled, 0), axis=1)
+        peaks = np.maximum.accumulate(equity, axis=1)
+        np.maximum(peaks, 1, out=peaks)  # the starting equity is the first peak
+        max_drawdown = (1 - equity / peaks).max(axis=1)
+        ruined = equity.min(axis=1) <= ruin_level
+        results.append((equity[:, steps - 1].astype('f4'), max_drawdown.astype('f4'), ruined))
+    return results
+
+
+def _executor(workers):
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            # spawn, not fork: the web server process has threads and open database connections
+            _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+            _pool_workers = workers
+        return _pool
+
+
+def _chunk_sizes(paths, trades):
+    chunk = max(100, min(CHUNK_PATHS, CHUNK_CELLS // trades))
+    sizes = [chunk] * (paths // chunk)
+    if paths % chunk:
+        sizes.append(paths % chunk)
+    return sizes
+
+
+def _run_chunks(tasks, workers, deadline):
+    """Results of the longest prefix of `tasks` finished before the deadline."""
+    done = {}
+    if workers <= 0:
+        for index, task in enumerate(tasks):
+            if index and time.monotonic() > deadline:
+                break
+            done[index] = simulate_chunk(*task)
+    else:
+        executor = _executor(workers)
+        futures = {executor.submit(simulate_chunk, *task): index for index, task in enumerate(tasks)}
+        pending = set(futures)
+        while pending:
+            remaining = deadline - time.monotonic()
+            # Past the deadline, still wait for the first chunk so there is something to report
+            timeout = None if remaining <= 0 and not done else max(remaining, 0)
+            finished, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in finished:
+                done[futures[future]] = future.result()
+            if pending and time.monotonic() >= deadline and done:
+                for future in pending:
+                    future.cancel()
+                break
+    prefix = []
+    while len(prefix) in done:
+        prefix.append(done[len(prefix)])
+    return prefix
+
+
+def _percentiles(values, scale=1.0, digits=2):
+    return {f"p{p}": round(float(v) * scale, digits) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+
+
+def run_simulation(r_multiples, risks, starting_balance, paths=10000, trades=500, method='bootstrap',
+                   block_size=None, ruin_level=0.5, seed=None, time_budget=10.0, workers=1):
+    """Simulate equity paths for each risk fraction and summarise them.
+
+    ruin_level is the fraction of the starting balance at or below which a path counts as
+    ruined. workers=0 runs the chunks in the calling thread.
+    """
+    started = time.monotonic()
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy % 2 ** 63)
+    if block_size is None:
+        block_size = default_block_size(len(r_multiples))
+    block_size = min(block_size, len(r_multiples))
+    steps = np.unique(np.linspace(1, trades, min(trades, BAND_POINTS)).round().astype(int))
+
+    sizes = _chunk_sizes(paths, trades)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(r_multiples, risks, size, trades, method, block_size, ruin_level, steps, chunk_seed)
+             for size, chunk_seed in zip(sizes, seeds)]
+    chunks = _run_chunks(tasks, workers, started + time_budget)
+    completed = sum(sizes[:len(chunks)])
+
+    results = []
+    for index, risk in enumerate(risks):
+        equity = np.concatenate([chunk[index][0] for chunk in chunks])
+        max_drawdown = np.concatenate([chunk[index][1] for chunk in chunks])
+        ruined = np.concatenate([chunk[index][2] for chunk in chunks])
+        band_values = np.percentile(equity, PERCENTILES, axis=0) * starting_balance
+        final = equity[:, -1]
+        histogram, _ = np.histogram(np.minimum(max_drawdown, 1), bins=DRAWDOWN_BINS)
+        results.append({
+            "risk_percentage": risk,
+            "bands": {f"p{p}": [round(starting_balance, 2)] + np.round(values, 2).tolist()
+                      for p, values in zip(PERCENTILES, band_values)},
+            "final_balance": {
+                "mean": round(float(final.mean()) * starting_balance, 2),
+                **_percentiles(final, starting_balance),
+            },
+            "probability_of_profit": round(float((final > 1).mean()), 4),
+            "max_drawdown": {
+                "mean": round(float(max_drawdown.mean()), 4),
+                **_percentiles(max_drawdown, digits=4),
+                "histogram": {"bins": DRAWDOWN_BINS.round(2).tolist(), "counts": histogram.tolist()},
+            },
+            "ruin_probability": round(float(ruined.mean()), 4),
+        })
+
+    return {
+        "history": {
+            "trades": len(r_multiples),
+            "mean_r": round(float(r_multiples.mean()), 4),
+            "win_rate": round(float((r_multiples > 0).mean()), 4),
+        },
+        "starting_balance": round(starting_balance, 2),
+        "method": method,
+        "block_size": block_size if method == 'block' else None,
+        "ruin_level": ruin_level,
+        "seed": seed,
+        "paths": completed,
+        "paths_requested": paths,
+        "truncated": completed < paths,
+        "trades": trades,
+        "steps": [0] + steps.tolist(),
+        "seconds": round(time.monotonic() - started, 3),
+        "results": results,
+    }
@@ -0,0 +1,133 @@
+"""In-process fan-out of change events to Server-Sent Events clients.
+
+app.py appends every event to the stream_event table in the same transaction as the write it
+describes, so every worker process sees the same ordered log. One Broadcaster per process
+tails that log with a single poller thread into a bounded ring buffer, and every connected
+client reads from the shared buffer at its own pace: an event is fetched and serialized once
+per process however many clients are listening, and a client costs no memory beyond its
+position in the log.
+
+That position is also the backpressure. Nothing is ever queued for a slow client; once the
+buffer has moved past the events it has not read yet, its next read is answered with a
+reset instead, telling it to refetch its state and carry on from the current head. Resuming
+with a Last-Event-ID works the same way: replayed from the buffer when it still holds
+everything after that id, reset otherwise.
+
+The broadcaster knows nothing about the database: it is handed fetch(after_id, limit),
+returning (id, type, account_id, data) rows in id order, where data is already JSON text.
+"""
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+Event = collections.namedtuple('Event', 'id type account_id data')
+
+
+class StreamFull(Exception):
+    """Raised by subscribe() when the process already serves its maximum number of clients."""
+
+
+def format_event(event_id, event_type, data):
+    """One SSE message; `data` is JSON text without newlines."""
+    return f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
+
+
+class Broadcaster:
+    """Shares the tail of the event log, up to `capacity` events, between all of a process's clients.
+
+    The poller thread starts with the first subscription and reads the log every
+    `poll_interval` seconds while anyone is subscribed, or at once after notify(), which
+    writers in this process call when they commit an event.
+    """
+
+    def __init__(self, fetch, capacity, poll_interval, max_clients):
+        self.fetch = fetch
+        self.capacity = capacity
+        self.poll_interval = poll_interval
+        self.max_clients = max_clients
+        self.condition = threading.Condition()
+        self.events = collections.deque(maxlen=capacity)
+        self.floor = None  # every event after this id is buffered; None until the first poll
+        self.last_id = 0  # the newest event read from the log
+        self.clients = 0
+        self.wake = False
+        self.thread = None
+
+    def subscribe(self):
+        """Register a client; raises StreamFull when max_clients are already connected."""
+        with self.condition:
+            if self.clients >= self.max_clients:
+                raise StreamFull()
+            self.clients += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._poll_forever, name='stream-poller', daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    def unsubscribe(self):
+        with self.condition:
+            self.clients -= 1
+
+    def notify(self):
+        """Have the poller read the log now instead of at its next interval."""
+        with self.condition:
+            self.wake = True
+            self.condition.notify_all()
+
+    def head(self, timeout):
+        """The newest event id, waiting up to `timeout` seconds for the first poll; None if it has not happened."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.floor is not None, timeout)
+            return self.last_id if self.floor is not None else None
+
+    def read(self, after_id, timeout):
+        """Events after `after_id`, waiting up to `timeout` seconds for one to arrive.
+
+        Returns a list, empty on timeout, or None when the events after `after_id` are no
+        longer buffered (or the id is from the future, e.g. a recreated database) and the
+        client has to reset.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.floor is not None and self.last_id != after_id, timeout)
+            if self.floor is None or self.last_id == after_id:
+                return []
+            if after_id < self.floor or after_id > self.last_id:
+                return None
+            # Lagging clients are the rare case: walk back from the newest event
+            pending = []
+            for event in reversed(self.events):
+                if event.id <= after_id:
+                    break
+                pending.append(event)
+            pending.reverse()
+            return pending
+
+    def _poll_forever(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.clients > 0)
+                if not self.wake and self.floor is not None:
+                    self.condition.wait(self.poll_interval)
+                self.wake = False
+                after_id = self.last_id if self.floor is not None else None
+            try:
+                rows = self.fetch(after_id, self.capacity)
+            except Exception:
+                logger.exception("Reading the event log failed")
+                time.sleep(self.poll_interval)
+                continue
+            with self.condition:
+                first_poll = self.floor is None
+                if first_poll:
+                    # The newest `capacity` events, so recent ids can resume
+                    self.floor = rows[0][0] - 1 if rows else 0
+                for row in rows:
+                    if len(self.events) == self.capacity:
+                        self.floor = self.events[0].id
+                    self.events.append(Event(*row))
+                    self.last_id = row[0]
+                if rows or first_poll:
+                    self.condition.notify_all()
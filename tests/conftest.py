@@ -0,0 +1,54 @@
+"""Every test runs against a fresh SQLite database in a temporary directory.
+
+app.py reads its configuration at import time, so DATABASE_URL is set before it is imported.
+"""
+import os
+import sys
+import tempfile
+
+_db_dir = tempfile.mkdtemp(prefix='journal-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_db_dir, 'journal.db')
+os.environ['ARCHIVE_DATABASE'] = os.path.join(_db_dir, 'archive.db')
+os.environ.setdefault('PERF_INSTRUMENTATION', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import app as journal
+
+
+@pytest.fixture
+def client():
+    with journal.app.app_context():
+        db = journal.db
+        db.drop_all()
+        db.create_all()
+        db.session.execute(journal.text("DELETE FROM archive.trade_archive"))
+        db.session.commit()
+    # Data versions restart with the database, so responses cached by an earlier test would match
+    journal.response_cache = journal.ResponseCache(journal.app.config['RESPONSE_CACHE_MAX_BYTES'])
+    client = journal.app.test_client()
+    for name in ('FX', 'Indices'):
+        assert client.post('/add_market', json={'name': name}).status_code == 201
+    for name in ('Breakout', 'Pullback'):
+        assert client.post('/add_trade_setup', json={'name': name, 'description': name}).status_code == 201
+    return client
+
+
+def trade_payload(date_entered, result, actual_return=None, **fields):
+    """A valid /add_trade body; actual_return follows result unless given."""
+    payload = {
+        'date_entered': date_entered.strftime('%Y-%m-%dT%H:%M:%S'),
+        'asset': 'EURUSD',
+        'market_id': 1,
+        'direction': 'Long',
+        'trade_setup_id': 1,
+        'number_of_confluences': 2,
+        'position_size': 1000,
+        'risk': 10,
+        'planned_return': 20,
+        'result': result,
+        'actual_return': result if actual_return is None else actual_return,
+    }
+    payload.update(fields)
+    return payload
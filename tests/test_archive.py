@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as journal
+from conftest import trade_payload
+
+START = datetime(2024, 1, 1)
+HORIZON = datetime(2025, 1, 1)
+
+
+def _add_closed_trades(client, count=10):
+    for day in range(count):
+        entered = START + timedelta(days=day)
+        exited = (entered + timedelta(hours=2)).strftime('%Y-%m-%dT%H:%M:%S')
+        payload = trade_payload(entered, 10 if day % 3 else -5, date_exited=exited, post_trade_notes=f'note {day}')
+        assert client.post('/add_trade', json=payload).status_code == 201
+
+
+@pytest.fixture
+def archived(client, monkeypatch):
+    """Ten closed trades on the default account, the first eight (two checkpoint intervals) archived."""
+    monkeypatch.setattr(journal, 'CHECKPOINT_INTERVAL', 4)
+    _add_closed_trades(client)
+    with journal.app.app_context():
+        assert journal.archive_trades(journal.DEFAULT_ACCOUNT_ID, HORIZON) == 8
+    return client
+
+
+def _listed_ids(client):
+    response = client.get('/get_trades?include_archived=1')
+    assert response.status_code == 200
+    return [trade['id'] for trade in response.get_json()]
+
+
+def test_new_trades_never_reuse_archived_ids(archived):
+    # With both hot trades gone the trade table is empty, so its own MAX(id) would hand out id 1 again
+    for trade_id in (9, 10):
+        assert archived.delete(f'/delete_trade/{trade_id}').status_code == 200
+    single = archived.post('/add_trade', json=trade_payload(START + timedelta(days=20), 5)).get_json()['trade_id']
+    batch = archived.post('/add_trade', json=[trade_payload(START + timedelta(days=21 + day), 5) for day in range(2)])
+    assert batch.status_code == 201
+    assert single > 8 and min(batch.get_json()['trade_ids']) > single
+
+    ids = _listed_ids(archived)
+    assert len(ids) == len(set(ids)) == 11
+
+
+def _counts():
+    with journal.app.app_context():
+        session = journal.db.session
+        return (session.query(journal.Trade).count(), session.query(journal.TradeHistory).count(),
+                session.execute(journal.text("SELECT COUNT(*) FROM archive.trade_archive")).scalar())
+
+
+def test_archiving_leaves_history_and_metrics_unchanged(client, monkeypatch):
+    monkeypatch.setattr(journal, 'CHECKPOINT_INTERVAL', 4)
+    _add_closed_trades(client)
+    metrics, listed = client.get('/metrics').get_json(), client.get('/get_trades?include_archived=1').get_json()
+
+    with journal.app.app_context():
+        assert journal.archive_trades(journal.DEFAULT_ACCOUNT_ID, HORIZON) == 8
+    assert _counts() == (2, 10, 8)
+    assert client.get('/metrics').get_json() == metrics
+    assert client.get('/get_trades?include_archived=1').get_json() == listed
+    with journal.app.app_context():
+        account = journal.db.session.get(journal.Account, journal.DEFAULT_ACCOUNT_ID)
+        assert journal.verify_metrics_aggregate(account)[1] == []
+
+
+def test_writes_inside_the_archived_history_are_refused(archived):
+    inside = START + timedelta(days=3)
+    assert archived.post('/add_trade', json=trade_payload(inside, 5)).status_code == 400
+    batch = archived.post('/add_trade', json=[trade_payload(inside, 5)]).get_json()
+    assert batch['trade_ids'] == [] and 'archived history' in batch['errors'][0]['error']
+    moved = archived.put('/update_trade/9', json={'date_entered': inside.strftime('%Y-%m-%dT%H:%M:%S')})
+    assert moved.status_code == 400
+    deposit = archived.post('/add_deposit', json={'amount': 100, 'date': inside.strftime('%Y-%m-%dT%H:%M:%S')})
+    assert deposit.status_code == 400
+    assert _counts() == (2, 10, 8)
+
+    # After the last archived trade is still writable
+    after = START + timedelta(days=8, hours=1)
+    assert archived.post('/add_trade', json=trade_payload(after, 5)).status_code == 201
+
+
+def test_an_interrupted_copy_is_invisible_and_purged(client, monkeypatch):
+    monkeypatch.setattr(journal, 'CHECKPOINT_INTERVAL', 4)
+    _add_closed_trades(client)
+
+    def interrupted():
+        raise RuntimeError("interrupted between copy and switch")
+    monkeypatch.setattr(journal, 'begin_chain_write', interrupted)
+    with journal.app.app_context(), pytest.raises(RuntimeError):
+        journal.archive_trades(journal.DEFAULT_ACCOUNT_ID, HORIZON)
+    monkeypatch.undo()
+    monkeypatch.setattr(journal, 'CHECKPOINT_INTERVAL', 4)
+
+    # The copied batch lies past the watermark: nothing reads it, and the trades are still hot
+    assert _counts() == (10, 10, 4)
+    assert len(_listed_ids(client)) == 10
+
+    with journal.app.app_context():
+        assert journal.archive_trades(journal.DEFAULT_ACCOUNT_ID, HORIZON) == 8
+    assert _counts() == (2, 10, 8)
+    assert sorted(_listed_ids(client)) == list(range(1, 11))
@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+
+import pyarrow.parquet as pq
+
+import app as journal
+import export
+from conftest import trade_payload
+
+
+def _export(tmp_path, incremental):
+    with journal.app.app_context(), journal.db.engine.connect() as connection, connection.begin():
+        return export.export_snapshot(connection.connection.driver_connection, str(tmp_path), 'parquet', incremental)
+
+
+def _exported_ids(tmp_path, manifest, table='trade'):
+    snapshot = f"{manifest['kind']}-{datetime.fromisoformat(manifest['watermark']).strftime('%Y%m%dT%H%M%S%f')}"
+    return sorted(pq.read_table(tmp_path / snapshot / manifest['tables'][table]['file']).column('id').to_pylist())
+
+
+def test_a_row_committed_after_the_watermark_it_predates_is_exported_next_time(client, tmp_path):
+    assert client.post('/add_trade', json=trade_payload(datetime(2024, 1, 1), 10)).status_code == 201
+    full = _export(tmp_path, incremental=False)
+    assert _exported_ids(tmp_path, full) == [1]
+
+    # Stamped before the full export's watermark, but committed only after that export read
+    assert client.post('/add_trade', json=trade_payload(datetime(2024, 1, 2), 10)).status_code == 201
+    stamped = datetime.fromisoformat(full['watermark']) - timedelta(seconds=5)
+    with journal.app.app_context():
+        trade = journal.Trade.__table__
+        journal.db.session.execute(journal.update(trade).where(trade.c.id == 2).values(updated_at=stamped))
+        journal.db.session.commit()
+
+    incremental = _export(tmp_path, incremental=True)
+    assert incremental['kind'] == 'incremental'
+    since = datetime.fromisoformat(full['watermark']) - export.WRITE_TRANSACTION_LAG
+    assert datetime.fromisoformat(incremental['since']) == since
+    assert 2 in _exported_ids(tmp_path, incremental)
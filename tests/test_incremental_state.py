@@ -0,0 +1,132 @@
+"""Incrementally maintained state must match a rebuild from the base tables after random edits.
+
+Covers the balance chain and account heads, balance checkpoints, the daily balance log, the
+P&L rollups and the metrics aggregate, across appends, back-dated and batched trades, edits,
+deletes and cash flows on two accounts.
+"""
+import math
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as journal
+from conftest import trade_payload
+
+START = datetime(2024, 1, 1)
+STEPS = 150
+CHECK_EVERY = 15
+
+
+def _close(expected, actual):
+    if isinstance(expected, float) or isinstance(actual, float):
+        return actual is not None and expected is not None and math.isclose(expected, actual, rel_tol=1e-9, abs_tol=1e-6)
+    if isinstance(expected, (list, tuple)):
+        return len(expected) == len(actual) and all(_close(e, a) for e, a in zip(expected, actual))
+    if isinstance(expected, dict):
+        return expected.keys() == actual.keys() and all(_close(expected[k], actual[k]) for k in expected)
+    return expected == actual
+
+
+def _snapshot():
+    session = journal.db.session
+    return {
+        'trades': [tuple(row) for row in session.query(
+            journal.Trade.id, journal.Trade.account_balance, journal.Trade.cumulative_pnl,
+            journal.Trade.account_change_percentage).order_by(journal.Trade.id)],
+        'heads': [(a.id, a.head_balance, a.head_pnl, a.head_ts, a.head_trades)
+                  for a in journal.Account.query.order_by(journal.Account.id)],
+        'checkpoints': [(c.account_id, c.trade_count, c.ts, c.trade_id, c.balance, c.cumulative_pnl)
+                        for c in journal.BalanceCheckpoint.query.order_by(journal.BalanceCheckpoint.account_id,
+                                                                          journal.BalanceCheckpoint.trade_count)],
+        'balance_log': [(b.account_id, b.date, b.balance)
+                        for b in journal.AccountBalanceLog.query.order_by(journal.AccountBalanceLog.account_id,
+                                                                          journal.AccountBalanceLog.date)],
+        'rollups': [(r.account_id, r.period, r.period_start, r.pnl, r.trade_count, r.wins, r.losses, r.gross_profit,
+                     r.gross_loss, r.deposits, r.withdrawals, r.closing_balance)
+                    for r in journal.PnlRollup.query.order_by(journal.PnlRollup.account_id, journal.PnlRollup.period,
+                                                              journal.PnlRollup.period_start)],
+        'metrics': [journal.aggregate_metrics(a) for a in journal.Account.query.order_by(journal.Account.id)],
+    }
+
+
+def _assert_matches_rebuild():
+    with journal.app.app_context():
+        session = journal.db.session
+        incremental = _snapshot()
+        for account in journal.Account.query.all():
+            _, mismatches = journal.verify_metrics_aggregate(account)
+            assert mismatches == [], f"account {account.id}: {mismatches}"
+
+        for account in journal.Account.query.all():
+            journal.rechain(account)
+            journal.rebuild_metrics_aggregate(account.id)
+        journal.rebuild_rollups()
+        session.flush()
+        session.expire_all()
+        rebuilt = _snapshot()
+        session.rollback()
+
+    for key, expected in rebuilt.items():
+        assert _close(expected, incremental[key]), f"{key} differs from a rebuild"
+
+
+def _random_trade(rng, account_id, latest):
+    # Mostly appends, some back-dated into the existing history
+    if rng.random() < 0.75:
+        ts = latest + timedelta(hours=rng.randint(1, 40))
+    else:
+        ts = START + timedelta(hours=rng.randint(0, max(int((latest - START).total_seconds() // 3600), 1)))
+    result = round(rng.uniform(-30, 40), 2)
+    return ts, trade_payload(ts, result, actual_return=round(rng.uniform(-3, 4), 2), account_id=account_id,
+                             market_id=rng.choice((1, 2)), trade_setup_id=rng.choice((1, 2)))
+
+
+def _trade_ids(account_id):
+    with journal.app.app_context():
+        return [trade_id for (trade_id,) in journal.db.session.query(journal.Trade.id)
+                .filter(journal.Trade.account_id == account_id)]
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_random_edits_match_a_rebuild(client, monkeypatch, seed):
+    # A small interval so checkpoints are added, rewritten and dropped throughout
+    monkeypatch.setattr(journal, 'CHECKPOINT_INTERVAL', 4)
+    rng = random.Random(seed)
+    assert client.post('/accounts', json={'name': 'Second', 'starting_balance': 5000}).status_code == 201
+    latest = {1: START, 2: START}
+
+    for step in range(1, STEPS + 1):
+        account_id = rng.choice((1, 2))
+        action = rng.random()
+        if action < 0.4:
+            ts, payload = _random_trade(rng, account_id, latest[account_id])
+            latest[account_id] = max(latest[account_id], ts)
+            assert client.post('/add_trade', json=payload).status_code == 201
+        elif action < 0.5:
+            batch = [_random_trade(rng, account_id, latest[account_id]) for _ in range(rng.randint(2, 6))]
+            latest[account_id] = max([latest[account_id]] + [ts for ts, _ in batch])
+            response = client.post(f'/add_trade?account_id={account_id}', json=[payload for _, payload in batch])
+            assert response.status_code == 201
+        elif action < 0.7:
+            trade_ids = _trade_ids(account_id)
+            if trade_ids:
+                changes = {'result': round(rng.uniform(-30, 40), 2), 'actual_return': round(rng.uniform(-3, 4), 2)}
+                if rng.random() < 0.5:
+                    moved = START + timedelta(hours=rng.randint(0, int((latest[account_id] - START).total_seconds() // 3600) + 1))
+                    changes['date_entered'] = moved.strftime('%Y-%m-%dT%H:%M:%S')
+                assert client.put(f'/update_trade/{rng.choice(trade_ids)}', json=changes).status_code == 200
+        elif action < 0.85:
+            trade_ids = _trade_ids(account_id)
+            if trade_ids:
+                assert client.delete(f'/delete_trade/{rng.choice(trade_ids)}').status_code == 200
+        else:
+            ts = START + timedelta(hours=rng.randint(0, int((latest[account_id] - START).total_seconds() // 3600) + 1),
+                                   minutes=30)
+            route, amount = ('/add_deposit', 200) if rng.random() < 0.6 else ('/add_withdrawal', 25)
+            response = client.post(route, json={'account_id': account_id, 'amount': amount,
+                                                'date': ts.strftime('%Y-%m-%dT%H:%M:%S')})
+            assert response.status_code in (200, 400)  # a withdrawal may overdraw the balance at its date
+
+        if step % CHECK_EVERY == 0:
+            _assert_matches_rebuild()
@@ -0,0 +1,138 @@
+import math
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as journal
+import ledger
+from conftest import trade_payload
+
+START = datetime(2024, 1, 1)
+YEAR_END = datetime(2025, 1, 1)  # 366 days after START
+
+
+def _account(client, starting_balance):
+    response = client.post('/accounts', json={'name': f'Ledger {starting_balance}', 'starting_balance': starting_balance})
+    assert response.status_code == 201
+    return response.get_json()['account_id']
+
+
+def _trade(client, account_id, ts, result):
+    assert client.post('/add_trade', json=trade_payload(ts, result, account_id=account_id)).status_code == 201
+
+
+def _flow(client, account_id, ts, amount):
+    route = '/add_deposit' if amount > 0 else '/add_withdrawal'
+    response = client.post(route, json={'account_id': account_id, 'amount': abs(amount),
+                                        'date': ts.strftime('%Y-%m-%dT%H:%M:%S')})
+    assert response.status_code == 200
+
+
+def _returns(client, account_id, start=START, end=YEAR_END):
+    response = client.get(f'/ledger/returns?account_id={account_id}&start={start.isoformat()}&end={end.isoformat()}')
+    assert response.status_code == 200
+    return response.get_json()
+
+
+@pytest.mark.parametrize('flows, rate', [
+    ([(0.0, -100), (1.0, 110)], 0.1),
+    ([(0.0, -100), (2.0, 121)], 0.1),
+    ([(0.0, -100), (0.5, 50), (1.0, 50)], 0.0),
+    ([(0.0, -100), (1.0, 50)], -0.5),
+])
+def test_irr_of_hand_computed_flows(flows, rate):
+    assert ledger.irr(flows) == pytest.approx(rate, abs=1e-9)
+
+
+@pytest.mark.parametrize('flows', [
+    [(0.0, -1000), (0.5, -500)],
+    [(0.0, 1000), (1.0, 500)],
+    [(1.0, 0.0)],
+])
+def test_irr_without_a_sign_change_is_none(flows):
+    assert ledger.irr(flows) is None
+
+
+def test_a_mid_period_deposit_moves_mwr_but_not_twr(client):
+    account_id = _account(client, 1000)
+    _trade(client, account_id, START + timedelta(days=30), 100)  # +10% on 1000
+    _flow(client, account_id, datetime(2024, 7, 1), 900)  # day 182
+    _trade(client, account_id, datetime(2024, 9, 1), 200)  # +10% on 2000
+    result = _returns(client, account_id)
+
+    assert (result['opening_balance'], result['closing_balance']) == (1000, 2200)
+    assert (result['trading_pnl'], result['deposits'], result['trades'], result['transactions']) == (300, 900, 2, 1)
+    assert result['time_weighted_return'] == pytest.approx(1.1 * 1.1 - 1)
+
+    # -1000 at the start, -900 on day 182 and +2200 on day 366 discount to zero at the MWR
+    years = 366 / ledger.DAYS_PER_YEAR
+    rate = result['money_weighted_return_annualized']
+    npv = -1000 - 900 * (1 + rate) ** -(182 / ledger.DAYS_PER_YEAR) + 2200 * (1 + rate) ** -years
+    assert npv == pytest.approx(0, abs=1e-6)
+    assert result['money_weighted_return'] == pytest.approx((1 + rate) ** years - 1)
+    # The deposit earned only the second trade, so per dollar the money did worse than the strategy
+    assert 0 < result['money_weighted_return'] < result['time_weighted_return']
+
+
+def test_a_flow_at_a_trades_timestamp_comes_first(client):
+    account_id = _account(client, 1000)
+    moment = datetime(2024, 3, 1, 12)
+    _trade(client, account_id, moment, 200)
+    _flow(client, account_id, moment, 1000)
+
+    entries = client.get(f'/ledger?account_id={account_id}').get_json()['entries']
+    assert [(entry['type'], entry['balance']) for entry in entries] == [('deposit', 2000), ('trade', 2200)]
+    # The trade's return is measured on the balance after the deposit: 200 on 2000, not on 1000
+    assert _returns(client, account_id)['time_weighted_return'] == pytest.approx(0.1)
+
+
+def test_no_capital_gives_no_money_weighted_return(client):
+    account_id = _account(client, 0)
+    result = _returns(client, account_id)
+    assert result['money_weighted_return_annualized'] is None and result['money_weighted_return'] is None
+
+
+def test_two_year_growth_annualizes(client):
+    account_id = _account(client, 1000)
+    _trade(client, account_id, datetime(2024, 6, 1), 210)
+    end = START + timedelta(days=round(2 * ledger.DAYS_PER_YEAR))
+    result = _returns(client, account_id, end=end)
+    years = (end - START).days / ledger.DAYS_PER_YEAR
+    assert result['money_weighted_return_annualized'] == pytest.approx(1.21 ** (1 / years) - 1)
+    assert result['time_weighted_return_annualized'] == pytest.approx(1.21 ** (1 / years) - 1)
+
+
+def test_paging_matches_one_pass(client, monkeypatch):
+    monkeypatch.setattr(journal, 'CHECKPOINT_INTERVAL', 4)
+    account_id = _account(client, 1000)
+    for day in range(14):
+        entered = START + timedelta(days=day)
+        exited = (entered + timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%S')
+        payload = trade_payload(entered, 15 if day % 4 else -10, account_id=account_id, date_exited=exited)
+        assert client.post('/add_trade', json=payload).status_code == 201
+    # Flows between trades and on their timestamps, on both sides of the archive boundary
+    for day in (8, 9, 10):
+        _flow(client, account_id, START + timedelta(days=day), 50)
+    _flow(client, account_id, START + timedelta(days=10, hours=6), -20)
+    _flow(client, account_id, START + timedelta(days=13), 5)
+    with journal.app.app_context():
+        assert journal.archive_trades(account_id, YEAR_END) == 12
+
+    full = client.get(f'/ledger?account_id={account_id}&limit=1000').get_json()
+    assert full['next_cursor'] is None and len(full['entries']) == 19
+
+    for limit in (1, 2, 3, 5):
+        paged, cursor = [], None
+        while True:
+            url = f'/ledger?account_id={account_id}&limit={limit}' + (f'&cursor={cursor}' if cursor else '')
+            page = client.get(url).get_json()
+            if paged:
+                assert page['opening_balance'] == pytest.approx(paged[-1]['balance'])
+            paged += page['entries']
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        assert paged == full['entries'], f"limit={limit}"
+
+    last = full['entries'][-1]
+    assert math.isclose(last['balance'], 1000 + 10 * 15 - 4 * 10 + 150 - 20 + 5)
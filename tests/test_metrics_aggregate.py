@@ -0,0 +1,44 @@
+from datetime import datetime
+
+import pytest
+
+import app as journal
+from conftest import trade_payload
+
+
+def _metrics(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def _assert_matches_scan():
+    with journal.app.app_context():
+        account = journal.db.session.get(journal.Account, journal.DEFAULT_ACCOUNT_ID)
+        _, mismatches = journal.verify_metrics_aggregate(account)
+    assert mismatches == []
+
+
+@pytest.mark.parametrize('results, edited, field, expected', [
+    ((10, 100), 20, 'largest_win', 20),
+    ((-10, -100), -20, 'largest_loss', -20),
+])
+def test_editing_the_extreme_trade_rereads_it(client, results, edited, field, expected):
+    trade_ids = [client.post('/add_trade', json=trade_payload(datetime(2024, 1, day + 1), result)).get_json()['trade_id']
+                 for day, result in enumerate(results)]
+    assert _metrics(client)[field] == results[1]
+
+    response = client.put(f'/update_trade/{trade_ids[1]}', json={'result': edited, 'actual_return': edited})
+    assert response.status_code == 200
+    assert _metrics(client)[field] == expected
+    _assert_matches_scan()
+
+
+def test_deleting_the_extreme_trade_rereads_it(client):
+    trade_ids = [client.post('/add_trade', json=trade_payload(datetime(2024, 1, day + 1), result)).get_json()['trade_id']
+                 for day, result in enumerate((10, 100, -50))]
+    assert client.delete(f'/delete_trade/{trade_ids[1]}').status_code == 200
+    assert client.delete(f'/delete_trade/{trade_ids[2]}').status_code == 200
+    metrics = _metrics(client)
+    assert (metrics['largest_win'], metrics['largest_loss']) == (10, 10)
+    _assert_matches_scan()
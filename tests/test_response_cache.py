@@ -0,0 +1,131 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as journal
+from conftest import trade_payload
+
+START = datetime(2024, 1, 1)
+
+
+def _get(client, url, etag=None):
+    response = client.get(url, headers={'If-None-Match': etag} if etag else {})
+    assert response.status_code in (200, 304)
+    # Reading a streamed body to the end ends its read transaction, as a real client would
+    response.get_data()
+    response.close()
+    return response
+
+
+def _add_trade(client, day=0, result=10, **fields):
+    response = client.post('/add_trade', json=trade_payload(START + timedelta(days=day), result, **fields))
+    assert response.status_code == 201
+    return response.get_json()['trade_id']
+
+
+def test_a_repeated_get_with_its_etag_is_not_modified(client):
+    _add_trade(client)
+    first = _get(client, '/metrics')
+    assert first.status_code == 200 and first.get_json()['total_trades'] == 1
+    etag = first.headers['ETag'].strip('"')
+
+    repeated = _get(client, '/metrics', etag)
+    assert repeated.status_code == 304 and repeated.data == b''
+    assert repeated.headers['ETag'] == first.headers['ETag']
+    # A stale tag gets the full body again
+    assert _get(client, '/metrics', 'stale').status_code == 200
+
+
+def _import(client):
+    body = '\n'.join(json.dumps(trade_payload(START + timedelta(days=40 + day), 5)) for day in range(3))
+    response = client.post('/import_trades?source=cache-test&format=ndjson', data=body,
+                           content_type='application/x-ndjson')
+    assert response.status_code in (200, 201)
+
+
+def _archive(client):
+    with journal.app.app_context():
+        assert journal.archive_trades(journal.DEFAULT_ACCOUNT_ID, datetime(2025, 1, 1)) > 0
+
+
+def _flow(route, amount, day=30):
+    def write(client):
+        date = (START + timedelta(days=day)).strftime('%Y-%m-%dT%H:%M:%S')
+        response = client.post(route, json={'amount': amount, 'date': date})
+        assert response.status_code == 200
+    return write
+
+
+WRITES = {
+    'add trade': lambda client: _add_trade(client, day=30, result=-20),
+    'add trade batch': lambda client: client.post('/add_trade', json=[trade_payload(START + timedelta(days=31), 7)]),
+    'back-dated trade': lambda client: _add_trade(client, day=0, result=3, asset='GBPUSD'),
+    'update trade': lambda client: client.put('/update_trade/2', json={'result': 50, 'actual_return': 5}),
+    'delete trade': lambda client: client.delete('/delete_trade/2'),
+    'import': _import,
+    'archive': _archive,
+    'deposit': _flow('/add_deposit', 100),
+    'withdrawal': _flow('/add_withdrawal', 10),
+    'back-dated deposit': _flow('/add_deposit', 100, day=3),
+    'set risk': lambda client: client.post('/set_risk', json={'risk_percentage': 0.5}),
+    'add market': lambda client: client.post('/add_market', json={'name': 'Crypto'}),
+    'delete market': lambda client: client.delete('/delete_market?id=2'),
+    'add setup': lambda client: client.post('/add_trade_setup', json={'name': 'Range', 'description': 'Range'}),
+    'delete setup': lambda client: client.delete('/delete_trade_setup?id=2'),
+}
+
+# Each write against cached GETs that depend on what it changes, or that must not notice it
+CASES = [
+    ('add trade', ['/get_trades', '/metrics', '/ledger', '/equity_curve', '/accounts', '/calendar'], ['/get_markets']),
+    ('add trade batch', ['/get_trades', '/metrics', '/analytics', '/accounts'], ['/get_transactions']),
+    ('back-dated trade', ['/get_trades', '/ledger', '/balance_as_of?at=2024-01-05'], ['/get_trade_setups']),
+    ('update trade', ['/get_trades', '/metrics', '/search_trades?q=EURUSD', '/ledger/returns'], ['/get_markets']),
+    ('delete trade', ['/get_trades', '/metrics', '/ledger'], ['/get_transactions']),
+    ('import', ['/get_trades', '/metrics', '/accounts'], ['/get_markets']),
+    ('archive', ['/get_trades?include_archived=1', '/accounts'], ['/get_transactions']),
+    ('deposit', ['/get_transactions', '/ledger', '/metrics', '/equity_curve', '/accounts'], ['/analytics']),
+    ('withdrawal', ['/get_transactions', '/balance_between?start=2024-01-01&end=2024-02-01'], ['/get_trades']),
+    # Trades after a back-dated flow are relinked onto the new balances
+    ('back-dated deposit', ['/get_transactions', '/get_trades', '/analytics', '/ledger'], ['/get_markets']),
+    ('set risk', ['/accounts'], ['/get_trades']),
+    ('add market', ['/get_markets', '/get_trades', '/metrics'], ['/ledger']),
+    ('delete market', ['/get_markets', '/get_trades'], ['/get_transactions']),
+    ('add setup', ['/get_trade_setups', '/analytics'], ['/ledger']),
+    ('delete setup', ['/get_trade_setups', '/get_trades'], ['/equity_curve']),
+]
+
+
+@pytest.mark.parametrize('write, dependent, independent', CASES, ids=[case[0] for case in CASES])
+def test_a_write_changes_the_etag_of_every_dependent_response(client, monkeypatch, write, dependent, independent):
+    monkeypatch.setattr(journal, 'CHECKPOINT_INTERVAL', 4)
+    for day in range(8):
+        exited = (START + timedelta(days=day, hours=1)).strftime('%Y-%m-%dT%H:%M:%S')
+        _add_trade(client, day=day, result=10 if day % 2 else -5, date_exited=exited)  # market 2 and setup 2 stay unused
+    before = {url: _get(client, url) for url in dependent + independent}
+    for url in dependent + independent:
+        assert _get(client, url).headers['ETag'] == before[url].headers['ETag']
+
+    WRITES[write](client)
+
+    for url in dependent:
+        after = _get(client, url, before[url].headers['ETag'].strip('"'))
+        assert after.status_code == 200, f"{url} still answered 304 after '{write}'"
+        assert after.headers['ETag'] != before[url].headers['ETag']
+    for url in independent:
+        assert _get(client, url, before[url].headers['ETag'].strip('"')).status_code == 304, url
+
+
+def test_the_query_string_is_part_of_the_key(client):
+    _add_trade(client, market_id=1)
+    _add_trade(client, day=1, market_id=2, asset='DAX')
+    fx, indices = _get(client, '/get_trades?market_id=1'), _get(client, '/get_trades?market_id=2')
+    assert fx.headers['ETag'] != indices.headers['ETag']
+    assert [trade['asset'] for trade in fx.get_json()] == ['EURUSD']
+    assert [trade['asset'] for trade in indices.get_json()] == ['DAX']
+
+    # Each variant is cached and served on its own
+    for url, expected in (('/metrics?account_id=1', 2), ('/metrics', 2)):
+        assert _get(client, url).get_json()['total_trades'] == expected
+    assert {'/metrics?account_id=1', '/metrics?'} <= set(journal.response_cache.entries)
+    assert _get(client, '/get_trades?market_id=1', indices.headers['ETag'].strip('"')).status_code == 200
@@ -0,0 +1,26 @@
+import json
+from datetime import datetime
+
+import app as journal
+from conftest import trade_payload
+
+
+def _last_event():
+    with journal.app.app_context():
+        event = journal.StreamEvent.query.order_by(journal.StreamEvent.id.desc()).first()
+        return event.type, json.loads(event.data)
+
+
+def test_trade_events_carry_the_rows_and_account_state(client):
+    trade_ids = [client.post('/add_trade', json=trade_payload(datetime(2024, 1, day), result)).get_json()['trade_id']
+                 for day, result in ((1, 40), (2, -15))]
+    event_type, data = _last_event()
+    assert event_type == 'trades_added'
+    assert [trade['id'] for trade in data['trades']] == [trade_ids[1]]
+    assert data['balance'] == 1025 and data['metrics']['total_trades'] == 2
+
+    assert client.delete(f'/delete_trade/{trade_ids[0]}').status_code == 200
+    event_type, data = _last_event()
+    assert event_type == 'trade_deleted'
+    assert data['trade']['id'] == trade_ids[0] and data['trade']['account_change'] == 40
+    assert data['balance'] == 985 and data['metrics']['total_trades'] == 1